@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Bulk indexing of documents through the Kibana console proxy (/_bulk).
+Documents are serialized to NDJSON with orjson and sent in batches, flushed by document count or body size.
+Only the failed items of a batch are retried; batches can be sent in parallel.
+"""
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import orjson
+import requests
+
+
+def jsonDefault(obj):
+    """
+    序列化 orjson 不支持的类型 (psycopg 返回的 Decimal 等)
+    :param obj: 对象
+    :return: Decimal 转为 float, 其他类型转为字符串
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+class BulkIndexer(object):
+    # retry the items rejected because of back pressure or server errors, the others will fail again
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, url: str, sess: requests.Session, max_docs: int=1000, max_bytes: int=5 * 1024 * 1024, workers: int=1, max_retries: int=3):
+        """
+        :param url: Kibana console proxy, e.g. http://localhost:5601/api/console/proxy
+        :param sess: requests.Session with auth and kbn-xsrf header
+        :param max_docs: 每批最多文档数
+        :param max_bytes: 每批请求体最大字节数
+        :param workers: 并行发送的批次数
+        :param max_retries: 失败条目的最大重试次数
+        """
+        self.url = url
+        self.sess = sess
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.workers = workers
+        self.futures = deque()
+        self.lines = [] # [(action, source), ...]
+        self.size = 0
+        self.stats = {'indexed': 0, 'failed': 0, 'requests': 0}
+        self.lock = threading.Lock()
+
+    def add(self, index_name: str, doc_id: str, data: dict) -> None:
+        """
+        添加一个文档 (index, 存在则覆盖), 达到 max_docs 或 max_bytes 时自动发送
+        :param index_name: 索引名
+        :param doc_id: 文档 ID
+        :param data: 文档内容
+        :return: None
+        """
+        action = orjson.dumps({'index': {'_index': index_name, '_id': str(doc_id)}})
+        source = orjson.dumps(data, default=jsonDefault)
+        size = len(action) + len(source) + 2
+        if self.lines and self.size + size > self.max_bytes:
+            self.send()
+        self.lines.append((action, source))
+        self.size += size
+        if len(self.lines) >= self.max_docs:
+            self.send()
+        return None
+
+    def send(self) -> None:
+        """
+        发送当前批次 (并行模式下提交到线程池, 在途批次数有上限)
+        :return: None
+        """
+        if not self.lines:
+            return None
+        lines, self.lines, self.size = self.lines, [], 0
+        if self.executor is None:
+            self.sendBatch(lines)
+            return None
+        while len(self.futures) >= self.workers * 2:
+            self.futures.popleft().result()
+        self.futures.append(self.executor.submit(self.sendBatch, lines))
+        return None
+
+    def postBulk(self, lines: list) -> dict:
+        """
+        发送一次 /_bulk 请求, 需要重试的整批失败 (如 429) 转换为每个条目的失败状态
+        :param lines: [(action, source), ...]
+        :return: /_bulk 接口的返回结果
+        """
+        params = {
+            'path': '/_bulk',
+            'method': 'POST'
+        }
+        body = b''.join([action + b'\n' + source + b'\n' for action, source in lines])
+        headers = {'Content-Type': 'application/x-ndjson'}
+        with self.lock:
+            self.stats['requests'] += 1
+        resp = self.sess.post(self.url, params=params, data=body, headers=headers, timeout=(10, 120))
+        if resp.status_code in self.RETRY_STATUS:
+            return {'errors': True, 'items': [{'index': {'status': resp.status_code}}] * len(lines)}
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
+
+    def sendBatch(self, lines: list) -> int:
+        """
+        发送一个批次, 只重试失败的条目
+        :param lines: [(action, source), ...]
+        :return: 写入成功的文档数
+        """
+        indexed = failed = 0
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            try:
+                result = self.postBulk(lines)
+            except:
+                traceback.print_exc()
+                continue # the whole batch is retried
+            items = result.get('items', [])
+            # a truncated response: the actions without a result are retried, not lost
+            retry = lines[len(items):]
+            if retry:
+                print(f'bulk index: {len(items)} results for {len(lines)} documents, {len(retry)} documents will be retried')
+            for line, item in zip(lines, items):
+                info = next(iter(item.values()))
+                status = info.get('status', 0)
+                if 200 <= status < 300:
+                    indexed += 1
+                elif status in self.RETRY_STATUS:
+                    retry.append(line)
+                else:
+                    failed += 1
+                    print(f'bulk index failed: {line[0].decode("utf-8")} {info.get("error")}')
+            lines = retry
+            if not lines:
+                break
+        if lines:
+            failed += len(lines)
+            print(f'bulk index failed: {len(lines)} documents after {self.max_retries} retries')
+        with self.lock:
+            self.stats['indexed'] += indexed
+            self.stats['failed'] += failed
+        return indexed
+
+    def flush(self) -> dict:
+        """
+        发送剩余文档, 并等待所有批次完成
+        :return: 统计信息字典
+        """
+        self.send()
+        while self.futures:
+            self.futures.popleft().result()
+        return self.stats
+
+    def close(self) -> dict:
+        """
+        发送剩余文档, 等待所有批次完成并关闭线程池
+        :return: 统计信息字典
+        """
+        stats = self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+        return stats
+
+
+if __name__ == '__main__':
+    pass
@@ -9,6 +9,7 @@ import requests
 sys.path.insert(0, abspath(join(dirname(__file__), '../../package')))
 
 from baidu_tongji import BaiduTongji
+from bulk_indexer import BulkIndexer
 from utils import changeToUTC, loadConfig
 
 CONFIG = loadConfig()
@@ -32,6 +33,14 @@ class Kibana(object):
         self.sess.auth = requests.auth.HTTPBasicAuth(kb_username, kb_password)
         self.sess.headers.update({'kbn-xsrf': 'kibana'})
 
+    def getBulkIndexer(self, **kwargs) -> BulkIndexer:
+        """
+        获取使用同一 Kibana 连接的批量写入器
+        :param kwargs: BulkIndexer 的参数, 如 max_docs, workers
+        :return: BulkIndexer
+        """
+        return BulkIndexer(self.url, self.sess, **kwargs)
+
     def insertDocument(self, index_name: str, doc_id: str, data: dict) -> dict:
         params = {
             'path': f'/{index_name}/_doc/{doc_id}',
@@ -57,7 +66,7 @@ class Kibana(object):
         return result
 
 
-def saveToES(self, entity: dict) -> bool:
+def saveToES(indexer: BulkIndexer, entity: dict) -> bool:
     # index_name, doc_id, data
     doc_lits = [
         ('visitors', entity['visitor']['visitor_id'], entity['visitor']),
@@ -72,8 +81,7 @@ def saveToES(self, entity: dict) -> bool:
             for k, v in data.items():
                 if k in ['date_time', 'first_visit_time', 'last_visit_time', 'receive_time', 'session_start_time', 'start_time']:
                     data[k] = changeToUTC(v)
-            result = self.insertDocument(index_name, doc_id, data)
-            print(result)
+            indexer.add(index_name, doc_id, data) # sent in batches, see indexer.flush()
         except:
             print(f'insert or update {index_name}')
             traceback.print_exc()
@@ -83,6 +91,7 @@ def saveToES(self, entity: dict) -> bool:
 
 if __name__ == '__main__':
     kb = Kibana()
+    indexer = kb.getBulkIndexer(workers=2)
     bd = BaiduTongji(debug=debug)
 
     # query by visitor_id which "duration" is -10000 (visiting)
@@ -108,13 +117,14 @@ if __name__ == '__main__':
                 traceback.print_exc()
                 continue
             for item in result:
-                saveToES(kb, item)
+                saveToES(indexer, item)
 
     # fetch new data
     result = bd.fetchRealTimeData(site_id, page_size=page_size)
     l = len(result)
     for idx, item in enumerate(result):
         print(f'fetch new data - {idx+1}/{l}')
-        saveToES(kb, item)
+        saveToES(indexer, item)
+    print(indexer.close())
 
     print('done.')
\ No newline at end of file
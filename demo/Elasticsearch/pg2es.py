@@ -2,7 +2,14 @@
 # -*- coding:utf-8 -*-
 """"
 This script is used to insert data from PostgreSQL to Elasticsearch.
+
+Usage:
+    python3 pg2es.py # rows updated in the last 30 minutes
+    python3 pg2es.py --sync # rows updated since the last sync, the checkpoint of each table is saved in pg2es_checkpoint.json
+    python3 pg2es.py --sync --overlap 300 # re-read the rows updated in the 5 minutes before the checkpoint (late commits)
 """
+import argparse
+import os
 import sys
 import traceback
 from os.path import abspath, dirname, join
@@ -12,6 +19,8 @@ import requests
 
 sys.path.insert(0, abspath(join(dirname(__file__), '../../package')))
 
+import orjson
+from bulk_indexer import BulkIndexer
 from utils import changeToUTC, loadConfig
 
 CONFIG = loadConfig()
@@ -28,6 +37,10 @@ pg_password = CONFIG['postgresql']['password']
 conn = psycopg.connect(host=pg_host, port=pg_port, dbname=pg_dbname, user=pg_username, password=pg_password)
 cur = conn.cursor()
 
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+CHECKPOINT_PATH = f'{CURRENT_PATH}/pg2es_checkpoint.json'
+PRIMARY_KEYS = {'visitors': 'visitor_id', 'sessions': 'session_id', 'events': 'event_id'}
+
 
 # you could also use the Elasticsearch Python Client (https://github.com/elastic/elasticsearch-py), but it may take some time to configure.
 class Kibana(object):
@@ -38,6 +51,14 @@ class Kibana(object):
         self.sess.auth = requests.auth.HTTPBasicAuth(kb_username, kb_password)
         self.sess.headers.update({'kbn-xsrf': 'kibana'})
 
+    def getBulkIndexer(self, **kwargs) -> BulkIndexer:
+        """
+        获取使用同一 Kibana 连接的批量写入器
+        :param kwargs: BulkIndexer 的参数, 如 max_docs, workers
+        :return: BulkIndexer
+        """
+        return BulkIndexer(self.url, self.sess, **kwargs)
+
     def insertDocument(self, index_name: str, doc_id: str, data: dict) -> dict:
         params = {
             'path': f'/{index_name}/_doc/{doc_id}',
@@ -64,7 +85,7 @@ def getTableColumns(table_name: str) -> dict:
     template = {x[0]: x[1] for x in rows}
     return template
 
-def saveToES(self, index_name: str, data: dict) -> bool:
+def saveToES(indexer: BulkIndexer, index_name: str, data: dict) -> bool:
     if index_name == 'visitors':
         doc_id = data['visitor_id']
     elif index_name == 'sessions':
@@ -76,8 +97,7 @@ def saveToES(self, index_name: str, data: dict) -> bool:
         for k, v in data.items():
             if k in ['date_time', 'first_visit_time', 'last_visit_time', 'receive_time', 'session_start_time', 'start_time']:
                 data[k] = changeToUTC(v)
-        result = self.insertDocument(index_name, doc_id, data)
-        print(result)
+        indexer.add(index_name, doc_id, data) # sent in batches, see indexer.flush()
     except:
         print(f'insert or update {index_name}')
         traceback.print_exc()
@@ -85,20 +105,139 @@ def saveToES(self, index_name: str, data: dict) -> bool:
     return True
 
 
+def loadCheckpoint() -> dict:
+    """
+    读取各表的同步位置
+    :return: {table_name: [_updated_at, primary_key]}
+    """
+    if not os.path.exists(CHECKPOINT_PATH):
+        return {}
+    with open(CHECKPOINT_PATH, 'rb') as f:
+        return orjson.loads(f.read())
+
+def saveCheckpoint(checkpoint: dict) -> None:
+    """
+    保存同步进度, 先写入临时文件再替换
+    :param checkpoint: {table_name: [_updated_at, primary_key]}
+    :return: None
+    """
+    tmp_path = f'{CHECKPOINT_PATH}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(checkpoint, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, CHECKPOINT_PATH) # never leave a truncated checkpoint
+    return None
+
+def iterRows(q: str, params: tuple=(), chunk_size: int=5000):
+    """
+    使用服务端游标分批读取查询结果, 内存占用与结果集大小无关
+    读取完毕后提交事务; 出错或调用方提前停止 (关闭生成器) 时回滚, 不留下未结束的事务
+    :param q: 查询语句
+    :param params: 查询参数
+    :param chunk_size: 每批行数
+    :return: 生成器, 每次返回一批行
+    """
+    try:
+        with conn.cursor(name='pg2es') as named_cur:
+            named_cur.itersize = chunk_size
+            named_cur.execute(q, params)
+            while True:
+                rows = named_cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+    except BaseException: # including GeneratorExit
+        conn.rollback()
+        raise
+    conn.commit()
+
+def syncRecent(indexer: BulkIndexer, index_name: str, minutes: int=30, chunk_size: int=5000) -> int:
+    """
+    同步最近更新的数据
+    :param indexer: BulkIndexer
+    :param index_name: 表名 / 索引名
+    :param minutes: 时间范围 (分钟)
+    :param chunk_size: 每批行数
+    :return: 同步的行数
+    """
+    cloumns = getTableColumns(index_name)
+    q = f'''
+        SELECT {','.join(cloumns.keys())}
+        FROM {index_name}
+        WHERE _updated_at >= (NOW() - %s * INTERVAL '1 MINUTE')
+    '''
+    count = 0
+    for rows in iterRows(q, (minutes,), chunk_size):
+        for row in rows:
+            data = {k: v for k, v in zip(cloumns.keys(), row)}
+            saveToES(indexer, index_name, data)
+        count += len(rows)
+    return count
+
+def syncIncremental(indexer: BulkIndexer, index_name: str, checkpoint: dict, chunk_size: int=5000, lag: int=60, overlap: int=300) -> int:
+    """
+    从上次同步位置开始同步, 按 (_updated_at, 主键) 顺序读取 (使用 (_updated_at, 主键) 索引), 每批写入 Elasticsearch 后保存同步位置
+    _updated_at 为事务开始时间, 较晚提交的事务可能写入较早的时间, 所以只同步 lag 秒之前的数据,
+    并从同步位置之前 overlap 秒开始重新读取 (文档按主键写入, 重复写入不影响结果), 与 cron_jobs 相同
+    :param indexer: BulkIndexer
+    :param index_name: 表名 / 索引名
+    :param checkpoint: 各表的同步位置 [_updated_at, 主键], 会被更新
+    :param chunk_size: 每批行数
+    :param lag: 延迟 (秒)
+    :param overlap: 与上次同步重叠的秒数, 0 为从同步位置之后开始
+    :return: 同步的行数
+    """
+    cloumns = getTableColumns(index_name)
+    keys = list(cloumns.keys())
+    primary_key = PRIMARY_KEYS[index_name]
+    updated_at, last_key = checkpoint.get(index_name, ['1970-01-01 00:00:00', ''])
+    last_key = '' if overlap else last_key # with overlap, all the rows from (_updated_at - overlap)
+    q = f'''
+        SELECT {','.join(keys)}, _updated_at
+        FROM {index_name}
+        WHERE (_updated_at, {primary_key}) > ((%s::TIMESTAMP - %s * INTERVAL '1 SECOND'), %s)
+        AND _updated_at < (NOW() - %s * INTERVAL '1 SECOND')::TIMESTAMP
+        ORDER BY _updated_at, {primary_key}
+    '''
+    count = 0
+    batches = iterRows(q, (updated_at, overlap, last_key, lag), chunk_size)
+    try:
+        for rows in batches:
+            failed = indexer.stats['failed']
+            for row in rows:
+                data = {k: v for k, v in zip(keys, row)}
+                saveToES(indexer, index_name, data)
+            indexer.flush()
+            if indexer.stats['failed'] > failed:
+                print(f'{index_name}: {indexer.stats["failed"] - failed} documents failed, stop at {checkpoint.get(index_name)}')
+                break
+            last_row = rows[-1]
+            checkpoint[index_name] = [last_row[-1].strftime('%Y-%m-%d %H:%M:%S.%f'), str(last_row[keys.index(primary_key)])]
+            saveCheckpoint(checkpoint)
+            count += len(rows)
+    finally:
+        batches.close() # ends the transaction of the cursor when stopped early
+    return count
+
+
 if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Insert data from PostgreSQL to Elasticsearch.')
+    arg_parser.add_argument('--sync', action='store_true', help='sync the rows updated since the last sync (pg2es_checkpoint.json)')
+    arg_parser.add_argument('--minutes', type=int, default=30, help='without --sync, sync the rows updated in the last N minutes')
+    arg_parser.add_argument('--chunk-size', type=int, default=5000, help='rows fetched from the server-side cursor at a time')
+    arg_parser.add_argument('--lag', type=int, default=60, help='with --sync, skip the rows updated in the last N seconds (transactions still in progress)')
+    arg_parser.add_argument('--overlap', type=int, default=300, help='with --sync, re-read the rows updated N seconds before the checkpoint (committed late)')
+    args = arg_parser.parse_args()
+
     kb = Kibana()
+    indexer = kb.getBulkIndexer(workers=2)
+    checkpoint = loadCheckpoint()
 
     for index_name in ['visitors', 'sessions', 'events']:
-        cloumns = getTableColumns(index_name)
-        q = f'''
-            SELECT {','.join(cloumns.keys())}
-            FROM {index_name}
-            WHERE _updated_at >= (NOW() - INTERVAL '30 MINUTES') -- update the data in the last 30 minutes, you can change it to your own time range
-        '''
-        cur.execute(q)
-        rows = cur.fetchall()
-        for row in rows:
-            data = {k: v for k, v in zip(cloumns.keys(), row)}
-            saveToES(kb, index_name, data)
+        if args.sync:
+            count = syncIncremental(indexer, index_name, checkpoint, chunk_size=args.chunk_size, lag=args.lag, overlap=args.overlap)
+        else:
+            count = syncRecent(indexer, index_name, minutes=args.minutes, chunk_size=args.chunk_size)
+        print(f'{index_name}: {count} rows')
+    print(indexer.close())
 
-    print('done.')
\ No newline at end of file
+    print('done.')
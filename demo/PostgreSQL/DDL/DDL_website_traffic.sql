@@ -45,6 +45,8 @@ CREATE TABLE public.visitors (
 );
 CREATE INDEX visitors_first_visit_time_idx ON public.visitors USING brin (first_visit_time);
 CREATE INDEX visitors_last_visit_time_idx ON public.visitors USING brin (last_visit_time);
+CREATE INDEX visitors__updated_at_idx ON public.visitors USING brin (_updated_at);
+CREATE INDEX visitors__updated_at_pkey_idx ON public.visitors USING btree (_updated_at, visitor_id); -- pg2es --sync
 COMMENT ON TABLE public.visitors IS '访客表';
 
 -- Column comments
@@ -162,6 +164,8 @@ CREATE TABLE public.sessions (
 CREATE INDEX sessions_date_time_idx ON public.sessions USING brin (date_time);
 CREATE INDEX sessions_start_time_idx ON public.sessions USING brin (start_time);
 CREATE INDEX sessions_visitor_id_idx ON public.sessions USING hash (visitor_id);
+CREATE INDEX sessions__updated_at_idx ON public.sessions USING brin (_updated_at);
+CREATE INDEX sessions__updated_at_pkey_idx ON public.sessions USING btree (_updated_at, session_id); -- pg2es --sync
 COMMENT ON TABLE public.sessions IS '会话表';
 
 -- Column comments
@@ -326,6 +330,8 @@ CREATE INDEX events_receive_time_idx ON public.events USING brin (receive_time);
 CREATE INDEX events_session_id_idx ON public.events USING hash (session_id);
 CREATE INDEX events_session_start_time_idx ON public.events USING brin (session_start_time);
 CREATE INDEX events_visitor_id_idx ON public.events USING hash (visitor_id);
+CREATE INDEX events__updated_at_idx ON public.events USING brin (_updated_at);
+CREATE INDEX events__updated_at_pkey_idx ON public.events USING btree (_updated_at, event_id); -- pg2es --sync
 COMMENT ON TABLE public.events IS '事件表';
 
 -- Column comments
@@ -403,4 +409,17 @@ COMMENT ON COLUMN public.events._updated_at IS '更新时间';
 CREATE TRIGGER trigger_set_timestamp BEFORE
 UPDATE
     ON
-    public.events FOR EACH ROW EXECUTE FUNCTION trigger_set_timestamp();
\ No newline at end of file
+    public.events FOR EACH ROW EXECUTE FUNCTION trigger_set_timestamp();
+
+-- public._cron_checkpoint definition (cron_jobs.py --incremental)
+
+-- Drop table
+
+DROP TABLE IF EXISTS public._cron_checkpoint CASCADE;
+
+CREATE TABLE public._cron_checkpoint (
+    job_name varchar(64) NOT NULL, -- 任务名称
+    last_run timestamp(6) NOT NULL, -- 上次运行时间
+    CONSTRAINT _cron_checkpoint_pkey PRIMARY KEY (job_name)
+);
+COMMENT ON TABLE public._cron_checkpoint IS '定时任务运行记录';
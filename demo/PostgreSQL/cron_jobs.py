@@ -2,7 +2,13 @@
 # -*- coding:utf-8 -*-
 """"
 This script is designed to fix data errors and aggregate data in PostgreSQL.
+
+Usage:
+    python3 cron_jobs.py # scan the whole tables
+    python3 cron_jobs.py --incremental # only the sessions and visitors changed since the last run (_cron_checkpoint), cheap enough to run every few minutes
 """
+import argparse
+import datetime
 import sys
 from os.path import abspath, dirname, join
 
@@ -22,9 +28,14 @@ pg_username = CONFIG['postgresql']['username']
 pg_password = CONFIG['postgresql']['password']
 conn = psycopg.connect(host=pg_host, port=pg_port, dbname=pg_dbname, user=pg_username, password=pg_password)
 cur = conn.cursor()
+JOB_NAME = 'cron_jobs'
 
 
-if __name__ == '__main__':
+def runFull() -> None:
+    """
+    全表修正和汇总
+    :return: None
+    """
     # update event duration which "duration" is -20000 (unknown) and "receive_time" is older than 3 hours
     q = '''
         UPDATE events
@@ -150,6 +161,200 @@ if __name__ == '__main__':
     '''
     cur.execute(q)
     conn.commit()
+    return None
+
+def getCheckpoint():
+    """
+    获取上次增量运行时间
+    :return: datetime, 没有运行记录时为 None
+    """
+    q = '''
+        CREATE TABLE IF NOT EXISTS _cron_checkpoint (
+            job_name varchar(64) NOT NULL,
+            last_run timestamp(6) NOT NULL,
+            CONSTRAINT _cron_checkpoint_pkey PRIMARY KEY (job_name)
+        );
+    '''
+    cur.execute(q)
+    cur.execute('SELECT last_run FROM _cron_checkpoint WHERE job_name = %s', (JOB_NAME,))
+    row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+def saveCheckpoint(last_run) -> None:
+    """
+    保存本次运行的开始时间 (由调用方提交事务)
+    :param last_run: 本次运行的开始时间
+    :return: None
+    """
+    q = '''
+        INSERT INTO _cron_checkpoint (job_name, last_run)
+        VALUES (%s, %s)
+        ON CONFLICT (job_name) DO UPDATE
+        SET last_run = EXCLUDED.last_run
+    '''
+    cur.execute(q, (JOB_NAME, last_run))
+    return None
+
+def runIncremental(overlap: int=5) -> None:
+    """
+    增量修正和汇总: 只处理上次运行之后变化 (_updated_at) 的会话和访客, 以及在此期间超过 3 小时的事件
+    所有更新在一个事务中完成, 失败时回滚, 下次运行从同一位置重新开始
+    :param overlap: 与上次运行重叠的分钟数 (覆盖运行时尚未提交的写入)
+    :return: None
+    """
+    last_run = getCheckpoint()
+    if last_run is None:
+        # first run, scan the whole tables once
+        cur.execute('SELECT NOW()::TIMESTAMP')
+        start = cur.fetchone()[0]
+        conn.commit()
+        runFull()
+        saveCheckpoint(start)
+        conn.commit()
+        return None
+
+    cur.execute('SELECT NOW()::TIMESTAMP')
+    start = cur.fetchone()[0]
+    params = {'since': last_run - datetime.timedelta(minutes=overlap)}
+    try:
+        # events which became older than 3 hours since the last run, or were updated again since then
+        for duration in [-20000, -10000]:
+            q = '''
+                UPDATE events
+                SET duration = 1
+                WHERE duration = %(duration)s
+                AND receive_time < (NOW() - INTERVAL '3 HOURS')
+                AND (receive_time >= (%(since)s - INTERVAL '3 HOURS') OR _updated_at > %(since)s);
+            '''
+            cur.execute(q, {**params, 'duration': duration})
+
+        q = '''
+            UPDATE events e
+            SET is_session_end = TRUE
+            WHERE is_session_end = FALSE
+            AND next_event_id = ''
+            AND receive_time < (NOW() - INTERVAL '3 HOURS')
+            AND (receive_time >= (%(since)s - INTERVAL '3 HOURS') OR _updated_at > %(since)s);
+        '''
+        cur.execute(q, params)
+
+        # sessions changed since the last run (including the events updated above, the trigger sets _updated_at)
+        q = '''
+            CREATE TEMP TABLE _changed_sessions ON COMMIT DROP AS
+            SELECT session_id, visitor_id FROM sessions WHERE _updated_at > %(since)s
+            UNION
+            SELECT session_id, visitor_id FROM events WHERE _updated_at > %(since)s;
+        '''
+        cur.execute(q, params)
+        cur.execute('CREATE INDEX ON _changed_sessions (session_id)')
+        cur.execute('ANALYZE _changed_sessions')
+
+        q = '''
+            UPDATE sessions s
+            SET duration = (
+                SELECT COALESCE(SUM(duration), -20000)
+                FROM events
+                WHERE session_id = s.session_id
+                AND duration > 0
+            )
+            WHERE duration < 0
+            AND session_id IN (SELECT session_id FROM _changed_sessions);
+        '''
+        cur.execute(q)
+
+        q = '''
+            UPDATE sessions s
+            SET last_event_id = (
+                SELECT event_id
+                FROM events
+                WHERE session_id = s.session_id
+                ORDER BY date_time DESC
+                LIMIT 1
+            )
+            WHERE last_event_id = ''
+            AND duration > 0
+            AND session_id IN (SELECT session_id FROM _changed_sessions);
+        '''
+        cur.execute(q)
+
+        q = '''
+            UPDATE events t
+            SET is_session_end = FALSE
+            FROM sessions s
+            WHERE t.session_id = s.session_id
+            AND t.is_session_end = TRUE
+            AND t.event_id <> s.last_event_id
+            AND t.session_id IN (SELECT session_id FROM _changed_sessions);
+        '''
+        cur.execute(q)
+
+        # visitors of the changed sessions
+        q = '''
+            CREATE TEMP TABLE _changed_visitors ON COMMIT DROP AS
+            SELECT DISTINCT visitor_id FROM _changed_sessions;
+        '''
+        cur.execute(q)
+        cur.execute('ANALYZE _changed_visitors')
+
+        q = '''
+            WITH info AS (
+                SELECT visitor_id, ip, country, province, city
+                FROM (
+                SELECT visitor_id,
+                    ip,
+                    country,
+                    province,
+                    city,
+                    RANK() OVER (PARTITION BY visitor_id ORDER BY COUNT(*) DESC) AS rank_ip
+                FROM sessions
+                WHERE visitor_id IN (SELECT visitor_id FROM _changed_visitors)
+                GROUP BY visitor_id, ip, country, province, city
+                ) t1
+                WHERE t1.rank_ip = 1
+            )
+            UPDATE visitors v
+            SET hf_ip = info.ip, hf_country= info.country, hf_province= info.province, hf_city= info.city
+            FROM info
+            WHERE v.visitor_id = info.visitor_id;
+        '''
+        cur.execute(q)
+
+        q = '''
+            WITH info AS (
+                SELECT visitor_id,
+                    COUNT(*) AS frequency,
+                    SUM(GREATEST(duration, 0)) AS total_duration,
+                    SUM(visit_pages) AS total_visit_pages
+                FROM sessions
+                WHERE visitor_id IN (SELECT visitor_id FROM _changed_visitors)
+                GROUP BY visitor_id
+            )
+            UPDATE visitors v
+            SET frequency = info.frequency, total_duration = info.total_duration, total_visit_pages = info.total_visit_pages
+            FROM info
+            WHERE v.visitor_id = info.visitor_id;
+        '''
+        cur.execute(q)
+
+        saveCheckpoint(start)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    return None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Fix data errors and aggregate data in PostgreSQL.')
+    arg_parser.add_argument('--incremental', action='store_true', help='only process the rows changed since the last incremental run')
+    arg_parser.add_argument('--overlap', type=int, default=5, help='with --incremental, minutes of overlap with the last run')
+    args = arg_parser.parse_args()
+
+    if args.incremental:
+        runIncremental(overlap=args.overlap)
+    else:
+        runFull()
 
     cur.close()
     conn.close()
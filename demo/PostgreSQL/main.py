@@ -11,6 +11,7 @@ import psycopg
 sys.path.insert(0, abspath(join(dirname(__file__), '../../package')))
 
 from baidu_tongji import BaiduTongji
+from pg_sink import PGSink
 from utils import loadConfig, loadDimensions
 
 CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -26,53 +27,22 @@ pg_username = CONFIG['postgresql']['username']
 pg_password = CONFIG['postgresql']['password']
 conn = psycopg.connect(host=pg_host, port=pg_port, dbname=pg_dbname, user=pg_username, password=pg_password)
 cur = conn.cursor()
+sink = PGSink(conn)
 
 site_id = '16847648' # change to your site_id
 page_size = 100 # change page_size if you want, max is 1000
 debug = True # set debug=False if useing in production environment
 
 
-def getTableColumns(table_name: str) -> dict:
-    q = f'''
-        SELECT column_name, data_type
-        FROM information_schema.columns
-        WHERE table_schema = 'public'
-        AND table_name = '{table_name}'
-        AND column_name NOT LIKE '\_%'
-    '''
-    cur.execute(q)
-    rows = cur.fetchall()
-    template = {x[0]: x[1] for x in rows}
-    return template
-
 def saveToDB(entity: dict) -> bool:
-    # table_name, primary_key, data
-    record_list = [
-        ('visitors', 'visitor_id', entity['visitor']),
-        ('sessions', 'session_id', entity['session'])
-    ]
-    record_list.extend([('events', 'event_id', x) for x in entity['event_list']])
-
-    # insert or update records
-    for table_name, primary_key, data in record_list:
-        template = getTableColumns(table_name)
-        obj = {k: v for k, v in data.items() if k in template.keys()}
-        try:
-            q = f'''
-                INSERT INTO {table_name} ({','.join(obj.keys())})
-                VALUES ({','.join(['%s'] * len(obj))})
-                ON CONFLICT ({primary_key}) DO UPDATE
-                SET {','.join(['{}=EXCLUDED.{}'.format(k, k) for k in obj.keys()])}
-            '''
-            cur.execute(q, tuple(obj.values()))
-            conn.commit()
-        except Exception as e:
-            traceback.print_exc()
-            logging.error(e, exc_info=True)
-            conn.rollback()
-
+    # buffered, written in bulk by flush() (or when the batch is full)
+    sink.add(entity)
     return True
 
+def flush() -> bool:
+    # write the buffered entities, called after each page
+    return sink.flush()
+
 
 if __name__ == '__main__':
     # # truncate tables
@@ -98,6 +68,7 @@ if __name__ == '__main__':
             conn.commit()
         except:
             conn.rollback()
+    sink.reloadColumns()
 
     # query by visitor_id which "duration" is -10000 (visiting)
     # you can change the order by condition to get the latest data, or change the limit to get more data
@@ -123,13 +94,13 @@ if __name__ == '__main__':
             continue
         for item in result:
             saveToDB(item)
+    flush()
 
-    # fetch new data
-    result = bd.fetchRealTimeData(site_id, page_size=page_size)
-    l = len(result)
-    for idx, item in enumerate(result):
-        print(f'fetch new data - {idx+1}/{l}')
+    # fetch new data, save each session as soon as it is parsed
+    for idx, item in enumerate(bd.iterRealTimeData(site_id, page_size=page_size)):
+        print(f'fetch new data - {idx+1}')
         saveToDB(item)
+    flush()
 
     cur.close()
     conn.close()
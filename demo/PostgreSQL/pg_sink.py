@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Bulk upsert of visitors, sessions and events into PostgreSQL.
+Entities are buffered, then each table is loaded with COPY into a temporary staging table
+and merged with a single INSERT ... ON CONFLICT statement, all in one transaction.
+"""
+import logging
+import traceback
+
+import psycopg
+
+
+class PGSink(object):
+    # table_name, primary_key, entity key
+    TABLES = [
+        ('visitors', 'visitor_id', 'visitor'),
+        ('sessions', 'session_id', 'session'),
+        ('events', 'event_id', 'event_list')
+    ]
+
+    def __init__(self, conn: psycopg.Connection, batch_size: int=1000):
+        """
+        :param conn: psycopg 连接
+        :param batch_size: 缓冲的会话数, 达到后自动写入
+        """
+        self.conn = conn
+        self.batch_size = batch_size # sessions per flush
+        self.columns = {}
+        self.buffer = {table_name: {} for table_name, _, _ in self.TABLES}
+
+    def getTableColumns(self, table_name: str) -> list:
+        """
+        获取表字段 (缓存, 只查询一次 information_schema)
+        :param table_name: 表名
+        :return: 字段列表
+        """
+        if table_name not in self.columns:
+            q = '''
+                SELECT column_name
+                FROM information_schema.columns
+                WHERE table_schema = 'public'
+                AND table_name = %s
+                AND column_name NOT LIKE '\\_%%'
+                ORDER BY ordinal_position
+            '''
+            with self.conn.cursor() as cur:
+                cur.execute(q, (table_name,))
+                self.columns[table_name] = [row[0] for row in cur.fetchall()]
+            self.conn.commit()
+        return self.columns[table_name]
+
+    def reloadColumns(self) -> None:
+        """
+        清空字段缓存 (表结构变化后调用, 如新增 custom_tracking_params 字段)
+        :return: None
+        """
+        self.columns = {}
+        return None
+
+    def add(self, entity: dict) -> None:
+        """
+        缓存一个会话的实体, 达到 batch_size 时自动写入
+        :param entity: {'visitor': ..., 'session': ..., 'event_list': [...]}
+        :return: None
+        """
+        for table_name, primary_key, key in self.TABLES:
+            records = entity[key] if isinstance(entity[key], list) else [entity[key]]
+            for record in records:
+                self.buffer[table_name][record[primary_key]] = record # the last one wins, same as sequential upserts
+        if len(self.buffer['sessions']) >= self.batch_size:
+            self.flush()
+        return None
+
+    def flush(self) -> bool:
+        """
+        将缓存的实体写入数据库: COPY 到临时表, 每张表一条 INSERT ... ON CONFLICT 合并, 单个事务
+        :return: 是否写入成功
+        """
+        if not any(self.buffer.values()):
+            return True
+        for table_name, _, _ in self.TABLES:
+            self.getTableColumns(table_name) # outside of the transaction below
+        if self.conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+            self.conn.commit() # otherwise conn.transaction() would only be a savepoint
+        try:
+            with self.conn.transaction():
+                with self.conn.cursor() as cur:
+                    for table_name, primary_key, _ in self.TABLES:
+                        records = list(self.buffer[table_name].values())
+                        if not records:
+                            continue
+                        template = self.getTableColumns(table_name)
+                        keys = set().union(*[record.keys() for record in records])
+                        columns = [x for x in template if x in keys]
+                        stage = f'_stage_{table_name}'
+                        cur.execute(f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP')
+                        with cur.copy(f'COPY {stage} ({",".join(columns)}) FROM STDIN') as copy:
+                            for record in records:
+                                copy.write_row([record.get(x) for x in columns])
+                        q = f'''
+                            INSERT INTO {table_name} ({','.join(columns)})
+                            SELECT {','.join(columns)} FROM {stage}
+                            ON CONFLICT ({primary_key}) DO UPDATE
+                            SET {','.join(['{}=EXCLUDED.{}'.format(k, k) for k in columns if k != primary_key])}
+                        '''
+                        cur.execute(q)
+            result = True
+        except Exception as e:
+            traceback.print_exc()
+            logging.error(e, exc_info=True)
+            # fall back to row by row upserts, so that one bad record does not discard the whole batch
+            result = self.flushRows()
+        self.buffer = {table_name: {} for table_name, _, _ in self.TABLES}
+        return result
+
+    def flushRows(self) -> bool:
+        """
+        逐条写入缓存的实体 (批量写入失败时使用)
+        :return: 是否全部写入成功
+        """
+        result = True
+        with self.conn.cursor() as cur:
+            for table_name, primary_key, _ in self.TABLES:
+                template = self.getTableColumns(table_name)
+                for data in self.buffer[table_name].values():
+                    obj = {k: v for k, v in data.items() if k in template}
+                    try:
+                        q = f'''
+                            INSERT INTO {table_name} ({','.join(obj.keys())})
+                            VALUES ({','.join(['%s'] * len(obj))})
+                            ON CONFLICT ({primary_key}) DO UPDATE
+                            SET {','.join(['{}=EXCLUDED.{}'.format(k, k) for k in obj.keys()])}
+                        '''
+                        cur.execute(q, tuple(obj.values()))
+                        self.conn.commit()
+                    except Exception as e:
+                        traceback.print_exc()
+                        logging.error(e, exc_info=True)
+                        self.conn.rollback()
+                        result = False
+        return result
+
+
+if __name__ == '__main__':
+    pass
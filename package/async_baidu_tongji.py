@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+import asyncio
+
+from requests.adapters import HTTPAdapter
+
+from baidu_tongji import BaiduTongji
+from utils import *
+
+
+class AsyncBaiduTongji(BaiduTongji):
+    def __init__(self, debug: bool = False, concurrency: int = 8):
+        """
+        :param debug: 调试模式
+        :param concurrency: 默认最大并发数, 也是连接池大小
+        """
+        super(AsyncBaiduTongji, self).__init__(debug=debug)
+        self.concurrency = concurrency
+        # one keep-alive connection per concurrent request
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.sess.mount('https://', adapter)
+        self.sess.mount('http://', adapter)
+
+    async def fetchRealTimeDataAsync(self, site_id: str, page_size: int=1000, visitor_id: str='') -> list:
+        """
+        异步获取实时数据
+        :param site_id: 站点 ID
+        :param page_size: 每页条数
+        :param visitor_id: 访客 ID
+        :return: 实时数据列表
+        """
+        return await asyncio.to_thread(self.fetchRealTimeData, site_id, page_size, visitor_id)
+
+    async def fetchMany(self, site_ids: list, page_size: int=1000, concurrency: int=0) -> dict:
+        """
+        并发获取多个站点的实时数据
+        :param site_ids: 站点 ID 列表
+        :param page_size: 每页条数
+        :param concurrency: 最大并发数, 默认使用初始化时的设置
+        :return: {站点 ID: 实时数据列表}, 请求或解析失败的站点为对应的异常对象
+        """
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def fetch(site_id: str) -> list:
+            async with semaphore:
+                return await self.fetchRealTimeDataAsync(site_id, page_size)
+
+        # all requests share the access token of the TokenManager, refreshed in background
+        results = await asyncio.gather(*[fetch(site_id) for site_id in site_ids], return_exceptions=True)
+        result = {}
+        for site_id, data in zip(site_ids, results):
+            if isinstance(data, Exception):
+                traceback.print_exception(type(data), data, data.__traceback__)
+            result[site_id] = data # the exception is kept, a failed site is not an empty one
+        return result
+
+
+if __name__ == '__main__':
+    pass
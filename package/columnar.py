@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Columnar output of the parsed entities (requires the pyarrow package).
+Each page is collected into column arrays with fixed types: numbers and booleans as numeric columns,
+local times as timestamps, repeated strings dictionary-encoded, ids as plain strings.
+The result is a pyarrow.RecordBatch per table, or Parquet files partitioned by site and day.
+
+Usage:
+    from raw_parser import iterRawData
+    from columnar import toRecordBatches, writeParquet
+
+    batches = toRecordBatches(iterRawData(content, compact=True))
+    writeParquet(batches, site_id) # data/parquet/{table}/site_id={site_id}/date={YYYY-MM-DD}/*.parquet
+"""
+from operator import attrgetter
+
+from entities import EVENT_FIELD_SET, EVENT_FIELDS, EVENT_KEYS, SESSION_FIELD_SET, SESSION_FIELDS, Event
+from utils import *
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except:
+    pa = None
+
+# table_name, entity key, column of the partition day
+TABLES = [
+    ('visitors', 'visitor', 'last_visit_time'),
+    ('sessions', 'session', 'start_time'),
+    ('events', 'event_list', 'receive_time')
+]
+
+# local times, e.g. 2023-03-30 07:56:57
+TIME_COLUMNS = {'date_time', 'first_visit_time', 'last_visit_time', 'receive_time', 'session_start_time', 'start_time'}
+
+# unique values, dictionary encoding does not help
+PLAIN_COLUMNS = {'event_id', 'first_event_id', 'last_event_id', 'next_event_id', 'prev_event_id', 'session_id', 'visitor_id'}
+
+# read the __slots__ of entities.Event and of its shared SessionAttributes in one call
+EVENT_VALUES = attrgetter(*EVENT_FIELDS)
+SESSION_VALUES = attrgetter(*SESSION_FIELDS)
+
+
+def getColumnTypes() -> dict:
+    """
+    获取字段类型, 未列出的字符串字段使用字典编码
+    :return: {字段名: pyarrow 类型}
+    """
+    types = {
+        'unix_timestamp': pa.float64(),
+        'duration': pa.int64(),
+        'visit_pages': pa.int32(),
+        'visitor_frequency': pa.int32(),
+        'screen_width': pa.int32(),
+        'screen_height': pa.int32(),
+        'ip_status': pa.int8(),
+        'visitor_status': pa.int8(),
+        'visitor_type': pa.int8(),
+        'cookie_enable': pa.bool_(),
+        'java_enable': pa.bool_(),
+        'is_first_day': pa.bool_(),
+        'is_first_time': pa.bool_(),
+        'is_session_start': pa.bool_(),
+        'is_session_end': pa.bool_(),
+        'enhanced_event_list': pa.list_(pa.dictionary(pa.int8(), pa.string()))
+    }
+    types.update({x: pa.timestamp('s') for x in TIME_COLUMNS})
+    types.update({x: pa.string() for x in PLAIN_COLUMNS})
+    return types
+
+
+class ColumnBuffer(object):
+    """
+    按列收集一张表的记录
+    """
+    def __init__(self):
+        self.columns = {}
+        self.rows = 0
+        self.event_columns = False # columns of entities.Event created
+
+    def append(self, record) -> None:
+        """
+        添加一条记录 (dict 或 entities.Event), 新字段用 None 补齐之前的行, 缺少的字段用 None 补齐本行
+        :param record: 记录
+        :return: None
+        """
+        if isinstance(record, Event):
+            return self.appendEvent(record)
+        columns = self.columns
+        rows = self.rows
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * rows
+            column.append(value)
+        self.pad(rows + 1)
+        return None
+
+    def appendEvent(self, event: Event) -> None:
+        """
+        添加一条紧凑事件记录, 直接读取 __slots__ 及共享的会话级属性, 不构建字典
+        :param event: entities.Event
+        :return: None
+        """
+        columns = self.columns
+        rows = self.rows
+        if not self.event_columns:
+            # the same column order as the event dict
+            for key in EVENT_KEYS:
+                if key not in columns:
+                    columns[key] = [None] * rows
+            self.event_columns = True
+        for key, value in zip(EVENT_FIELDS, EVENT_VALUES(event)):
+            columns[key].append(value)
+        for key, value in zip(SESSION_FIELDS, SESSION_VALUES(event.shared)):
+            columns[key].append(value)
+        for key, value in event.extra.items():
+            if key in EVENT_FIELD_SET or key in SESSION_FIELD_SET:
+                columns[key][-1] = value # assigned after the event was built
+            else:
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * rows
+                column.append(value)
+        self.pad(rows + 1)
+        return None
+
+    def pad(self, rows: int) -> None:
+        """
+        结束一行: 用 None 补齐本行缺少的字段
+        :param rows: 新的行数
+        :return: None
+        """
+        self.rows = rows
+        for column in self.columns.values():
+            if len(column) < rows:
+                column.append(None)
+        return None
+
+    def toRecordBatch(self, types: dict):
+        """
+        转换为 RecordBatch
+        :param types: 字段类型
+        :return: pyarrow.RecordBatch
+        """
+        arrays = []
+        names = []
+        for name, values in self.columns.items():
+            if name in TIME_COLUMNS:
+                array = pc.strptime(pa.array(values, type=pa.string()), format='%Y-%m-%d %H:%M:%S', unit='s', error_is_null=True)
+            else:
+                array = pa.array(values, type=types.get(name, pa.dictionary(pa.int32(), pa.string())))
+            arrays.append(array)
+            names.append(name)
+        return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def toRecordBatches(entities) -> dict:
+    """
+    将实体转换为列式数据
+    :param entities: 实体可迭代对象, 如 parseRawData / iterRawData 的结果 (compact 模式也可)
+    :return: {'visitors': RecordBatch, 'sessions': RecordBatch, 'events': RecordBatch}
+    """
+    if pa is None:
+        raise ImportError('columnar output requires the pyarrow package')
+    buffers = {table_name: ColumnBuffer() for table_name, _, _ in TABLES}
+    visitors = buffers['visitors']
+    sessions = buffers['sessions']
+    events = buffers['events']
+    for entity in entities:
+        visitors.append(entity['visitor'])
+        sessions.append(entity['session'])
+        for event in entity['event_list']:
+            events.append(event)
+    types = getColumnTypes()
+    return {table_name: buffer.toRecordBatch(types) for table_name, buffer in buffers.items()}
+
+def writeParquet(batches: dict, site_id: str, path: str='', compression: str='') -> list:
+    """
+    按站点和日期写入 Parquet 文件: {path}/{table}/site_id={site_id}/date={YYYY-MM-DD}/{table}_{timestamp}.parquet
+    每次调用写入新文件, 不修改已有文件
+    :param batches: toRecordBatches 的结果
+    :param site_id: 站点 ID
+    :param path: 输出目录, 默认使用配置文件中的 columnar.path
+    :param compression: 压缩方式, 默认使用配置文件中的 columnar.compression
+    :return: 写入的文件路径列表
+    """
+    path = path or CONFIG['columnar']['path']
+    path = path if os.path.isabs(path) else f'{CURRENT_PATH}/{path}'
+    compression = compression or CONFIG['columnar']['compression']
+    suffix = f'{arrow.now().format("YYYYMMDDHHmmssSSS")}_{os.getpid()}'
+    file_list = []
+    for table_name, _, day_column in TABLES:
+        batch = batches[table_name]
+        if batch.num_rows == 0:
+            continue
+        table = pa.Table.from_batches([batch])
+        days = pc.strftime(table[day_column], format='%Y-%m-%d').to_pylist()
+        partitions = {}
+        for idx, day in enumerate(days):
+            partitions.setdefault(day or 'unknown', []).append(idx)
+        for day, indices in partitions.items():
+            dir_path = f'{path}/{table_name}/site_id={site_id}/date={day}'
+            os.makedirs(dir_path, exist_ok=True)
+            file_path = f'{dir_path}/{table_name}_{suffix}.parquet'
+            part = table if len(indices) == table.num_rows else table.take(indices)
+            pq.write_table(part, file_path, compression=compression)
+            file_list.append(file_path)
+    return file_list
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Long-running polling daemon. Each site in config.yaml (daemon.sites) is polled on its own interval,
+which is adapted to the observed rate of new sessions and bounded by the API quota.
+The BaiduTongji client, Redis/SQLite/HTTP connections, watermarks and in-memory caches are reused between polls.
+
+Usage:
+    python3 daemon.py
+    python3 daemon.py --sink ../demo/PostgreSQL/main.py:saveToDB
+"""
+import argparse
+import heapq
+import signal
+
+from baidu_tongji import BaiduTongji
+from replay import loadSink
+from utils import *
+
+
+class Poller(object):
+    def __init__(self, sites: list, sink, flush=None, page_size: int=1000, min_interval: int=30, max_interval: int=600, daily_quota: int=0, compact: bool=False, debug: bool=False):
+        """
+        :param sites: 站点 ID 列表
+        :param sink: 写入函数, 参数为一个会话的实体
+        :param flush: 每次轮询后调用的函数, 如提交事务
+        :param page_size: 每页条数
+        :param min_interval: 最短轮询间隔 (秒)
+        :param max_interval: 最长轮询间隔 (秒)
+        :param daily_quota: 每日 API 调用配额, 0 为不限制
+        :param compact: 是否使用紧凑的事件记录
+        :param debug: 调试模式
+        """
+        self.bd = BaiduTongji(debug=debug)
+        self.sites = sites
+        self.sink = sink
+        self.flush = flush or (lambda: None)
+        self.page_size = page_size
+        self.compact = compact # events share the session fields, less memory and GC work in a long-running process
+        # the API quota is shared by all sites, so each site may not poll more often than this
+        quota_interval = 86400 * len(sites) / daily_quota if daily_quota else 0
+        self.min_interval = max(min_interval, quota_interval)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.intervals = {site_id: self.min_interval for site_id in sites}
+        self.running = False
+
+    def nextInterval(self, site_id: str, new_sessions: int) -> float:
+        """
+        根据本次新增会话数调整轮询间隔
+        新增会话接近一页时缩短间隔 (避免漏数据), 没有新增时逐步延长, 其余情况使每次新增约为 1/4 页
+        :param site_id: 站点 ID
+        :param new_sessions: 本次新增或变化的会话数
+        :return: 新的轮询间隔 (秒)
+        """
+        interval = self.intervals[site_id]
+        if new_sessions == 0:
+            interval = interval * 1.5
+        elif new_sessions >= self.page_size * 0.5:
+            interval = interval / 2
+        else:
+            factor = (self.page_size * 0.25) / new_sessions
+            interval = interval * min(max(factor, 0.5), 2)
+        interval = min(max(interval, self.min_interval), self.max_interval)
+        self.intervals[site_id] = interval
+        return interval
+
+    def pollOnce(self, site_id: str) -> int:
+        """
+        轮询一次站点数据, 写入新增或变化的会话
+        :param site_id: 站点 ID
+        :return: 新增或变化的会话数
+        """
+        if not self.bd.debug:
+            self.bd.token_manager.ensureToken() # normally a no-op, the token is refreshed in background
+        count = 0
+        for entity in self.bd.iterRealTimeData(site_id, page_size=self.page_size, incremental=True, compact=self.compact):
+            self.sink(entity)
+            count += 1
+        self.flush()
+        return count
+
+    def stop(self, *args) -> None:
+        """
+        停止轮询, 当前站点处理完后退出 (SIGINT / SIGTERM 的处理函数)
+        :param args: signal 传入的参数
+        :return: None
+        """
+        self.running = False
+        return None
+
+    def run(self) -> None:
+        """
+        按各站点的轮询间隔循环拉取数据, 直到收到 SIGINT / SIGTERM
+        :return: None
+        """
+        self.running = True
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        schedule = [(time.monotonic(), site_id) for site_id in self.sites]
+        heapq.heapify(schedule)
+        while self.running and schedule:
+            due, site_id = schedule[0]
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(min(wait, 1)) # wake up regularly to handle stop signals
+                continue
+            heapq.heappop(schedule)
+            start = time.monotonic()
+            try:
+                count = self.pollOnce(site_id)
+                interval = self.nextInterval(site_id, count)
+            except:
+                traceback.print_exc()
+                count = -1
+                interval = min(self.intervals[site_id] * 2, self.max_interval)
+                self.intervals[site_id] = interval
+            print(f'{arrow.now().format("YYYY-MM-DD HH:mm:ss")} site {site_id}: {count} sessions in {time.monotonic() - start:.1f}s, next poll in {interval:.0f}s')
+            heapq.heappush(schedule, (start + interval, site_id))
+        return None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Poll realtime data of the sites in config.yaml (daemon.sites).')
+    arg_parser.add_argument('--sink', default='null', help='null, jsonl, or path/to/file.py:function')
+    arg_parser.add_argument('--output', default='', help='output file of the jsonl sink')
+    arg_parser.add_argument('--debug', action='store_true', help='use the demo API of Baidu Tongji')
+    args = arg_parser.parse_args()
+
+    sink, flush, close = loadSink(args.sink, args.output)
+    poller = Poller(
+        [str(x) for x in CONFIG['daemon']['sites']],
+        sink,
+        flush=flush,
+        page_size=CONFIG['daemon']['page_size'],
+        min_interval=CONFIG['daemon']['min_interval'],
+        max_interval=CONFIG['daemon']['max_interval'],
+        daily_quota=CONFIG['daemon']['daily_quota'],
+        compact=CONFIG['daemon']['compact'],
+        debug=args.debug
+    )
+    try:
+        poller.run()
+    finally:
+        close()
+    print('done.')
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Compact event records, used by the parser when compact=True.
+Most fields of an event are copied from its session (browser, os, city, resolution, latest_* attribution ...),
+so they are stored once in a SessionAttributes block shared by all events of the session,
+and each Event only keeps its own fields in __slots__.
+Event is a Mapping with the same keys as the event dict, to_dict() returns the plain dict.
+Keys can also be assigned (e.g. next_event_id), other keys are stored in a copy of the extra dict, the shared blocks are never modified.
+"""
+from collections.abc import Mapping
+
+# fields shared by all events of a session
+SESSION_FIELDS = (
+    'session_id', 'visitor_id', 'browser', 'browser_language', 'browser_type', 'city', 'country', 'device_type', 'ip', 'is_first_day',
+    'latest_landing_page', 'latest_referrer', 'latest_referrer_host', 'latest_referrer_host_sld', 'latest_search_engine', 'latest_search_keyword',
+    'latest_traffic_source_type', 'latest_utm_campaign', 'latest_utm_content', 'latest_utm_medium', 'latest_utm_source', 'latest_utm_term',
+    'os', 'os_type', 'province', 'resolution', 'screen_height', 'screen_width', 'session_start_time', 'visitor_type'
+)
+
+# fields of each event
+EVENT_FIELDS = (
+    'event_id', 'receive_time', 'date_time', 'unix_timestamp', 'event', 'duration', 'enhanced_event_list', 'enhanced_traffic_group',
+    'hmci', 'hmcu', 'hmkw', 'hmpl', 'hmsr', 'is_first_time', 'is_session_end', 'is_session_start', 'next_event_id', 'onsite_search_term',
+    'prev_event_id', 'referrer', 'referrer_host', 'referrer_host_sld', 'traffic_source_type', 'url', 'url_full_path', 'url_host', 'url_host_sld',
+    'url_path', 'url_query', 'utm_campaign', 'utm_content', 'utm_medium', 'utm_source', 'utm_term', 'wx_share_from'
+)
+
+# key order of the event dict built by raw_parser.iterSessions
+EVENT_KEYS = (
+    'event_id', 'session_id', 'visitor_id', 'receive_time', 'date_time', 'unix_timestamp', 'event', 'browser', 'browser_language', 'browser_type',
+    'city', 'country', 'device_type', 'duration', 'enhanced_event_list', 'enhanced_traffic_group', 'hmci', 'hmcu', 'hmkw', 'hmpl', 'hmsr', 'ip',
+    'is_first_day', 'is_first_time', 'is_session_end', 'is_session_start', 'latest_landing_page', 'latest_referrer', 'latest_referrer_host',
+    'latest_referrer_host_sld', 'latest_search_engine', 'latest_search_keyword', 'latest_traffic_source_type', 'latest_utm_campaign',
+    'latest_utm_content', 'latest_utm_medium', 'latest_utm_source', 'latest_utm_term', 'next_event_id', 'onsite_search_term', 'os', 'os_type',
+    'prev_event_id', 'province', 'referrer', 'referrer_host', 'referrer_host_sld', 'resolution', 'screen_height', 'screen_width',
+    'session_start_time', 'traffic_source_type', 'url', 'url_full_path', 'url_host', 'url_host_sld', 'url_path', 'url_query', 'utm_campaign',
+    'utm_content', 'utm_medium', 'utm_source', 'utm_term', 'visitor_type', 'wx_share_from'
+)
+
+EVENT_FIELD_SET = frozenset(EVENT_FIELDS)
+SESSION_FIELD_SET = frozenset(SESSION_FIELDS)
+EVENT_KEY_SOURCES = tuple((key, key in SESSION_FIELD_SET) for key in EVENT_KEYS)
+
+
+class SessionAttributes(object):
+    """
+    会话级属性, 由同一会话的所有事件共享
+    """
+    __slots__ = SESSION_FIELDS
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: SESSION_FIELDS 中的全部字段
+        """
+        for key in SESSION_FIELDS:
+            setattr(self, key, kwargs[key])
+
+    def __reduce__(self):
+        return (rebuildSessionAttributes, (tuple(getattr(self, key) for key in SESSION_FIELDS),))
+
+
+def rebuildSessionAttributes(values: tuple) -> SessionAttributes:
+    # used by pickle (parallel parsing in worker processes)
+    return SessionAttributes(**dict(zip(SESSION_FIELDS, values)))
+
+
+class Event(Mapping):
+    """
+    紧凑的事件记录, 只保存事件自身的字段, 会话级字段引用共享的 SessionAttributes
+    支持按键赋值: 事件自身的字段直接修改, 其他键写入 extra 的副本, 不修改共享的数据
+    """
+    __slots__ = EVENT_FIELDS + ('shared', 'extra')
+
+    def __init__(self, shared: SessionAttributes, extra: dict, event_id, receive_time, date_time, unix_timestamp, event, duration, enhanced_event_list,
+                 enhanced_traffic_group, hmci, hmcu, hmkw, hmpl, hmsr, is_first_time, is_session_end, is_session_start, next_event_id,
+                 onsite_search_term, prev_event_id, referrer, referrer_host, referrer_host_sld, traffic_source_type, url, url_full_path, url_host,
+                 url_host_sld, url_path, url_query, utm_campaign, utm_content, utm_medium, utm_source, utm_term, wx_share_from):
+        """
+        :param shared: 会话级属性
+        :param extra: 自定义 tracking 参数 (ct_params), 可能与其他事件共享, 不会被修改
+        """
+        self.shared = shared
+        self.extra = extra
+        self.event_id = event_id
+        self.receive_time = receive_time
+        self.date_time = date_time
+        self.unix_timestamp = unix_timestamp
+        self.event = event
+        self.duration = duration
+        self.enhanced_event_list = enhanced_event_list
+        self.enhanced_traffic_group = enhanced_traffic_group
+        self.hmci = hmci
+        self.hmcu = hmcu
+        self.hmkw = hmkw
+        self.hmpl = hmpl
+        self.hmsr = hmsr
+        self.is_first_time = is_first_time
+        self.is_session_end = is_session_end
+        self.is_session_start = is_session_start
+        self.next_event_id = next_event_id
+        self.onsite_search_term = onsite_search_term
+        self.prev_event_id = prev_event_id
+        self.referrer = referrer
+        self.referrer_host = referrer_host
+        self.referrer_host_sld = referrer_host_sld
+        self.traffic_source_type = traffic_source_type
+        self.url = url
+        self.url_full_path = url_full_path
+        self.url_host = url_host
+        self.url_host_sld = url_host_sld
+        self.url_path = url_path
+        self.url_query = url_query
+        self.utm_campaign = utm_campaign
+        self.utm_content = utm_content
+        self.utm_medium = utm_medium
+        self.utm_source = utm_source
+        self.utm_term = utm_term
+        self.wx_share_from = wx_share_from
+
+    def __getitem__(self, key: str):
+        if key in self.extra:
+            return self.extra[key]
+        if key in EVENT_FIELD_SET:
+            return getattr(self, key)
+        if key in SESSION_FIELD_SET:
+            return getattr(self.shared, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value) -> None:
+        if key in EVENT_FIELD_SET and key not in self.extra:
+            setattr(self, key, value)
+        else:
+            self.extra = {**self.extra, key: value} # copy on write, the session block and ct_params are shared
+        return None
+
+    def __iter__(self):
+        # same order as to_dict(), without building it
+        yield from EVENT_KEYS
+        for key in self.extra:
+            if key not in EVENT_FIELD_SET and key not in SESSION_FIELD_SET:
+                yield key
+
+    def __len__(self) -> int:
+        return len(EVENT_KEYS) + len([key for key in self.extra if key not in EVENT_FIELD_SET and key not in SESSION_FIELD_SET])
+
+    def __repr__(self) -> str:
+        return f'Event({self.to_dict()!r})'
+
+    def __reduce__(self):
+        extra = self.extra if type(self.extra) is dict else dict(self.extra) # ct_params is a read-only MappingProxyType
+        return (rebuildEvent, (self.shared, extra, tuple(getattr(self, key) for key in EVENT_FIELDS)))
+
+    def to_dict(self) -> dict:
+        """
+        转换为与非紧凑模式相同的事件字典
+        :return: 事件字典
+        """
+        shared = self.shared
+        result = {key: getattr(shared, key) if is_shared else getattr(self, key) for key, is_shared in EVENT_KEY_SOURCES}
+        result.update(self.extra)
+        return result
+
+
+def rebuildEvent(shared: SessionAttributes, extra: dict, values: tuple) -> Event:
+    # used by pickle, the shared block is pickled once per session
+    return Event(shared, extra, *values)
+
+
+def toDict(entity: dict) -> dict:
+    """
+    将紧凑模式的实体转换为普通字典
+    :param entity: {'visitor': ..., 'session': ..., 'event_list': [...]}
+    :return: 事件为普通字典的实体
+    """
+    return {
+        'visitor': entity['visitor'],
+        'session': entity['session'],
+        'event_list': [event.to_dict() if isinstance(event, Event) else event for event in entity['event_list']]
+    }
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,682 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Parse the raw data of the realtime visitors API (trend/latest/a) into visitor, session and event entities.
+No network request is made here, so the parser could be used on replayed data or in worker processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import md5
+
+from entities import Event, SessionAttributes
+from utils import *
+
+executors = {} # {workers: ProcessPoolExecutor}, shared by the threads of the process
+executors_lock = threading.Lock()
+
+
+class Watermark(object):
+    """
+    站点增量水位: 记录最新的会话开始时间, 及近期会话的内容指纹 (保存在 Redis), 用于跳过未变化的会话
+    """
+    def __init__(self, site_id: str, window: int=0):
+        """
+        :param site_id: 站点 ID
+        :param window: 时间窗口 (秒), 早于最新会话超过该时间的会话不再解析, 默认使用配置文件中的 incremental.window
+        """
+        self.key = f'watermark_{site_id}'
+        self.window = window or CONFIG['incremental']['window']
+        self.latest = 0.0
+        self.sessions = {} # {session_key: (unix_timestamp, fingerprint)}
+        self.pending = {}
+        for session_key, value in rd.hgetall(self.key).items():
+            unix_timestamp, fingerprint = value.split(',')
+            self.sessions[session_key] = (float(unix_timestamp), fingerprint)
+            self.latest = max(self.latest, float(unix_timestamp))
+
+    def filterItems(self, items: list) -> list:
+        """
+        过滤掉与上次解析相比没有变化的会话, 以及早于时间窗口的会话 (其指纹已被清理)
+        :param items: 原始数据中的 items
+        :return: 仅包含新会话及有变化会话的 items
+        """
+        detail = items[0]
+        outline = items[1]
+        cutoff = self.latest - self.window
+        self.pending = {} # drop the sessions of an unfinished poll, they were not (all) emitted
+        kept_detail, kept_outline = [], []
+        for i in range(len(outline)):
+            o = outline[i]
+            d = detail[i][0]['detail']
+            start_time, date_time, unix_timestamp = getTime(o[0])
+            if unix_timestamp < cutoff:
+                continue
+            session_key = md5(f'{o[6]}_{int(unix_timestamp)}_{o[3]}'.encode('utf-8')).hexdigest()[:16]
+            fingerprint = md5(json.dumps([o[7], o[8], d['endPage'], d['paths']])).hexdigest()[:16]
+            if self.sessions.get(session_key, (0, ''))[1] == fingerprint:
+                continue
+            self.pending[session_key] = (unix_timestamp, fingerprint)
+            kept_detail.append(detail[i])
+            kept_outline.append(outline[i])
+        return [kept_detail, kept_outline]
+
+    def save(self) -> None:
+        """
+        保存本次解析的会话指纹, 并清理超出时间窗口的记录 (在解析成功后调用)
+        :return: None
+        """
+        self.sessions.update(self.pending)
+        for unix_timestamp, fingerprint in self.pending.values():
+            self.latest = max(self.latest, unix_timestamp)
+        # the same cutoff as filterItems, the expired sessions are skipped there
+        cutoff = self.latest - self.window
+        expired = [k for k, v in self.sessions.items() if v[0] < cutoff]
+        for session_key in expired:
+            del self.sessions[session_key]
+        pipe = rd.pipeline(transaction=False)
+        if self.pending:
+            pipe.hset(self.key, mapping={k: f'{v[0]},{v[1]}' for k, v in self.pending.items()})
+        if expired:
+            pipe.hdel(self.key, *expired)
+        pipe.execute()
+        self.pending = {}
+        return None
+
+
+def loadRawData(content) -> list:
+    """
+    加载原始数据
+    :param content: 原始数据, dict / bytes / str 均可, 与 saveRawData 保存的格式一致
+    :return: items 列表
+    """
+    if isinstance(content, (bytes, bytearray, memoryview, str)):
+        content = json.loads(content)
+    if 'items' in content: # MongoDB log document
+        return content['items']
+    items = content.get('data', content.get('result'))['items']
+    return items
+
+def parseRawData(content, workers: int=0, chunk_size: int=0, watermark: Watermark=None, compact: bool=False) -> list:
+    """
+    解析原始数据
+    :param content: 原始数据, dict / bytes / str 均可
+    :param workers: 并行解析的进程数, 0 为串行解析
+    :param chunk_size: 并行解析时, 每个任务包含的会话数
+    :param watermark: 站点增量水位, 设置时仅解析新会话及有变化的会话
+    :param compact: 是否使用紧凑的事件记录 (entities.Event), 同一会话的事件共享会话级字段
+    :return: 实时数据列表
+    """
+    items = loadRawData(content)
+    if watermark:
+        items = watermark.filterItems(items)
+    if workers:
+        result = parseItemsParallel(items, workers, chunk_size, compact)
+    else:
+        result = parseItems(items, compact)
+    if watermark:
+        watermark.save()
+    return result
+
+def iterRawData(content, watermark: Watermark=None, compact: bool=False):
+    """
+    逐个会话解析原始数据
+    :param content: 原始数据, dict / bytes / str 均可
+    :param watermark: 站点增量水位, 设置时仅解析新会话及有变化的会话
+    :param compact: 是否使用紧凑的事件记录
+    :return: 生成器, 每次返回一个会话的实体
+    """
+    items = loadRawData(content)
+    if watermark:
+        items = watermark.filterItems(items)
+    yield from iterItems(items, compact)
+    # only reached when the page is fully consumed, a generator closed early saves nothing
+    if watermark:
+        watermark.save()
+
+def parseItems(items: list, compact: bool=False, page_state: list=None) -> list:
+    """
+    解析 items, 构建 visitor, session, event 对象
+    :param items: 原始数据中的 items
+    :param compact: 是否使用紧凑的事件记录
+    :param page_state: resolvePageState 的结果, 设置时不再读写 Redis
+    :return: 实时数据列表
+    """
+    result = list(iterItems(items, compact, page_state))
+    return result
+
+def getExecutor(workers: int) -> ProcessPoolExecutor:
+    """
+    获取进程池, 相同进程数复用同一个进程池
+    不同进程数使用各自的进程池, 不关闭其他线程可能正在使用的进程池
+    :param workers: 进程数
+    :return: 进程池
+    """
+    with executors_lock:
+        if workers not in executors:
+            executors[workers] = ProcessPoolExecutor(max_workers=workers)
+        return executors[workers]
+
+def parseItemsParallel(items: list, workers: int=0, chunk_size: int=0, compact: bool=False) -> list:
+    """
+    按会话分块, 在进程池中并行解析 items, 结果顺序与串行解析一致
+    :param items: 原始数据中的 items
+    :param workers: 进程数, 默认使用配置文件中的 parser.workers, 仍为 0 时使用 CPU 核数
+    :param chunk_size: 每个任务包含的会话数, 默认使用配置文件中的 parser.chunk_size
+    :param compact: 是否使用紧凑的事件记录
+    :return: 实时数据列表
+    """
+    workers = workers or CONFIG['parser']['workers'] or os.cpu_count()
+    chunk_size = chunk_size or CONFIG['parser']['chunk_size']
+    detail = items[0]
+    outline = items[1]
+    chunks = [
+        [detail[i:i + chunk_size], outline[i:i + chunk_size]]
+        for i in range(0, len(outline), chunk_size)
+    ]
+    if workers == 1 or len(chunks) <= 1:
+        return parseItems(items, compact)
+    # first_day and ip_location depend on the sessions before, resolve them for the whole page before dispatching
+    page_state = resolvePageState(items)
+    states = [page_state[i:i + chunk_size] for i in range(0, len(outline), chunk_size)]
+    result = []
+    for part in getExecutor(workers).map(parseItems, chunks, [compact] * len(chunks), states):
+        result.extend(part)
+    return result
+
+def resolvePageState(items: list, cache: PageCache=None) -> list:
+    """
+    按会话顺序解析依赖 Redis 的单页状态 (地区信息, 首次访问日期) 并写回 Redis, 与串行解析的结果一致
+    :param items: 原始数据中的 items
+    :param cache: 状态缓存, 默认为新的 PageCache (读写 Redis)
+    :return: [((country, province, city), first_day), ...], 与会话一一对应
+    """
+    outline = items[1]
+    detail = items[0]
+    session_times = getTimes([o[0] for o in outline])
+    cache = cache or PageCache()
+    cache.prefetch([o[5] for o in outline], [o[6] for o in outline])
+    cache.prefetchLBS([o[1] for o in outline], [o[5] for o in outline])
+    page_state = []
+    try:
+        for i in range(len(outline)):
+            area, ip, visitor_id = outline[i][1], outline[i][5], outline[i][6]
+            division = queryDivision(area, ip, cache)
+            is_first_time = True if detail[i][0]['detail']['lastVisitTime'] == '首次访问' else False
+            saveFistVisitTime(visitor_id, session_times[i][0], is_first_time, cache)
+            page_state.append((division, cache.getFirstDay(visitor_id) or False))
+    finally:
+        cache.flush()
+    return page_state
+
+def iterItems(items: list, compact: bool=False, page_state: list=None):
+    """
+    逐个会话解析 items, 每构建完一个会话即返回, 避免整页数据同时驻留内存
+    :param items: 原始数据中的 items
+    :param compact: 是否使用紧凑的事件记录
+    :param page_state: resolvePageState 的结果, 设置时不再读写 Redis
+    :return: 生成器, 每次返回 {'visitor': ..., 'session': ..., 'event_list': [...]}
+    """
+    outline = items[1]
+    detail = items[0]
+    session_times = getTimes([o[0] for o in outline])
+    if page_state is not None:
+        yield from iterSessions(outline, detail, session_times, None, compact, page_state)
+        return None
+    cache = PageCache()
+    cache.prefetch([o[5] for o in outline], [o[6] for o in outline])
+    cache.prefetchLBS([o[1] for o in outline], [o[5] for o in outline])
+    try:
+        yield from iterSessions(outline, detail, session_times, cache, compact)
+    finally:
+        cache.flush()
+
+def iterSessions(outline: list, detail: list, session_times: list, cache: PageCache, compact: bool=False, page_state: list=None):
+    """
+    逐个会话构建 visitor, session, event 对象
+    :param outline: items[1], 会话概要列表
+    :param detail: items[0], 会话详情列表
+    :param session_times: 会话开始时间信息列表
+    :param cache: 单页 Redis 状态缓存
+    :param compact: 是否使用紧凑的事件记录, 事件共享会话级字段
+    :param page_state: resolvePageState 的结果, 设置时使用其中的地区信息及首次访问日期, 不使用 cache
+    :return: 生成器
+    """
+    for i in range(len(outline)):
+        o = outline[i]
+        d = detail[i][0]['detail']
+
+        """
+        session info
+        """
+        start_time, area, source, access_page, search_word, ip, visitor_id, duration, visit_pages = o
+
+        start_time, date_time, unix_timestamp = session_times[i]
+        raw_area = area
+        if page_state is None:
+            country, province, city = queryDivision(area, ip, cache)
+        else:
+            country, province, city = page_state[i][0]
+        landing_page = access_page
+        source = d['fromType'] # Use the fromType from detail because the outline does not contain the search_keyword information.
+        source_from_type = source.get('fromType', '')
+        source_tip = source.get('tip', '')
+        source_url = source.get('url', '')
+        source_url = '' if not source_url else source_url
+        traffic_source = parseTrafficSource(source_from_type, source_url)
+        traffic_source_type = traffic_source['traffic_source_type']
+        referrer = traffic_source['referrer']
+        referrer_host = traffic_source['referrer_host']
+        referrer_host_sld = parseSLD(referrer_host) # Second-level domain, e.g. book.douban.com -> douban.com, www.google.com.hk -> google.com.hk
+        access = parseUrl(access_page)
+        access_host = access.host
+        access_path, access_full_path = parsetUrlPath(access)
+        access_page_query = access.query
+        tracking_arams = access.tracking_params # read-only, shared by the sessions with the same landing page
+        utm_source = tracking_arams['utm_source']
+        utm_medium = tracking_arams['utm_medium']
+        utm_campaign = tracking_arams['utm_campaign']
+        utm_term = tracking_arams['utm_term']
+        utm_content = tracking_arams['utm_content']
+        hmsr = tracking_arams['hmsr']
+        hmpl = tracking_arams['hmpl']
+        hmcu = tracking_arams['hmcu']
+        hmkw = tracking_arams['hmkw']
+        hmci = tracking_arams['hmci']
+        ct_params = tracking_arams['ct_params']
+        search_keyword = unquote_plus(search_word)
+        search_keyword = '' if search_keyword == '--' else search_keyword
+        search_keyword = traffic_source['search_keyword'] if not search_keyword else search_keyword
+        duration = getDuration(duration)
+        visit_pages = int(visit_pages)
+        anti_code = d['antiCode']
+        anti_code = '' if anti_code == '--' else anti_code
+        browser = d['browser']
+        browser_type = d['browserType']
+        color_depth = d['color']
+        cookie = d['cookie']
+        cookie_enable = True if cookie == '支持' else False
+        device_type = d['deviceType']
+        end_page = d['endPage']
+        flash_version = d['flash']
+        from_word = d['from_word']
+        from_word = unquote_plus(from_word)
+        from_word = '' if from_word == '--' else from_word
+        utm_term = from_word if (from_word and not utm_term) else utm_term
+        ip_status = d['ipStatus']
+        isp = d['isp']
+        ip_isp = isp
+        java = d['java']
+        java_enable = True if java == '支持' else False
+        browser_language = d['language']
+        last_visit_time = d['lastVisitTime']
+        is_first_time = True if last_visit_time == '首次访问' else False
+        if page_state is None:
+            saveFistVisitTime(visitor_id, start_time, is_first_time, cache)
+            first_day = cache.getFirstDay(visitor_id) or False
+        else:
+            first_day = page_state[i][1]
+        start_day = start_time[:10]
+        is_first_day = start_day == first_day or False
+        last_visit_time = start_time if is_first_time else last_visit_time
+        last_visit_time = getTime(last_visit_time)[0]
+        _os = d['os']
+        os_type = d['osType']
+        resolution = d['resolution']
+        screen_width, screen_height = getScreenSize(resolution)
+        b_user_id = d['userId']
+        visitor_frequency = int(d['visitorFrequency'])
+        visitor_status = d['visitorStatus']
+        visitor_type = d['visitorType']
+        visitor_type = 1 if visitor_type == '老访客' else 0
+        enhanced_traffic_group = parseEnhancedTrafficGroup(traffic_source_type, referrer_host, utm_source, utm_medium, utm_campaign)
+        search_engine = querySearchEngine(traffic_source, enhanced_traffic_group, referrer_host)
+        wx_share_from = parseWXShareFrom(browser_type, referrer_host, access_page)
+
+        session_id = 's_' + md5(f'{visitor_id}_{int(unix_timestamp)}_{access_page}'.encode('utf-8')).hexdigest().lower()
+
+        session = {
+            'session_id': session_id,
+            'visitor_id': visitor_id,
+            'start_time': start_time,
+            'date_time': date_time,
+            'unix_timestamp': unix_timestamp,
+            'access_full_path': access_full_path,
+            'access_host': access_host,
+            'access_page': access_page,
+            'access_page_query': access_page_query,
+            'access_path': access_path,
+            'anti_code': anti_code,
+            'b_user_id': b_user_id,
+            'browser': browser,
+            'browser_language': browser_language,
+            'browser_type': browser_type,
+            'city': city,
+            'color_depth': color_depth,
+            'cookie_enable': cookie_enable,
+            'country': country,
+            'device_type': device_type,
+            'duration': duration,
+            'end_page': end_page,
+            'enhanced_traffic_group': enhanced_traffic_group,
+            'first_event_id': '',
+            'flash_version': flash_version,
+            'from_word': from_word,
+            'hmci': hmci,
+            'hmcu': hmcu,
+            'hmkw': hmkw,
+            'hmpl': hmpl,
+            'hmsr': hmsr,
+            'ip': ip,
+            'ip_isp': ip_isp,
+            'ip_status': ip_status,
+            'is_first_day': is_first_day,
+            'is_first_time': is_first_time,
+            'java_enable': java_enable,
+            'landing_page': landing_page,
+            'last_event_id': '',
+            'last_visit_time': last_visit_time,
+            'os': _os,
+            'os_type': os_type,
+            'province': province,
+            'raw_area': raw_area,
+            'referrer': referrer,
+            'referrer_host': referrer_host,
+            'referrer_host_sld': referrer_host_sld,
+            'resolution': resolution,
+            'screen_height': screen_height,
+            'screen_width': screen_width,
+            'search_engine': search_engine,
+            'search_keyword': search_keyword,
+            'source_from_type': source_from_type,
+            'source_tip': source_tip,
+            'source_url': source_url,
+            'traffic_source_type': traffic_source_type,
+            'utm_campaign': utm_campaign,
+            'utm_content': utm_content,
+            'utm_medium': utm_medium,
+            'utm_source': utm_source,
+            'utm_term': utm_term,
+            'visit_pages': visit_pages,
+            'visitor_frequency': visitor_frequency,
+            'visitor_status': visitor_status,
+            'visitor_type': visitor_type,
+            'wx_share_from': wx_share_from,
+            **ct_params
+         }
+
+
+        """
+        visitor info
+        """
+        if visitor_type == 0:
+            first_visit_time = start_time
+            utm_source = utm_source
+            utm_medium = utm_medium
+            utm_campaign = utm_campaign
+            utm_term = utm_term
+            utm_content = utm_content
+            first_referrer = referrer
+            first_referrer_host = referrer_host
+            first_search_engine = search_engine
+            first_search_keyword = search_keyword
+            first_landing_page = landing_page
+            first_traffic_source_type = traffic_source_type
+        else:
+            first_visit_time = '1970-01-01 00:00:01'
+            utm_source = ''
+            utm_medium = ''
+            utm_campaign = ''
+            utm_term = ''
+            utm_content = ''
+            first_referrer = ''
+            first_referrer_host = ''
+            first_search_engine = ''
+            first_search_keyword = ''
+            first_landing_page = ''
+            first_traffic_source_type = ''
+
+        visitor = {
+            'visitor_id': visitor_id,
+            'first_visit_time': first_visit_time,
+            'last_visit_time': start_time,
+            'first_landing_page': first_landing_page,
+            'first_referrer': first_referrer,
+            'first_referrer_host': first_referrer_host,
+            'first_search_engine': first_search_engine,
+            'first_search_keyword': first_search_keyword,
+            'first_traffic_source_type': first_traffic_source_type,
+            'utm_campaign': utm_campaign,
+            'utm_content': utm_content,
+            'utm_medium': utm_medium,
+            'utm_source': utm_source,
+            'utm_term': utm_term
+        }
+
+
+        """
+        event info
+        """
+        latest_landing_page = landing_page
+        latest_referrer = referrer
+        latest_referrer_host = referrer_host
+        latest_referrer_host_sld = referrer_host_sld
+        latest_search_engine = search_engine
+        latest_search_keyword = search_keyword
+        latest_traffic_source_type = traffic_source_type
+        latest_utm_source = utm_source
+        latest_utm_medium = utm_medium
+        latest_utm_campaign = utm_campaign
+        latest_utm_term = utm_term
+        latest_utm_content = utm_content
+        session_duration = duration
+        session_start_time = start_time
+        if compact:
+            shared = SessionAttributes(
+                session_id=session_id,
+                visitor_id=visitor_id,
+                browser=browser,
+                browser_language=browser_language,
+                browser_type=browser_type,
+                city=city,
+                country=country,
+                device_type=device_type,
+                ip=ip,
+                is_first_day=is_first_day,
+                latest_landing_page=latest_landing_page,
+                latest_referrer=latest_referrer,
+                latest_referrer_host=latest_referrer_host,
+                latest_referrer_host_sld=latest_referrer_host_sld,
+                latest_search_engine=latest_search_engine,
+                latest_search_keyword=latest_search_keyword,
+                latest_traffic_source_type=latest_traffic_source_type,
+                latest_utm_campaign=latest_utm_campaign,
+                latest_utm_content=latest_utm_content,
+                latest_utm_medium=latest_utm_medium,
+                latest_utm_source=latest_utm_source,
+                latest_utm_term=latest_utm_term,
+                os=_os,
+                os_type=os_type,
+                province=province,
+                resolution=resolution,
+                screen_height=screen_height,
+                screen_width=screen_width,
+                session_start_time=session_start_time,
+                visitor_type=visitor_type
+            )
+
+        paths = sorted(d['paths'], key=lambda x: x[0]) # sort by event start_time asc
+        event_list = []
+        l = len(paths)
+        path_times = getTimes([path[0] for path in paths])
+        for idx, path in enumerate(paths):
+            start_time, duration, url = path
+
+            receive_time, date_time, unix_timestamp = path_times[idx]
+            event_id = 'p_' + md5(f'{session_id}_{int(unix_timestamp)}_{url}'.encode('utf-8')).hexdigest().lower()
+
+            if idx == 0:
+                is_session_start = True
+                session['first_event_id'] = event_id
+                referrer = latest_referrer_host
+                referrer_host = latest_referrer_host
+                prev_event_id = ''
+                next_event_id = ''
+            else:
+                is_session_start = False
+                is_first_time = False
+                referrer = paths[idx - 1][2] # previous url
+                referrer_host = parseUrl(referrer).host
+                event_list[idx - 1]['next_event_id'] = event_id # previous event's next_event_id
+                prev_event_id = event_list[idx - 1]['event_id'] # current event's prev_event_id
+
+            if (idx == l - 1) and (session_duration > 0) and (url == end_page):
+                is_session_end = True
+                session['last_event_id'] = event_id
+            else:
+                is_session_end = False
+
+            duration = getDuration(duration)
+            referrer_host_sld = parseSLD(referrer_host)
+            parsed_url = parseUrl(url)
+            url_host = parsed_url.host
+            url_host_sld = parseSLD(url_host)
+            traffic_source_type = '站内来源' if url_host_sld == referrer_host_sld else traffic_source_type
+            url_path, url_full_path = parsetUrlPath(parsed_url)
+            url_query = parsed_url.query
+            tracking_arams = parsed_url.tracking_params
+            utm_source = tracking_arams['utm_source']
+            utm_medium = tracking_arams['utm_medium']
+            utm_campaign = tracking_arams['utm_campaign']
+            utm_term = tracking_arams['utm_term']
+            utm_content = tracking_arams['utm_content']
+            hmsr = tracking_arams['hmsr']
+            hmpl = tracking_arams['hmpl']
+            hmcu = tracking_arams['hmcu']
+            hmkw = tracking_arams['hmkw']
+            hmci = tracking_arams['hmci']
+            ct_params = tracking_arams['ct_params']
+            onsite_search_term = parseOnSiteSearchTerm(parsed_url)
+            enhanced_event_list = parseEnhancedEvent(parsed_url, duration, is_first_day, is_session_start)
+            enhanced_traffic_group = parseEnhancedTrafficGroup(traffic_source_type, referrer_host, utm_source, utm_medium, utm_campaign)
+            wx_share_from = parseWXShareFrom(browser_type, referrer_host, access_page)
+
+            if compact:
+                event_list.append(Event(
+                    shared,
+                    ct_params,
+                    event_id=event_id,
+                    receive_time=receive_time,
+                    date_time=date_time,
+                    unix_timestamp=unix_timestamp,
+                    event='page_view',
+                    duration=duration,
+                    enhanced_event_list=enhanced_event_list,
+                    enhanced_traffic_group=enhanced_traffic_group,
+                    hmci=hmci,
+                    hmcu=hmcu,
+                    hmkw=hmkw,
+                    hmpl=hmpl,
+                    hmsr=hmsr,
+                    is_first_time=is_first_time,
+                    is_session_end=is_session_end,
+                    is_session_start=is_session_start,
+                    next_event_id=prev_event_id,
+                    onsite_search_term=onsite_search_term,
+                    prev_event_id=prev_event_id,
+                    referrer=referrer,
+                    referrer_host=referrer_host,
+                    referrer_host_sld=referrer_host_sld,
+                    traffic_source_type=traffic_source_type,
+                    url=url,
+                    url_full_path=url_full_path,
+                    url_host=url_host,
+                    url_host_sld=url_host_sld,
+                    url_path=url_path,
+                    url_query=url_query,
+                    utm_campaign=utm_campaign,
+                    utm_content=utm_content,
+                    utm_medium=utm_medium,
+                    utm_source=utm_source,
+                    utm_term=utm_term,
+                    wx_share_from=wx_share_from
+                ))
+                continue
+
+            event = {
+                'event_id': event_id,
+                'session_id': session_id,
+                'visitor_id': visitor_id,
+                'receive_time': receive_time,
+                'date_time': date_time,
+                'unix_timestamp': unix_timestamp,
+                'event': 'page_view',
+                'browser': browser,
+                'browser_language': browser_language,
+                'browser_type': browser_type,
+                'city': city,
+                'country': country,
+                'device_type': device_type,
+                'duration': duration,
+                'enhanced_event_list': enhanced_event_list,
+                'enhanced_traffic_group': enhanced_traffic_group,
+                'hmci': hmci,
+                'hmcu': hmcu,
+                'hmkw': hmkw,
+                'hmpl': hmpl,
+                'hmsr': hmsr,
+                'ip': ip,
+                'is_first_day': is_first_day,
+                'is_first_time': is_first_time,
+                'is_session_end': is_session_end,
+                'is_session_start': is_session_start,
+                'latest_landing_page': latest_landing_page,
+                'latest_referrer': latest_referrer,
+                'latest_referrer_host': latest_referrer_host,
+                'latest_referrer_host_sld': latest_referrer_host_sld,
+                'latest_search_engine': latest_search_engine,
+                'latest_search_keyword': latest_search_keyword,
+                'latest_traffic_source_type': latest_traffic_source_type,
+                'latest_utm_campaign': latest_utm_campaign,
+                'latest_utm_content': latest_utm_content,
+                'latest_utm_medium': latest_utm_medium,
+                'latest_utm_source': latest_utm_source,
+                'latest_utm_term': latest_utm_term,
+                'next_event_id': prev_event_id,
+                'onsite_search_term': onsite_search_term,
+                'os': _os,
+                'os_type': os_type,
+                'prev_event_id': prev_event_id,
+                'province': province,
+                'referrer': referrer,
+                'referrer_host': referrer_host,
+                'referrer_host_sld': referrer_host_sld,
+                'resolution': resolution,
+                'screen_height': screen_height,
+                'screen_width': screen_width,
+                'session_start_time': session_start_time,
+                'traffic_source_type': traffic_source_type,
+                'url': url,
+                'url_full_path': url_full_path,
+                'url_host': url_host,
+                'url_host_sld': url_host_sld,
+                'url_path': url_path,
+                'url_query': url_query,
+                'utm_campaign': utm_campaign,
+                'utm_content': utm_content,
+                'utm_medium': utm_medium,
+                'utm_source': utm_source,
+                'utm_term': utm_term,
+                'visitor_type': visitor_type,
+                'wx_share_from': wx_share_from,
+                **ct_params
+            }
+            event_list.append(event)
+
+        yield {
+            'visitor': visitor,
+            'session': session,
+            'event_list': event_list
+        }
+
+
+if __name__ == '__main__':
+    pass
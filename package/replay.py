@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Replay stored raw data through the parser, e.g. after changing dimensions.yaml.
+
+Sources:
+    - json files written by saveRawData (data/{site_id}_raw_data.json)
+    - archive files written in archive mode (*.jsonl.gz / *.jsonl.zst)
+    - MongoDB documents in website_traffic.log
+
+Redis is not modified: first_day is replayed from scratch in memory, ip_location is only read.
+The state is resolved in payload order in the main process, so the result does not depend on the workers.
+A session found in several (overlapping) payloads is written again only if it has changed.
+
+Sinks:
+    - null: parse only, report throughput
+    - jsonl: write one entity ({'visitor', 'session', 'event_list'}) per line
+    - path/to/file.py:function: call function(entity) for each entity, e.g. ../demo/PostgreSQL/main.py:saveToDB
+      a module level flush() is called at the end, if defined (e.g. for buffered bulk writes)
+
+Usage:
+    python3 replay.py data/archive/16847648 --workers 4 --sink jsonl --output result.jsonl
+    python3 replay.py --mongodb --site-id 16847648 --start '2023-03-01 00:00:00' --end '2023-04-01 00:00:00'
+"""
+import argparse
+import importlib.util
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from raw_parser import loadRawData, parseItems, resolvePageState
+from utils import *
+
+
+class ReplayCache(PageCache):
+    """
+    回放使用的状态缓存: 在多份原始数据间保留, 首次访问日期只保存在内存中, IP 地区信息只读取 Redis, 不写回
+    """
+    def prefetch(self, ips: list, visitor_ids: list) -> None:
+        """
+        批量读取尚未缓存的 IP 地区信息, 不读取首次访问日期 (Redis 中为当前的数据, 不适用于历史数据)
+        :param ips: IP 地址列表
+        :param visitor_ids: 访客 ID 列表
+        :return: None
+        """
+        ips = list(dict.fromkeys(ip for ip in ips if ip and ip not in self.ip_location))
+        if ips:
+            self.ip_location.update(zip(ips, rd.hmget('ip_location', ips)))
+        return None
+
+    def getFirstDay(self, visitor_id: str) -> str:
+        """
+        获取回放过程中记录的首次访问日期
+        :param visitor_id: 访客 ID
+        :return: 日期, 没有记录时为 None
+        """
+        return self.first_day.get(visitor_id)
+
+    def flush(self) -> None:
+        """
+        不写回 Redis, 新增的状态保留在内存中
+        :return: None
+        """
+        self.pending_ip_location = {}
+        self.pending_first_day = {}
+        return None
+
+
+def iterFiles(paths: list):
+    """
+    遍历原始数据文件
+    :param paths: 文件或目录列表
+    :return: 生成器, 每次返回一个文件路径
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(('.json', '.jsonl.gz', '.jsonl.zst')):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def iterFilePayloads(paths: list):
+    """
+    读取文件中的原始数据
+    :param paths: 文件或目录列表
+    :return: 生成器, 每次返回一份原始数据
+    """
+    for path in iterFiles(paths):
+        if path.endswith('.json'):
+            with open(path, 'rb') as f:
+                yield f.read()
+        else:
+            for record in readArchive(path):
+                yield record['content']
+
+def iterMongoPayloads(site_id: str='', start: str='', end: str=''):
+    """
+    读取 MongoDB 中的原始数据日志
+    :param site_id: 站点 ID
+    :param start: 开始时间, 如 2023-03-01 00:00:00
+    :param end: 结束时间
+    :return: 生成器, 每次返回一份原始数据
+    """
+    query = {}
+    if site_id:
+        query['site_id'] = site_id
+    if start or end:
+        query['timestamp'] = {}
+        if start:
+            query['timestamp']['$gte'] = start
+        if end:
+            query['timestamp']['$lt'] = end
+    collection = getMongoClient()['website_traffic']['log']
+    for doc in collection.find(query, {'_id': 0, 'items': 1}).sort('timestamp', 1):
+        yield doc
+
+def replayPayloads(payloads, workers: int=0, cache: ReplayCache=None):
+    """
+    并行解析原始数据, 按原始顺序返回结果; 同时在途的任务数有上限, 内存占用不随数据量增长
+    依赖状态的字段 (地区信息, 首次访问日期) 在主进程中按顺序解析, 子进程只做无状态的解析
+    :param payloads: 原始数据可迭代对象
+    :param workers: 进程数, 默认为 CPU 核数
+    :param cache: 状态缓存, 默认为新的 ReplayCache
+    :return: 生成器, 每次返回一份原始数据的解析结果
+    """
+    workers = workers or os.cpu_count()
+    cache = cache or ReplayCache()
+    if workers == 1:
+        for payload in payloads:
+            items = loadRawData(payload)
+            yield parseItems(items, False, resolvePageState(items, cache))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        for payload in payloads:
+            items = loadRawData(payload)
+            futures.append(executor.submit(parseItems, items, False, resolvePageState(items, cache)))
+            if len(futures) >= workers * 2:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+def loadSink(sink: str, output: str=''):
+    """
+    加载数据写入函数
+    :param sink: null / jsonl / path/to/file.py:function
+    :param output: jsonl 输出文件路径
+    :return: (写入函数, 刷新函数, 关闭函数)
+    """
+    if sink == 'null':
+        return (lambda entity: None, lambda: None, lambda: None)
+    if sink == 'jsonl':
+        f = open(output or 'replay_result.jsonl', 'wb')
+        return (lambda entity: f.write(json.dumps(entity, default=dict) + b'\n'), f.flush, f.close) # default: compact events
+    path, func_name = sink.rsplit(':', 1)
+    path = os.path.abspath(path)
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(path))[0], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    flush = getattr(module, 'flush', lambda: None)
+    return (getattr(module, func_name), flush, flush)
+
+def replay(payloads, sink: str='null', output: str='', workers: int=0, report_every: int=100) -> dict:
+    """
+    回放原始数据
+    :param payloads: 原始数据可迭代对象
+    :param sink: 数据写入方式
+    :param output: jsonl 输出文件路径
+    :param workers: 进程数
+    :param report_every: 每处理多少份原始数据输出一次吞吐量
+    :return: 统计信息字典
+    """
+    write, flush, close = loadSink(sink, output)
+    stats = {'payloads': 0, 'sessions': 0, 'events': 0, 'duplicates': 0}
+    written = {} # {session_id: (duration, visit_pages, events)}, the version last written
+    start = time.perf_counter()
+
+    def report() -> None:
+        """
+        输出已处理的数据量及吞吐量
+        :return: None
+        """
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(
+            f"payloads: {stats['payloads']} ({stats['payloads'] / elapsed:.1f}/s), "
+            f"sessions: {stats['sessions']} ({stats['sessions'] / elapsed:.1f}/s), "
+            f"events: {stats['events']} ({stats['events'] / elapsed:.1f}/s), "
+            f"duplicates: {stats['duplicates']}, "
+            f"elapsed: {elapsed:.1f}s"
+        )
+
+    try:
+        for result in replayPayloads(payloads, workers):
+            for entity in result:
+                session = entity['session']
+                version = (session['duration'], session['visit_pages'], len(entity['event_list']))
+                if written.get(session['session_id']) == version:
+                    stats['duplicates'] += 1 # unchanged since an earlier poll
+                    continue
+                written[session['session_id']] = version
+                write(entity)
+                stats['sessions'] += 1
+                stats['events'] += len(entity['event_list'])
+            stats['payloads'] += 1
+            if stats['payloads'] % report_every == 0:
+                report()
+    finally:
+        close()
+    report()
+    stats['elapsed'] = time.perf_counter() - start
+    return stats
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Replay stored raw data through the parser.')
+    arg_parser.add_argument('paths', nargs='*', help='raw data json files, archive files, or directories')
+    arg_parser.add_argument('--mongodb', action='store_true', help='read raw data from MongoDB website_traffic.log')
+    arg_parser.add_argument('--site-id', default='', help='MongoDB only, filter by site_id')
+    arg_parser.add_argument('--start', default='', help='MongoDB only, e.g. 2023-03-01 00:00:00')
+    arg_parser.add_argument('--end', default='', help='MongoDB only, e.g. 2023-04-01 00:00:00')
+    arg_parser.add_argument('--workers', type=int, default=0, help='parser processes, default is the number of CPUs')
+    arg_parser.add_argument('--sink', default='null', help='null, jsonl, or path/to/file.py:function')
+    arg_parser.add_argument('--output', default='', help='output file of the jsonl sink')
+    args = arg_parser.parse_args()
+
+    if args.mongodb:
+        payloads = iterMongoPayloads(args.site_id, args.start, args.end)
+    else:
+        payloads = iterFilePayloads(args.paths)
+    replay(payloads, sink=args.sink, output=args.output, workers=args.workers)
+    print('done.')
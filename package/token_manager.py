@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Shared access token of Baidu openapi.
+The token is kept in memory and refreshed in background before it expires.
+Refreshes are serialized across threads and processes with a file lock, and the token saved by another process is reused.
+"""
+from contextlib import contextmanager
+
+from utils import *
+
+try:
+    import fcntl
+except:
+    fcntl = None
+
+
+class TokenManager(object):
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.client_id = CONFIG['baidu']['api_key']
+        self.client_secret = CONFIG['baidu']['secret_key']
+        self.auth_code = CONFIG['baidu']['auth_code']
+        self.refresh_margin = CONFIG['baidu']['token_refresh_margin']
+        self.lock_path = f'{CURRENT_PATH}/data/token.lock'
+        self.sess = requests.Session()
+        self.lock = threading.RLock()
+        self.thread = None
+        self.load()
+
+    @classmethod
+    def getInstance(cls):
+        """
+        获取进程内共享的 TokenManager
+        :return: TokenManager
+        """
+        with cls.instance_lock:
+            if cls.instance is None:
+                cls.instance = cls()
+        return cls.instance
+
+    def load(self) -> None:
+        """
+        从 data.db 读取 token 信息
+        :return: None
+        """
+        token_info = queryTokenInfo()
+        self.access_token = token_info['access_token']['value']
+        self.refresh_token = token_info['refresh_token']['value']
+        self.access_token_expires = token_info['access_token']['expires']
+        return None
+
+    def isFresh(self) -> bool:
+        """
+        access token 是否存在且距离过期超过 token_refresh_margin
+        :return: bool
+        """
+        return bool(self.access_token) and (self.access_token_expires - self.refresh_margin > arrow.utcnow().timestamp())
+
+    def isExpired(self) -> bool:
+        """
+        access token 是否不存在或已过期
+        :return: bool
+        """
+        return not self.access_token or self.access_token_expires <= arrow.utcnow().timestamp()
+
+    @contextmanager
+    def processLock(self):
+        """
+        跨线程、跨进程的刷新锁
+        """
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def requestToken(self, params: dict) -> dict:
+        """
+        请求 token 接口, 并保存 token 信息
+        :param params: 请求参数
+        :return: token 信息字典
+        """
+        url = 'http://openapi.baidu.com/oauth/2.0/token'
+        resp = self.sess.get(url, params=params, timeout=(10, 30))
+        content = resp.json()
+        if content.get('error'):
+            print(content)
+            return content
+        self.refresh_token = content['refresh_token']
+        self.access_token = content['access_token']
+        self.access_token_expires = arrow.utcnow().timestamp() + content['expires_in']
+        token_info = {
+            'access_token': {
+                'value': self.access_token,
+                'expires': self.access_token_expires
+            },
+            'refresh_token': {
+                'value': self.refresh_token,
+                'expires': 0
+            }
+        }
+        saveTokenInfo(token_info)
+        return content
+
+    def genToken(self, force: bool=False) -> dict:
+        """
+        生成 token (使用授权码), 若其他进程已生成则直接使用其结果
+        :param force: 是否强制重新生成
+        :return: token 信息字典
+        """
+        with self.processLock():
+            self.load() # another process may have generated the token
+            if self.access_token and not force:
+                return {}
+            params = {
+                'grant_type': 'authorization_code',
+                'code': self.auth_code,
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'redirect_uri': 'oob'
+            }
+            return self.requestToken(params)
+
+    def refreshAccessToken(self, force: bool=False) -> dict:
+        """
+        刷新 token, 若其他进程已刷新则直接使用其结果
+        :param force: 是否强制刷新
+        :return: token 信息字典
+        """
+        with self.processLock():
+            self.load()
+            if self.isFresh() and not force:
+                return {}
+            params = {
+                'grant_type': 'refresh_token',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'refresh_token': self.refresh_token
+            }
+            return self.requestToken(params)
+
+    def ensureToken(self) -> str:
+        """
+        确保 token 可用, 必要时生成或刷新
+        只在 token 已过期时同步刷新, 即将过期 (token_refresh_margin 内) 的 token 由后台线程刷新
+        :return: access token
+        """
+        if not self.access_token:
+            self.genToken()
+        if self.isExpired():
+            self.refreshAccessToken()
+        return self.access_token
+
+    def run(self) -> None:
+        """
+        后台刷新线程: 在 token 过期前刷新, 等待期间定期重新读取 (其他进程可能已刷新), 失败时稍后重试
+        :return: None
+        """
+        while True:
+            wait = self.access_token_expires - self.refresh_margin - arrow.utcnow().timestamp()
+            if wait > 0:
+                time.sleep(min(wait, 600)) # re-check regularly, another process may have refreshed the token
+                self.load()
+                continue
+            try:
+                self.refreshAccessToken()
+            except:
+                traceback.print_exc()
+            if not self.isFresh():
+                time.sleep(60) # retry later
+        return None
+
+    def start(self) -> None:
+        """
+        启动后台刷新线程
+        :return: None
+        """
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='token_refresher', daemon=True)
+                self.thread.start()
+        return None
+
+
+if __name__ == '__main__':
+    pass
@@ -1,10 +1,25 @@
 #!/usr/bin/env python3
 # -*- coding:utf-8 -*-
+import atexit
+import bisect
+import calendar
 import codecs
+import csv
+import datetime
+import gzip
+import ipaddress
 import os
+import queue
 import re
 import sqlite3
+import threading
+import time
 import traceback
+from array import array
+from collections import namedtuple
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from urllib.parse import parse_qs, unquote_plus, urlparse
 
 import arrow
@@ -13,12 +28,18 @@ import orjson as json
 import redis
 import requests
 import yaml
+from requests.adapters import HTTPAdapter
 
 try:
     from pymongo import MongoClient
 except:
     pass
 
+try:
+    import zstandard
+except:
+    zstandard = None
+
 CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
 
 
@@ -51,6 +72,64 @@ def loadDimensions() -> dict:
 
 DIMENSIONS = loadDimensions()
 
+DIVISIONS = None
+
+def loadDivisions() -> dict:
+    """
+    加载行政区划数据到内存, 并建立子串索引 (等价于 LIKE '%name%' 查询)
+    :return: 行政区划索引字典
+    """
+    with sqlite3.connect(f'{CURRENT_PATH}/data/divisions.db') as con:
+        cur = con.cursor()
+        provinces = cur.execute('SELECT code, name FROM province').fetchall()
+        cities = cur.execute('SELECT code, name FROM city').fetchall()
+        areas = cur.execute('SELECT code, name, provinceCode FROM area').fetchall()
+    return buildDivisions(provinces, cities, areas)
+
+def buildDivisions(provinces: list, cities: list, areas: list) -> dict:
+    """
+    建立行政区划索引
+    :param provinces: [(code, name), ...]
+    :param cities: [(code, name), ...]
+    :param areas: [(code, name, provinceCode), ...]
+    :return: 行政区划索引字典
+    """
+    def buildIndex(rows: list) -> dict:
+        # every substring of a name -> rows whose name contains it, in table order
+        index = {}
+        for row in rows:
+            name = row[0]
+            subs = {name[i:j] for i in range(len(name)) for j in range(i + 1, len(name) + 1)}
+            for sub in subs:
+                index.setdefault(sub, []).append(row)
+        return index
+
+    divisions = {
+        'province_name': {code: name for code, name in provinces},
+        'city_name': {code: name for code, name in cities},
+        'city_index': buildIndex([(name, code) for code, name in cities]),
+        'area_index': buildIndex([(name, code, province_code) for code, name, province_code in areas]),
+    }
+    # precomputed ambiguity: names that resolve to exactly one city (or county-level area) need no IP lookup
+    divisions['unique'] = {}
+    for sub, rows in divisions['area_index'].items():
+        if len(rows) == 1 and sub not in divisions['city_index']:
+            divisions['unique'][sub] = rows[0][:2]
+    for sub, rows in divisions['city_index'].items():
+        if len(rows) == 1:
+            divisions['unique'][sub] = rows[0]
+    return divisions
+
+def getDivisions() -> dict:
+    """
+    获取内存中的行政区划索引, 首次调用时加载
+    :return: 行政区划索引字典
+    """
+    global DIVISIONS
+    if DIVISIONS is None:
+        DIVISIONS = loadDivisions()
+    return DIVISIONS
+
 def queryTokenInfo() -> dict:
     """
     查询 token 信息
@@ -82,6 +161,202 @@ def saveTokenInfo(token_info: dict) -> None:
             )
     return None
 
+class BackgroundWriter(object):
+    """
+    后台写入线程: put() 立即返回, 后台线程将队列中的数据分批交给 write 函数处理, 进程退出前写完剩余数据
+    """
+    def __init__(self, write, batch_size: int=100, queue_size: int=1000, name: str='writer'):
+        """
+        :param write: 写入函数, 参数为一批数据的列表
+        :param batch_size: 每批最多数据条数
+        :param queue_size: 队列长度, 队列已满时新数据被丢弃
+        :param name: 线程名称
+        """
+        self.write = write
+        self.batch_size = batch_size
+        self.name = name
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, item) -> bool:
+        """
+        提交数据, 队列已满时丢弃并返回 False, 不阻塞调用方
+        :param item: 数据
+        :return: 是否提交成功
+        """
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            print(f'{self.name}: queue is full, item dropped.')
+            return False
+
+    def run(self) -> None:
+        """
+        后台线程: 从队列中取出数据分批写入, 收到结束信号 (None) 后写完本批数据并退出
+        :return: None
+        """
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch: # stop signal
+                stop = True
+            items = [x for x in batch if x is not None]
+            try:
+                if items:
+                    self.write(items)
+            except:
+                traceback.print_exc()
+            for _ in batch:
+                self.queue.task_done()
+        return None
+
+    def flush(self) -> None:
+        """
+        等待队列中的数据全部写入
+        :return: None
+        """
+        self.queue.join()
+        return None
+
+    def close(self) -> None:
+        """
+        写完剩余数据并结束后台线程
+        :return: None
+        """
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        return None
+
+MONGO_CLIENT = None
+MONGO_WRITER = None
+
+def getMongoClient():
+    """
+    获取 MongoDB 客户端, 进程内复用同一个连接池
+    :return: MongoClient
+    """
+    global MONGO_CLIENT
+    if MONGO_CLIENT is None:
+        MONGO_CLIENT = MongoClient(CONFIG['mongodb']['uri'])
+    return MONGO_CLIENT
+
+def insertRawLogs(logs: list) -> None:
+    """
+    批量写入原始数据日志到 MongoDB
+    :param logs: 日志列表
+    :return: None
+    """
+    collection = getMongoClient()['website_traffic']['log']
+    collection.insert_many(logs, ordered=False)
+    return None
+
+def getMongoWriter() -> BackgroundWriter:
+    """
+    获取 MongoDB 后台写入线程
+    :return: BackgroundWriter
+    """
+    global MONGO_WRITER
+    if MONGO_WRITER is None:
+        MONGO_WRITER = BackgroundWriter(
+            insertRawLogs,
+            batch_size=CONFIG['mongodb']['batch_size'],
+            queue_size=CONFIG['mongodb']['queue_size'],
+            name='mongodb_writer'
+        )
+    return MONGO_WRITER
+
+ARCHIVE_WRITER = None
+
+def getArchivePath(site_id: str, timestamp: float) -> str:
+    """
+    获取原始数据归档文件路径, 按站点及时间切分
+    :param site_id: 站点 ID
+    :param timestamp: 时间戳
+    :return: 文件路径, 如 data/archive/16847648/16847648_2023033007.jsonl.gz
+    """
+    archive_path = CONFIG['archive']['path']
+    archive_path = archive_path if os.path.isabs(archive_path) else f'{CURRENT_PATH}/{archive_path}'
+    segment = time.strftime('%Y%m%d%H' if CONFIG['archive']['rotate'] == 'hour' else '%Y%m%d', time.localtime(timestamp))
+    suffix = 'zst' if CONFIG['archive']['compression'] == 'zstd' else 'gz'
+    return f'{archive_path}/{site_id}/{site_id}_{segment}.jsonl.{suffix}'
+
+def appendArchive(records: list) -> None:
+    """
+    追加写入原始数据归档, 每批数据压缩为一个独立的 gzip member / zstd frame
+    :param records: [(文件路径, 一行 json), ...]
+    :return: None
+    """
+    segments = {}
+    for path, line in records:
+        segments.setdefault(path, []).append(line)
+    for path, lines in segments.items():
+        data = b''.join(lines)
+        if path.endswith('.zst'):
+            data = zstandard.ZstdCompressor().compress(data)
+        else:
+            data = gzip.compress(data, compresslevel=6)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as f:
+            f.write(data)
+    return None
+
+def readArchive(path: str):
+    """
+    读取原始数据归档文件
+    :param path: 文件路径
+    :return: 生成器, 每次返回 {'site_id': ..., 'timestamp': ..., 'content': ...}
+    """
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('reading zstd archives requires the zstandard package')
+        with open(path, 'rb') as f:
+            reader = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+            buffer = b''
+            while True:
+                chunk = reader.read(1 << 20)
+                if not chunk:
+                    break
+                lines = (buffer + chunk).split(b'\n')
+                buffer = lines.pop()
+                for line in lines:
+                    if line:
+                        yield json.loads(line)
+            if buffer:
+                yield json.loads(buffer)
+    else:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def getArchiveWriter() -> BackgroundWriter:
+    """
+    获取原始数据归档后台写入线程
+    :return: BackgroundWriter
+    """
+    global ARCHIVE_WRITER
+    if ARCHIVE_WRITER is None:
+        # check before any payload is queued, a failure in the writer thread would drop them
+        if CONFIG['archive']['compression'] == 'zstd' and zstandard is None:
+            print('archive_writer: zstandard is not installed, fall back to gzip.')
+            CONFIG['archive']['compression'] = 'gzip'
+        ARCHIVE_WRITER = BackgroundWriter(
+            appendArchive,
+            batch_size=CONFIG['archive']['batch_size'],
+            queue_size=CONFIG['archive']['queue_size'],
+            name='archive_writer'
+        )
+    return ARCHIVE_WRITER
+
 def saveRawData(site_id: str, content: dict) -> None:
     """
     保存原始数据
@@ -89,14 +364,27 @@ def saveRawData(site_id: str, content: dict) -> None:
     :param content: 原始数据
     :return: None
     """
-    # save raw data as json file for debug.
-    try:
-        with codecs.open(f'{CURRENT_PATH}/data/{site_id}_raw_data.json', 'w', 'utf-8') as f:
-            f.write(json.dumps(content, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode('utf-8'))
-    except:
-        traceback.print_exc()
+    if CONFIG['archive']['enable']:
+        # append raw data to the compressed archive, in background
+        try:
+            now = time.time()
+            line = json.dumps({
+                'site_id': site_id,
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+                'content': content
+            }) + b'\n'
+            getArchiveWriter().put((getArchivePath(site_id, now), line))
+        except:
+            traceback.print_exc()
+    else:
+        # save raw data as json file for debug.
+        try:
+            with codecs.open(f'{CURRENT_PATH}/data/{site_id}_raw_data.json', 'w', 'utf-8') as f:
+                f.write(json.dumps(content, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode('utf-8'))
+        except:
+            traceback.print_exc()
 
-    # save raw data to mongodb
+    # save raw data to mongodb, in background
     if CONFIG['mongodb']['enable']:
         try:
             log = {
@@ -104,25 +392,53 @@ def saveRawData(site_id: str, content: dict) -> None:
                 'timestamp': arrow.now().format('YYYY-MM-DD HH:mm:ss'),
                 'items': content.get('data', content.get('result'))['items']
             }
-            mongodb_uri = CONFIG['mongodb']['uri']
-            client = MongoClient(mongodb_uri)
-            db = client['website_traffic']
-            collection = db['log']
-            if isinstance(log, list):
-                collection.insert_many(log)
-            else:
-                collection.insert_one(log)
+            getMongoWriter().put(log)
         except:
             traceback.print_exc()
 
     return None
 
+TIME_PATTERN = re.compile(r'^(?:(\d{4})[-/](\d{1,2})[-/](\d{1,2})\s+)?(\d{1,2}):(\d{2}):(\d{2})$')
+
+@lru_cache(maxsize=4096)
+def getDayEpoch(year: int, month: int, day: int) -> int:
+    """
+    获取某日零点的时间戳 (按 UTC 计算, 与 arrow.get 对无时区时间的处理一致)
+    :param year: 年
+    :param month: 月
+    :param day: 日
+    :return: 时间戳
+    """
+    datetime.date(year, month, day) # raise ValueError if the date is invalid
+    return calendar.timegm((year, month, day, 0, 0, 0))
+
 def getTime(start_time: str) -> tuple:
     """
     处理时间信息
-    :param start_time: 开始时间
+    :param start_time: 开始时间, 如 2023/03/30 07:56:57, 2023-03-30 07:56:57, 07:56:57
     :return: 时间信息元组
     """
+    # fast path for the fixed formats returned by Baidu
+    match = TIME_PATTERN.match(start_time)
+    if match:
+        year, month, day, hour, minute, second = match.groups()
+        if year:
+            year, month, day = int(year), int(month), int(day)
+        else:
+            # handle no date in start_time
+            today = datetime.date.today()
+            year, month, day = today.year, today.month, today.day
+        hour, minute, second = int(hour), int(minute), int(second)
+        if hour < 24 and minute < 60 and second < 60:
+            try:
+                day_epoch = getDayEpoch(year, month, day)
+            except ValueError:
+                pass
+            else:
+                start_time = f'{year:04d}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:{second:02d}'
+                unix_timestamp = float(day_epoch + hour * 3600 + minute * 60 + second)
+                return (start_time, start_time, unix_timestamp)
+
     # handle no date in start_time
     try:
         start_time = arrow.get(start_time).format('YYYY-MM-DD HH:mm:ss')
@@ -133,12 +449,176 @@ def getTime(start_time: str) -> tuple:
     unix_timestamp = arrow.get(start_time).timestamp()
     return (start_time, date_time, unix_timestamp)
 
+def getTimes(start_times: list) -> list:
+    """
+    批量处理时间信息
+    :param start_times: 开始时间列表
+    :return: 时间信息元组列表
+    """
+    return [getTime(start_time) for start_time in start_times]
+
+# keep-alive connections shared by all LBS requests
+lbs_sess = requests.Session()
+lbs_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(CONFIG['lbs']['workers'], 1))
+lbs_sess.mount('https://', lbs_adapter)
+lbs_sess.mount('http://', lbs_adapter)
+
+class CircuitBreaker(object):
+    """
+    LBS 服务熔断: 连续失败达到阈值后, 在冷却时间内跳过该服务; 冷却结束后放行一次试探请求
+    """
+    def __init__(self, threshold: int, cooldown: int):
+        """
+        :param threshold: 连续失败次数阈值
+        :param cooldown: 冷却时间 (秒)
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.opened_at = {}
+        self.lock = threading.Lock()
+
+    def allow(self, provider: str) -> bool:
+        """
+        是否可以请求该服务, 冷却结束后放行一次试探请求
+        :param provider: 服务名称
+        :return: bool
+        """
+        with self.lock:
+            opened_at = self.opened_at.get(provider)
+            if opened_at is None:
+                return True
+            if time.time() - opened_at < self.cooldown:
+                return False
+            self.opened_at[provider] = time.time() # half-open, let one request through and wait for its result
+            return True
+
+    def success(self, provider: str) -> None:
+        """
+        记录一次成功请求, 清空失败计数并关闭熔断
+        :param provider: 服务名称
+        :return: None
+        """
+        with self.lock:
+            self.failures.pop(provider, None)
+            self.opened_at.pop(provider, None)
+        return None
+
+    def failure(self, provider: str) -> None:
+        """
+        记录一次失败请求, 连续失败达到阈值时开启熔断
+        :param provider: 服务名称
+        :return: None
+        """
+        with self.lock:
+            self.failures[provider] = self.failures.get(provider, 0) + 1
+            if self.failures[provider] >= self.threshold:
+                self.opened_at[provider] = time.time()
+        return None
+
+LBS_BREAKER = CircuitBreaker(CONFIG['lbs']['breaker_threshold'], CONFIG['lbs']['breaker_cooldown'])
+
+# IPs that no service could locate, {ip: expire timestamp}, shared by the threads of resolveLocations
+LBS_NEGATIVE_CACHE = {}
+LBS_NEGATIVE_LOCK = threading.Lock()
+
+def addNegativeCache(ip: str, limit: int=100000):
+    """
+    记录无法定位的 IP, 在 negative_ttl 内不再查询
+    :param ip: IP 地址
+    :param limit: 缓存上限
+    :return:
+    """
+    now = time.time()
+    with LBS_NEGATIVE_LOCK:
+        # re-insert at the end, so with the same ttl the entries stay ordered by expiry
+        LBS_NEGATIVE_CACHE.pop(ip, None)
+        LBS_NEGATIVE_CACHE[ip] = now + CONFIG['lbs']['negative_ttl']
+        # drop the expired entries first, then the ones closest to expiry
+        while LBS_NEGATIVE_CACHE:
+            oldest = next(iter(LBS_NEGATIVE_CACHE))
+            if LBS_NEGATIVE_CACHE[oldest] > now and len(LBS_NEGATIVE_CACHE) <= limit:
+                break
+            del LBS_NEGATIVE_CACHE[oldest]
+
+IP_DATABASE = None
+IP_DATABASE_LOCK = threading.Lock()
+
+def loadIPDatabase(path: str) -> dict:
+    """
+    加载本地 IP 地址库, 按起始地址排序, 以便二分查找
+    文件为 csv 格式, 每行: start_ip,end_ip,country,province,provinceCode,city,cityCode (IP 可为点分十进制或整数)
+    :param path: 文件路径, 相对路径以 package 目录为准
+    :return: IP 地址库字典
+    """
+    path = path if os.path.isabs(path) else f'{CURRENT_PATH}/{path}'
+    ranges = []
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or row[0] == 'start_ip':
+                continue
+            start_ip, end_ip = [int(x) if x.isdigit() else int(ipaddress.IPv4Address(x)) for x in row[:2]]
+            ranges.append((start_ip, end_ip, tuple(x.strip() for x in row[2:7])))
+    ranges.sort()
+    locations = {}
+    database = {
+        'starts': array('L', [x[0] for x in ranges]),
+        'ends': array('L', [x[1] for x in ranges]),
+        'locations': [locations.setdefault(x[2], x[2]) for x in ranges] # share identical location tuples
+    }
+    return database
+
+def queryIPDatabase(ip: str) -> dict:
+    """
+    查询本地 IP 地址库 (需在配置文件中设置 lbs.ip_database)
+    :param ip: IP 地址
+    :return: IP 信息字典, 未配置或未查询到时返回 None
+    """
+    global IP_DATABASE
+    path = CONFIG['lbs'].get('ip_database')
+    if not path:
+        return None
+    if IP_DATABASE is None:
+        with IP_DATABASE_LOCK:
+            if IP_DATABASE is None:
+                try:
+                    IP_DATABASE = loadIPDatabase(path)
+                except:
+                    # logged once, the online services are used instead
+                    traceback.print_exc()
+                    print(f'ip_database: failed to load {path}, disabled.')
+                    IP_DATABASE = {'starts': array('L'), 'ends': array('L'), 'locations': []}
+    try:
+        n = int(ipaddress.IPv4Address(ip))
+    except ValueError:
+        return None
+    idx = bisect.bisect_right(IP_DATABASE['starts'], n) - 1
+    if idx < 0 or n > IP_DATABASE['ends'][idx]:
+        return None
+    country, province, provinceCode, city, cityCode = IP_DATABASE['locations'][idx]
+    result = {
+        'country': country,
+        'province': province,
+        'provinceCode': provinceCode,
+        'city': city,
+        'cityCode': cityCode,
+        'lbs_service': 'local'
+    }
+    return result
+
 def lbs(ip: str) -> dict:
     """
-    获取 IP 地址信息
+    获取 IP 地址信息, 优先查询本地 IP 地址库
     :param ip: IP 地址
     :return: IP 信息字典
     """
+    try:
+        result = queryIPDatabase(ip)
+        if result:
+            return result
+    except:
+        traceback.print_exc()
+
     country = ''
     province = ''
     provinceCode = ''
@@ -147,7 +627,12 @@ def lbs(ip: str) -> dict:
 
     lbs_service = CONFIG['lbs']['service']
     lbs_app_key = CONFIG['lbs']['app_key']
-    if all([lbs_service, lbs_app_key]):
+    with LBS_NEGATIVE_LOCK:
+        expires = LBS_NEGATIVE_CACHE.get(ip)
+    if expires and expires > time.time():
+        return {'country': '', 'province': '', 'provinceCode': '', 'city': '', 'cityCode': '', 'lbs_service': 'negative_cache'}
+    answered = False
+    if all([lbs_service, lbs_app_key]) and LBS_BREAKER.allow(lbs_service):
         try:
             if lbs_service == 'amap':
                 url = 'https://restapi.amap.com/v3/ip'
@@ -155,7 +640,7 @@ def lbs(ip: str) -> dict:
                     'ip': ip,
                     'key': lbs_app_key,
                 }
-                resp = requests.get(url, params=params, timeout=(10, 30))
+                resp = lbs_sess.get(url, params=params, timeout=(10, 30))
                 data = resp.json()
                 adcode = data['adcode']
                 if adcode:
@@ -171,7 +656,7 @@ def lbs(ip: str) -> dict:
                     'ip': ip,
                     'ak': lbs_app_key
                 }
-                resp = requests.get(url, params=params,  timeout=(10, 30))
+                resp = lbs_sess.get(url, params=params, timeout=(10, 30))
                 data = resp.json()
                 if data['status'] == 0:
                     address_detail = data['content']['address_detail']
@@ -188,7 +673,7 @@ def lbs(ip: str) -> dict:
                     'ip': ip,
                     'key': lbs_app_key,
                 }
-                resp = requests.get(url, params=params,  timeout=(10, 30))
+                resp = lbs_sess.get(url, params=params, timeout=(10, 30))
                 data = resp.json()
                 if data['status'] == 0:
                     content = data['result']['ad_info']
@@ -199,31 +684,39 @@ def lbs(ip: str) -> dict:
                         provinceCode = adcode[:2]
                         city = content['city']
                         cityCode = adcode[:4]
+            LBS_BREAKER.success(lbs_service)
+            answered = True
         except:
+            LBS_BREAKER.failure(lbs_service)
             traceback.print_exc()
-    else:
-        try:
-            lbs_service = 'taobao'
-            url = 'https://ip.taobao.com/outGetIpInfo'
-            params = {
-                'ip': ip,
-                'accessKey': 'alibaba-inc'
-            }
-            resp = requests.get(url, params=params, timeout=(10, 30))
-            content = resp.json()
-            data = content['data']
-            country = data['country']
-            country = '' if country == 'XX' else country
-            province = data['region']
-            province = '' if province == 'XX' else province
-            city = data['city']
-            city = '' if city == 'XX' else city
-            if country == '中国':
-                provinceCode = data['region_id'][:2]
-                provinceCode = '' if provinceCode == 'xx' else provinceCode
-                cityCode = data['city_id'][:4]
-                cityCode = '' if cityCode == 'xx' else cityCode
-        except:
+    elif not all([lbs_service, lbs_app_key]):
+        if LBS_BREAKER.allow('taobao'):
+            try:
+                lbs_service = 'taobao'
+                url = 'https://ip.taobao.com/outGetIpInfo'
+                params = {
+                    'ip': ip,
+                    'accessKey': 'alibaba-inc'
+                }
+                resp = lbs_sess.get(url, params=params, timeout=(10, 30))
+                content = resp.json()
+                data = content['data']
+                country = data['country']
+                country = '' if country == 'XX' else country
+                province = data['region']
+                province = '' if province == 'XX' else province
+                city = data['city']
+                city = '' if city == 'XX' else city
+                if country == '中国':
+                    provinceCode = data['region_id'][:2]
+                    provinceCode = '' if provinceCode == 'xx' else provinceCode
+                    cityCode = data['city_id'][:4]
+                    cityCode = '' if cityCode == 'xx' else cityCode
+                LBS_BREAKER.success('taobao')
+                answered = True
+            except:
+                LBS_BREAKER.failure('taobao')
+        if (not answered) and LBS_BREAKER.allow('pconline'):
             try:
                 lbs_service = 'pconline'
                 url = 'https://whois.pconline.com.cn/ipJson.jsp'
@@ -231,7 +724,7 @@ def lbs(ip: str) -> dict:
                     'ip': ip,
                     'json': 'true'
                 }
-                resp = requests.get(url, params=params, timeout=(10, 30))
+                resp = lbs_sess.get(url, params=params, timeout=(10, 30))
                 data = resp.json()
                 if data['proCode'] == '999999':
                     country = data['addr'].strip()
@@ -244,8 +737,13 @@ def lbs(ip: str) -> dict:
                     city = data['city'].strip()
                     cityCode = data['cityCode'][:4]
                     cityCode = '' if cityCode == '999999' else cityCode
+                LBS_BREAKER.success('pconline')
+                answered = True
             except:
-                pass
+                LBS_BREAKER.failure('pconline')
+
+    if answered and not country:
+        addNegativeCache(ip)
 
     result = {
         'country': country,
@@ -258,14 +756,168 @@ def lbs(ip: str) -> dict:
 
     return result
 
-def queryDivision(name: str, ip: str='') -> tuple:
+def resolveLocations(ips: list, workers: int=0) -> dict:
+    """
+    并发查询多个 IP 地址信息, 相同 IP 只查询一次
+    :param ips: IP 地址列表
+    :param workers: 并发数, 默认使用配置文件中的 lbs.workers
+    :return: {IP 地址: IP 信息字典}
+    """
+    result = {}
+    pending = []
+    for ip in dict.fromkeys(ips):
+        location = queryIPDatabase(ip)
+        if location:
+            result[ip] = location
+        else:
+            pending.append(ip) # online services
+    workers = min(workers or CONFIG['lbs']['workers'], len(pending))
+    if workers <= 1:
+        result.update({ip: lbs(ip) for ip in pending})
+        return result
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        result.update(zip(pending, executor.map(lbs, pending)))
+    return result
+
+class PageCache(object):
+    """
+    单页数据的 Redis 状态缓存: 解析前批量读取 ip_location 及 first_day, 解析后批量写回
+    """
+    def __init__(self):
+        self.ip_location = {}
+        self.first_day = {}
+        self.lbs_results = {}
+        self.pending_ip_location = {}
+        self.pending_first_day = {}
+
+    def prefetch(self, ips: list, visitor_ids: list) -> None:
+        """
+        批量读取 IP 地址信息及首次访问日期
+        :param ips: IP 地址列表
+        :param visitor_ids: 访客 ID 列表
+        :return: None
+        """
+        ips = list(dict.fromkeys(ip for ip in ips if ip))
+        visitor_ids = list(dict.fromkeys(visitor_id for visitor_id in visitor_ids if visitor_id))
+        if not (ips or visitor_ids):
+            return None
+        pipe = rd.pipeline(transaction=False)
+        if ips:
+            pipe.hmget('ip_location', ips)
+        if visitor_ids:
+            pipe.mget([f'first_day_{visitor_id}' for visitor_id in visitor_ids])
+        results = pipe.execute()
+        if ips:
+            self.ip_location.update(zip(ips, results.pop(0)))
+        if visitor_ids:
+            self.first_day.update(zip(visitor_ids, results.pop(0)))
+        return None
+
+    def prefetchLBS(self, areas: list, ips: list) -> None:
+        """
+        找出本页需要通过 IP 定位的会话 (地区名称有歧义、且 Redis 中没有记录), 去重后并发查询
+        :param areas: 地区名称列表
+        :param ips: IP 地址列表, 与 areas 一一对应
+        :return: None
+        """
+        pending = [
+            ip for area, ip in zip(areas, ips)
+            if ip not in self.lbs_results and isAmbiguousDivision(area) and IPV4_PATTERN.fullmatch(ip) and not self.getLocation(ip)
+        ]
+        if pending:
+            self.lbs_results.update(resolveLocations(pending))
+        return None
+
+    def getLBS(self, ip: str) -> dict:
+        """
+        获取 IP 地址信息, 优先使用 prefetchLBS 的查询结果
+        :param ip: IP 地址
+        :return: IP 信息字典
+        """
+        if ip not in self.lbs_results:
+            self.lbs_results[ip] = lbs(ip)
+        return self.lbs_results[ip]
+
+    def getLocation(self, ip: str) -> str:
+        """
+        获取 Redis 中的 IP 地区信息, 未预读的 IP 单独查询
+        :param ip: IP 地址
+        :return: 'country,province,city', 没有记录时为 None
+        """
+        if ip not in self.ip_location:
+            self.ip_location[ip] = rd.hget('ip_location', ip)
+        return self.ip_location[ip]
+
+    def setLocation(self, ip: str, location: str) -> None:
+        """
+        记录 IP 地区信息, 在 flush 时写回 Redis
+        :param ip: IP 地址
+        :param location: 'country,province,city'
+        :return: None
+        """
+        self.ip_location[ip] = location
+        self.pending_ip_location[ip] = location
+        return None
+
+    def getFirstDay(self, visitor_id: str) -> str:
+        """
+        获取访客的首次访问日期, 未预读的访客单独查询
+        :param visitor_id: 访客 ID
+        :return: 日期, 如 2023-03-30, 没有记录时为 None
+        """
+        if visitor_id not in self.first_day:
+            self.first_day[visitor_id] = rd.get(f'first_day_{visitor_id}')
+        return self.first_day[visitor_id]
+
+    def setFirstDay(self, visitor_id: str, first_day: str) -> None:
+        """
+        记录访客的首次访问日期, 在 flush 时写回 Redis
+        :param visitor_id: 访客 ID
+        :param first_day: 日期, 如 2023-03-30
+        :return: None
+        """
+        self.first_day[visitor_id] = first_day
+        self.pending_first_day[visitor_id] = first_day
+        return None
+
+    def flush(self) -> None:
+        """
+        批量写回新增的 IP 地址信息及首次访问日期
+        :return: None
+        """
+        if not (self.pending_ip_location or self.pending_first_day):
+            return None
+        pipe = rd.pipeline(transaction=False)
+        if self.pending_ip_location:
+            pipe.hset('ip_location', mapping=self.pending_ip_location)
+        for visitor_id, first_day in self.pending_first_day.items():
+            pipe.set(f'first_day_{visitor_id}', first_day, ex=60*60*24*2) # expire in 2 days.
+        pipe.execute()
+        self.pending_ip_location = {}
+        self.pending_first_day = {}
+        return None
+
+IPV4_PATTERN = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+
+def isAmbiguousDivision(name: str) -> bool:
+    """
+    地区名称是否需要通过 IP 进一步定位 (未匹配到城市, 或匹配到多个城市)
+    :param name: 地区名称
+    :return: bool
+    """
+    if name in ['北京', '上海', '天津', '重庆', '香港', '澳门', '台湾']:
+        return False
+    return name not in getDivisions()['unique']
+
+def queryDivision(name: str, ip: str='', cache: PageCache=None) -> tuple:
     """
     查询地区信息
     :param name: 地区名称
     :param ip: IP 地址
+    :param cache: 单页 Redis 状态缓存, 为空时直接读写 Redis
     :return: 地区信息元组
     """
-    is_ipv4 = re.fullmatch(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', ip)
+    is_ipv4 = IPV4_PATTERN.fullmatch(ip)
     country, province, city = '', '', ''
 
     # 直辖市
@@ -279,56 +931,36 @@ def queryDivision(name: str, ip: str='') -> tuple:
 
     # 非直辖市、非港澳台
     if province not in ['北京市', '上海市', '天津市', '重庆市', '香港', '澳门', '台湾']:
-        with sqlite3.connect(f'{CURRENT_PATH}/data/divisions.db') as con:
-            cur = con.cursor()
-
-            # 优先使用城市名称查询
-            rows = cur.execute('SELECT name, code FROM city WHERE name LIKE ?', (f'%{name}%',)).fetchall()
-            if not rows:
-                # 有可能是省直辖县级行政区划
-                rows = cur.execute('SELECT name, code FROM area WHERE name LIKE ?', (f'%{name}%',)).fetchall()
-            # 有且仅有一个结果
-            if len(rows) == 1:
-                city, cityCode = rows[0]
-                provinceCode = cityCode[:2]
-                province = cur.execute('''SELECT name FROM province WHERE code = ?''', (provinceCode,)).fetchone()[0]
-                country = '中国'
-            # 未查询到结果，或查询到多个结果，转为 IP 查询
-            else:
-                # 查询 Redis
-                location = rd.hget('ip_location', ip)
-                if location:
-                    country, province, city = location.split(',')
-                elif is_ipv4:
-                    location_info = lbs(ip)
-                    country = location_info['country']
-                    province = location_info['province']
-                    provinceCode = location_info['provinceCode']
-                    city = location_info['city']
-                    cityCode = location_info['cityCode']
-                    if all([provinceCode, cityCode]):
-                        # 城市名称规范化
-                        try:
-                            row = None
-                            q = f'''SELECT name FROM city WHERE code = {cityCode}'''
-                            row = cur.execute(q).fetchone()
-                            city = row[0] if row else ''
-                            if not city:
-                                # 有可能是省直辖县级行政区划
-                                q = f'''SELECT name FROM area WHERE name LIKE '%{name}%' AND provinceCode = {provinceCode}'''
-                                row = cur.execute(q).fetchone()
-                                city = row[0] if row else ''
-                        except:
-                            traceback.print_exc()
-                            print(name, ip)
-                        # 省份名称规范化
-                        try:
-                            row = None
-                            row = cur.execute('''SELECT name FROM province WHERE code = ?''', (provinceCode,)).fetchone()
-                            province = row[0] if row else ''
-                        except:
-                            traceback.print_exc()
-                            print(name, ip)
+        divisions = getDivisions()
+
+        # 优先使用城市名称查询, 其次有可能是省直辖县级行政区划; 有且仅有一个结果
+        if name in divisions['unique']:
+            city, cityCode = divisions['unique'][name]
+            provinceCode = cityCode[:2]
+            province = divisions['province_name'].get(provinceCode, '')
+            country = '中国'
+        # 未查询到结果，或查询到多个结果，转为 IP 查询
+        else:
+            # 查询 Redis
+            location = cache.getLocation(ip) if cache else rd.hget('ip_location', ip)
+            if location:
+                country, province, city = location.split(',')
+            elif is_ipv4:
+                location_info = cache.getLBS(ip) if cache else lbs(ip)
+                country = location_info['country']
+                province = location_info['province']
+                provinceCode = location_info['provinceCode']
+                city = location_info['city']
+                cityCode = location_info['cityCode']
+                if all([provinceCode, cityCode]):
+                    # 城市名称规范化
+                    city = divisions['city_name'].get(cityCode, '')
+                    if not city:
+                        # 有可能是省直辖县级行政区划
+                        rows = [row for row in divisions['area_index'].get(name, []) if row[2] == provinceCode]
+                        city = rows[0][0] if rows else ''
+                    # 省份名称规范化
+                    province = divisions['province_name'].get(provinceCode, '')
 
     try:
         province = re.search(r'(香港|澳门|台湾)', province).group(1)
@@ -339,7 +971,10 @@ def queryDivision(name: str, ip: str='') -> tuple:
 
     # save to redis
     if all([country, province, city]):
-        rd.hset('ip_location', ip, f'{country},{province},{city}')
+        if cache:
+            cache.setLocation(ip, f'{country},{province},{city}')
+        else:
+            rd.hset('ip_location', ip, f'{country},{province},{city}')
 
     return (country, province, city)
 
@@ -375,7 +1010,7 @@ def parseTrafficSource(source_from_type: str, source_url: str) -> dict:
 
     if source_url:
         referrer = source_url
-        referrer_host = urlparse(referrer).netloc
+        referrer_host = parseUrl(referrer).host
     else:
         referrer = ''
         referrer_host = ''
@@ -434,28 +1069,29 @@ def parseSLD(host: str) -> str:
         sld = '.'.join(terms[-2:])
     return sld
 
-def parsetUrlPath(url: str) -> tuple:
+ParsedUrl = namedtuple(
+    'ParsedUrl',
+    ['url', 'host', 'path', 'full_path', 'query', 'query_params', 'tracking_params', 'onsite_search_term']
+)
+
+@lru_cache(maxsize=50000)
+def parseUrl(url: str) -> ParsedUrl:
     """
-    解析url路径信息
+    解析 url, 同一 url 只解析一次 (结果缓存)
+    结果由所有调用方共享, query_params 及 tracking_params 为只读的 MappingProxyType, 需要修改时使用副本 (如 parsetracking_arams)
     :param url: url
-    :return: 路径信息元组
+    :return: ParsedUrl, 包含域名、路径、参数、tracking 参数、站内搜索词
     """
+    parsed = urlparse(url)
     try:
         url_path = '/' + re.sub(r'[\?#%&]\S*', '', url.split('/')[3])
-        url_full_path = urlparse(url).path
+        url_full_path = parsed.path
     except IndexError:
         url_path = '/'
         url_full_path = '/'
-    return (url_path, url_full_path)
-
-def parsetracking_arams(url: str) -> dict:
-    """
-    解析 url 中的 tracking 参数信息
-    :param url: url
-    :return: tracking 参数信息字典
-    """
-    query_params = parse_qs(urlparse(url).query, keep_blank_values=True)
+    query_params = parse_qs(parsed.query, keep_blank_values=True)
     query_params = {k: v[0] for k, v in query_params.items()}
+
     hmsr = query_params.get('hmsr', '')
     utm_source = query_params.get('utm_source', hmsr)
     hmpl = query_params.get('hmpl', '')
@@ -466,7 +1102,6 @@ def parsetracking_arams(url: str) -> dict:
     utm_term = query_params.get('utm_term', hmkw)
     hmci = query_params.get('hmci', '')
     utm_content = query_params.get('utm_content', hmci)
-
     tracking_params = {
         'utm_source': utm_source,
         'hmsr': hmsr,
@@ -478,9 +1113,46 @@ def parsetracking_arams(url: str) -> dict:
         'hmkw': hmkw,
         'utm_content': utm_content,
         'hmci': hmci,
-        'ct_params': {**{param: query_params.get(param, '') for param in DIMENSIONS['custom_tracking_params']}} # custom tracking params in dimensions.yaml
+        'ct_params': MappingProxyType({param: query_params.get(param, '') for param in DIMENSIONS['custom_tracking_params']}) # custom tracking params in dimensions.yaml
     }
 
+    onsite_search_term = ''
+    onsite_search_params = DIMENSIONS['onsite_search_params']
+    for k, v in query_params.items():
+        term = unquote_plus(v)
+        onsite_search_term = '' if k not in onsite_search_params else term
+        if onsite_search_term:
+            break
+
+    return ParsedUrl(
+        url=url,
+        host=parsed.netloc,
+        path=url_path,
+        full_path=url_full_path,
+        query=parsed.query,
+        query_params=MappingProxyType(query_params),
+        tracking_params=MappingProxyType(tracking_params),
+        onsite_search_term=onsite_search_term
+    )
+
+def parsetUrlPath(url) -> tuple:
+    """
+    解析url路径信息
+    :param url: url 或 ParsedUrl
+    :return: 路径信息元组
+    """
+    parsed = url if isinstance(url, ParsedUrl) else parseUrl(url)
+    return (parsed.path, parsed.full_path)
+
+def parsetracking_arams(url) -> dict:
+    """
+    解析 url 中的 tracking 参数信息
+    :param url: url 或 ParsedUrl
+    :return: tracking 参数信息字典 (副本, 修改不影响缓存的结果)
+    """
+    parsed = url if isinstance(url, ParsedUrl) else parseUrl(url)
+    tracking_params = dict(parsed.tracking_params)
+    tracking_params['ct_params'] = dict(tracking_params['ct_params'])
     return tracking_params
 
 def getDuration(duration: str) -> int:
@@ -497,16 +1169,21 @@ def getDuration(duration: str) -> int:
         duration = int(duration)
     return duration
 
-def saveFistVisitTime(visitor_id: str, start_time: str, is_first_time: bool) -> None:
+def saveFistVisitTime(visitor_id: str, start_time: str, is_first_time: bool, cache: PageCache=None) -> None:
     """
     保存首次访问时间
     :param visitor_id: 访客id
     :param start_time: 会话开始时间
     :param is_first_time: 是否首次访问
+    :param cache: 单页 Redis 状态缓存, 为空时直接写入 Redis
     :return: None
     """
     if is_first_time:
-        rd.set(f'first_day_{visitor_id}', arrow.get(start_time).format('YYYY-MM-DD'), ex=60*60*24*2) # expire in 2 days.
+        first_day = getTime(start_time)[0][:10]
+        if cache:
+            cache.setFirstDay(visitor_id, first_day)
+        else:
+            rd.set(f'first_day_{visitor_id}', first_day, ex=60*60*24*2) # expire in 2 days.
     return None
 
 def getScreenSize(resolution: str) -> tuple:
@@ -523,27 +1200,19 @@ def getScreenSize(resolution: str) -> tuple:
         screen_height, screen_width = 0, 0
     return (screen_height, screen_width)
 
-def parseOnSiteSearchTerm(url: str) -> str:
+def parseOnSiteSearchTerm(url) -> str:
     """
     解析 url 中的搜索词
-    :param url: url
+    :param url: url 或 ParsedUrl
     :return: 搜索词
     """
-    onsite_search_term = ''
-    query_params = parse_qs(urlparse(url).query, keep_blank_values=True)
-    query_params = {k: v[0] for k, v in query_params.items()}
-    onsite_search_params = DIMENSIONS['onsite_search_params']
-    for k, v in query_params.items():
-        term = unquote_plus(v)
-        onsite_search_term = '' if k not in onsite_search_params else term
-        if onsite_search_term:
-            break
-    return onsite_search_term
+    parsed = url if isinstance(url, ParsedUrl) else parseUrl(url)
+    return parsed.onsite_search_term
 
-def parseEnhancedEvent(url: str, duration: int, is_first_time: bool, is_session_start: bool) -> list:
+def parseEnhancedEvent(url, duration: int, is_first_time: bool, is_session_start: bool) -> list:
     """
     解析 url, 生成增强型事件列表
-    :param url: url
+    :param url: url 或 ParsedUrl
     :param duration: 时长
     :param is_first_time: 是否首次访问
     :param is_session_start: 是否会话开始
@@ -556,60 +1225,56 @@ def parseEnhancedEvent(url: str, duration: int, is_first_time: bool, is_session_
         enhanced_event_list.append('first_visit')
     if is_session_start:
         enhanced_event_list.append('session_start')
-    query_params = parse_qs(urlparse(url).query, keep_blank_values=True)
+    query_params = (url if isinstance(url, ParsedUrl) else parseUrl(url)).query_params
     onsite_search_params = DIMENSIONS['onsite_search_params']
     if any(param in query_params for param in onsite_search_params):
         enhanced_event_list.append('view_search_results')
     enhanced_event_list = sorted(enhanced_event_list)
     return enhanced_event_list
 
+SOURCE_CATEGORY = None
+
+def loadSourceCategory() -> dict:
+    """
+    加载流量渠道分类到内存
+    :return: {来源域名/品牌: 分类}
+    """
+    with sqlite3.connect(f'{CURRENT_PATH}/data/data.db') as con:
+        cur = con.cursor()
+        rows = cur.execute('SELECT source, category FROM source_category').fetchall()
+    return {source: category for source, category in rows}
+
+def reloadSourceCategory() -> None:
+    """
+    重新加载流量渠道分类 (修改 source_category 表后调用), 并清空匹配缓存
+    :return: None
+    """
+    global SOURCE_CATEGORY
+    SOURCE_CATEGORY = loadSourceCategory()
+    querySourceCategory.cache_clear()
+    return None
+
+@lru_cache(maxsize=10000)
 def querySourceCategory(referrer_host: str) -> str:
     """
     匹配流量渠道组
     :param referrer_host: 首次前向域名
     :return: 流量渠道组
     """
+    global SOURCE_CATEGORY
+    if SOURCE_CATEGORY is None:
+        SOURCE_CATEGORY = loadSourceCategory()
     category = ''
     referrer_host = re.sub(r'^(links?|redir|ref|jump2|go)\.', '', referrer_host) # remove prefix, e.g. link.zhihu.com -> zhihu.com
     sld = parseSLD(referrer_host) # Second-level domain, e.g. zhuanlan.zhihu.com -> zhihu.com
     brand = sld.split('.')[0] # e.g. zhihu.com -> zhihu
-    with sqlite3.connect(f'{CURRENT_PATH}/data/data.db') as con:
-        cur = con.cursor()
-        # match full referrer_host
-        cur.execute(
-            f'''
-                SELECT category
-                FROM source_category
-                WHERE source = '{referrer_host}'
-            '''
-        )
-        source_category = cur.fetchone()
-        if source_category:
-            category = source_category[0]
-        else:
-            # match Second-level domain
-            cur.execute(
-                f'''
-                    SELECT category
-                    FROM source_category
-                    WHERE source = '{sld}'
-                '''
-            )
-            source_category = cur.fetchone()
-            if source_category:
-                category = source_category[0]
-            else:
-                # match brand
-                cur.execute(
-                    f'''
-                        SELECT category
-                        FROM source_category
-                        WHERE source = '{brand}'
-                    '''
-                )
-                source_category = cur.fetchone()
-                if source_category:
-                    category = source_category[0]
+    # match full referrer_host, then Second-level domain, then brand
+    if referrer_host in SOURCE_CATEGORY:
+        category = SOURCE_CATEGORY[referrer_host]
+    elif sld in SOURCE_CATEGORY:
+        category = SOURCE_CATEGORY[sld]
+    elif brand in SOURCE_CATEGORY:
+        category = SOURCE_CATEGORY[brand]
     return category
 
 def parseEnhancedTrafficGroup(traffic_source_type: str, referrer_host: str, utm_source: str, utm_medium: str, utm_campaign: str) -> str:
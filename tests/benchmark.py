@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Parser benchmark on synthetic trend/latest/a payloads.
+Redis and the LBS service are replaced by local stand-ins, so no network or server is needed.
+If package/data/divisions.db is missing, a small built-in gazetteer is used instead.
+
+Usage:
+    python3 benchmark.py
+    python3 benchmark.py --sessions 1000 --path-length 8 --urls 5000 --referrers 500 --ips 20000 --repeat 5
+    python3 benchmark.py --input 16847648_raw_data.json # a saved raw data file instead of a synthetic payload
+    python3 benchmark.py --save payload.json # also save the synthetic payload, e.g. for replay.py
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+import zlib
+from os.path import abspath, dirname, join
+
+import orjson
+import orjson as json
+
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+import raw_parser
+import utils
+from raw_parser import loadRawData, parseRawData
+from utils import *
+
+CURRENT_PATH = os.path.dirname(os.path.abspath(__file__))
+ROOT_PATH = os.path.dirname(CURRENT_PATH)
+
+
+"""
+synthetic payload
+"""
+FIELDS = ['null', 'start_time', 'area', 'source', 'access_page', 'searchword', 'ip', 'visitorId', 'visit_time', 'visit_pages']
+
+# area names as returned by the API: unique cities, municipalities, Hong Kong, ambiguous names and unknown ones (located by IP)
+AREAS = ['北京', '上海', '香港', '广州', '深圳', '哈尔滨', '红河', '泰州', '厦门', '沈阳', '南京', '杭州', '成都', '苏州', '朝阳', '其他']
+AREA_WEIGHTS = [10, 10, 2, 8, 8, 3, 1, 2, 3, 3, 4, 5, 5, 4, 2, 6]
+
+SEARCH_ENGINES = [
+    ('百度', 'https://www.baidu.com/s?wd={}'),
+    ('Google', 'https://www.google.com/search?q={}'),
+    ('Bing', 'https://cn.bing.com/search?q={}'),
+    ('搜狗', 'https://www.sogou.com/web?query={}'),
+    ('360搜索', 'https://www.so.com/s?q={}')
+]
+OTHER_REFERRERS = [
+    'https://weibo.com/u/{}', 'https://mp.weixin.qq.com/s/{}', 'https://www.zhihu.com/question/{}', 'https://www.douban.com/note/{}',
+    'https://blog{}.example.com.cn/post', 'https://news{}.example.org/article', 'https://m.toutiao.com/i{}/', 'https://open.weixin.qq.com/{}'
+]
+KEYWORDS = ['网站统计', '访问统计', '流量分析', '百度统计', '数据分析', '用户画像', 'utm 参数', '转化率', '热力图', '漏斗分析']
+PATH_WORDS = ['web', 'home', 'product', 'news', 'article', 'help', 'account', 'source', 'custom', 'event', 'report', 'site', 'search', 'pro']
+BROWSERS = [('Google Chrome', 'chrome'), ('Safari', 'safari'), ('Microsoft Edge', 'edge'), ('Firefox', 'firefox'), ('微信', 'wechat'), ('QQ浏览器', 'qqbrowser')]
+SYSTEMS = [('Win 10', 'pc', 'pc'), ('Mac OS X', 'pc', 'pc'), ('iOS', 'mobile', 'mobile'), ('Android', 'mobile', 'mobile')]
+RESOLUTIONS = ['1920x1080', '1440x900', '2560x1440', '390x844', '414x896', '360x780', 'unknown']
+LANGUAGES = ['中文(简体)', '中文(台湾)', '英语(美国)']
+
+
+def genUrls(rng: random.Random, count: int, host: str='www.example.com') -> list:
+    """
+    生成站内 URL, 部分带有 tracking / 站内搜索 / 自定义参数
+    :param rng: 随机数生成器
+    :param count: URL 数量
+    :param host: 站点域名
+    :return: URL 列表
+    """
+    hosts = [host, host, host, f'm.{host.split(".", 1)[-1]}', f'shop.{host.split(".", 1)[-1]}']
+    urls = []
+    for i in range(count):
+        path = '/'.join(rng.choice(PATH_WORDS) for _ in range(rng.randint(1, 4)))
+        url = f'https://{rng.choice(hosts)}/{path}/{i}'
+        r = rng.random()
+        if r < 0.1:
+            url += f'?utm_source={rng.choice(["baidu", "weibo", "newsletter"])}&utm_medium={rng.choice(["cpc", "social", "email"])}&utm_campaign=c{rng.randint(1, 20)}'
+        elif r < 0.15:
+            url += f'?q={rng.choice(KEYWORDS)}'
+        elif r < 0.2:
+            url += f'?activity_id={rng.randint(1, 50)}&channel_id={rng.randint(1, 5)}'
+        elif r < 0.25:
+            url += f'?hmsr={rng.choice(["baidu", "360"])}&hmpl=p{rng.randint(1, 9)}&hmkw={rng.choice(KEYWORDS)}'
+        elif r < 0.35:
+            url += f'?page={rng.randint(1, 20)}'
+        urls.append(url)
+    return urls
+
+def genReferrers(rng: random.Random, count: int) -> list:
+    """
+    生成站外来源 URL
+    :param rng: 随机数生成器
+    :param count: URL 数量
+    :return: URL 列表
+    """
+    return [rng.choice(OTHER_REFERRERS).format(rng.randint(1, 10 ** 6)) for _ in range(count)]
+
+def genIPs(rng: random.Random, count: int) -> list:
+    """
+    生成 IP 地址及其对应的地区名称
+    :param rng: 随机数生成器
+    :param count: IP 数量
+    :return: [(ip, area), ...]
+    """
+    result = []
+    for _ in range(count):
+        ip = f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}'
+        result.append((ip, rng.choices(AREAS, AREA_WEIGHTS)[0]))
+    return result
+
+def genSource(rng: random.Random, referrers: list) -> tuple:
+    """
+    生成来源信息
+    :return: (概要中的 source, 详情中的 fromType, 搜索词)
+    """
+    r = rng.random()
+    if r < 0.35:
+        source = {'fromType': '直接访问', 'tip': '', 'url': None}
+        return (source, dict(source), '--')
+    if r < 0.7:
+        name, pattern = rng.choice(SEARCH_ENGINES)
+        keyword = rng.choice(KEYWORDS)
+        url = pattern.format(keyword)
+        return ({'fromType': name, 'url': url}, {'fromType': f'{name}(搜索词:{keyword})', 'url': url}, keyword)
+    if r < 0.95:
+        url = rng.choice(referrers)
+        return ({'fromType': url, 'url': url}, {'fromType': url, 'url': url}, '--')
+    url = f'https://www.baidu.com/baidu.php?sc={rng.randint(1, 10 ** 6)}'
+    return ({'fromType': '百度搜索推广', 'url': url}, {'fromType': '百度搜索推广', 'url': url}, '--')
+
+def genPayload(sessions: int=1000, path_length: int=5, url_count: int=200, referrer_count: int=50, ip_count: int=500, visitor_count: int=0, seed: int=0) -> dict:
+    """
+    生成 trend/latest/a 接口的模拟返回数据
+    :param sessions: 会话数
+    :param path_length: 平均每个会话的页面数 (1 ~ 2 * path_length - 1 均匀分布)
+    :param url_count: 站内 URL 数量
+    :param referrer_count: 站外来源 URL 数量
+    :param ip_count: IP 数量
+    :param visitor_count: 访客数, 默认为会话数的 80%
+    :param seed: 随机种子
+    :return: 原始数据字典
+    """
+    rng = random.Random(seed)
+    urls = genUrls(rng, url_count)
+    referrers = genReferrers(rng, referrer_count)
+    ips = genIPs(rng, ip_count)
+    visitor_count = visitor_count or max(int(sessions * 0.8), 1)
+    visitors = [str(rng.randint(10 ** 18, 10 ** 19 - 1)) for _ in range(visitor_count)]
+
+    detail = []
+    outline = []
+    now = datetime.datetime(2023, 3, 30, 23, 59, 59)
+    start = now
+    for _ in range(sessions):
+        start = start - datetime.timedelta(seconds=rng.randint(0, 30)) # newest first
+        visitor_id = rng.choice(visitors)
+        ip, area = rng.choice(ips)
+        source, from_type, search_word = genSource(rng, referrers)
+        browser, browser_type = rng.choice(BROWSERS)
+        _os, os_type, device_type = rng.choice(SYSTEMS)
+        is_first_time = rng.random() < 0.3
+        last_visit_time = '首次访问' if is_first_time else (start - datetime.timedelta(minutes=rng.randint(1, 60 * 24 * 30))).strftime('%Y/%m/%d %H:%M:%S')
+
+        l = max(1, min(rng.randint(1, 2 * path_length - 1), 1000))
+        page_urls = [rng.choice(urls) for _ in range(l)]
+        paths = []
+        t = start
+        for idx, url in enumerate(page_urls):
+            if idx == l - 1:
+                duration = '正在访问' if rng.random() < 0.5 else rng.randint(1, 300)
+            else:
+                duration = rng.choice([str(rng.randint(1, 300)), rng.randint(1, 300), -rng.randint(1, 10)])
+            paths.append([t.strftime('%H:%M:%S'), duration, url])
+            t = t + datetime.timedelta(seconds=rng.randint(1, 120))
+        visit_time = '正在访问' if paths[-1][1] == '正在访问' else sum(x[1] if isinstance(x[1], int) else int(x[1]) for x in paths if x[1] != '正在访问')
+
+        outline.append([
+            start.strftime('%Y/%m/%d %H:%M:%S'),
+            area,
+            source,
+            page_urls[0],
+            search_word,
+            ip,
+            visitor_id,
+            visit_time,
+            str(l)
+        ])
+        detail.append([{'detail': {
+            'accessPage': page_urls[0],
+            'antiCode': '--',
+            'browser': browser,
+            'browserType': browser_type,
+            'color': '24-bit',
+            'cookie': '支持',
+            'deviceType': device_type,
+            'endPage': page_urls[-1],
+            'flash': '',
+            'fromType': from_type,
+            'from_word': '--',
+            'ipStatus': 0,
+            'isp': '',
+            'java': '不支持',
+            'language': rng.choice(LANGUAGES),
+            'lastVisitTime': last_visit_time,
+            'os': _os,
+            'osType': os_type,
+            'paths': paths,
+            'resolution': rng.choice(RESOLUTIONS),
+            'userId': '0',
+            'visitorFrequency': str(rng.randint(1, 50)),
+            'visitorStatus': 0,
+            'visitorType': '新访客' if is_first_time else '老访客'
+        }}])
+
+    return {
+        'data': {
+            'fields': FIELDS,
+            'items': [detail, outline, [], []],
+            'total': sessions
+        },
+        'msg': '',
+        'status': 0
+    }
+
+
+"""
+local stand-ins
+"""
+class LocalPipeline(object):
+    """
+    LocalRedis 的 pipeline 替身, 记录命令, execute 时依次执行
+    """
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self) -> list:
+        """
+        依次执行记录的命令
+        :return: 各命令的结果列表
+        """
+        result = [getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return result
+
+
+class LocalRedis(object):
+    """
+    进程内的 Redis 替身, 仅实现解析器用到的命令
+    """
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.calls = 0
+
+    def get(self, key: str):
+        self.calls += 1
+        return self.values.get(key)
+
+    def set(self, key: str, value, ex: int=None):
+        self.calls += 1
+        self.values[key] = value
+        return True
+
+    def mget(self, keys: list) -> list:
+        self.calls += 1
+        return [self.values.get(key) for key in keys]
+
+    def hget(self, name: str, key: str):
+        self.calls += 1
+        return self.hashes.get(name, {}).get(key)
+
+    def hmget(self, name: str, keys: list) -> list:
+        self.calls += 1
+        h = self.hashes.get(name, {})
+        return [h.get(key) for key in keys]
+
+    def hset(self, name: str, key: str=None, value=None, mapping: dict=None):
+        self.calls += 1
+        h = self.hashes.setdefault(name, {})
+        if key is not None:
+            h[key] = value
+        if mapping:
+            h.update(mapping)
+        return 1
+
+    def hgetall(self, name: str) -> dict:
+        self.calls += 1
+        return dict(self.hashes.get(name, {}))
+
+    def hdel(self, name: str, *keys):
+        self.calls += 1
+        for key in keys:
+            self.hashes.get(name, {}).pop(key, None)
+        return 1
+
+    def delete(self, *keys):
+        self.calls += 1
+        for key in keys:
+            self.values.pop(key, None)
+            self.hashes.pop(key, None)
+        return 1
+
+    def expire(self, *args, **kwargs):
+        return True
+
+    def pipeline(self, transaction: bool=True) -> LocalPipeline:
+        return LocalPipeline(self)
+
+
+# (province, provinceCode, city, cityCode), about 5% of the lookups fail
+LBS_LOCATIONS = [
+    ('北京市', '11', '北京市', '1101'), ('广东省', '44', '广州市', '4401'), ('广东省', '44', '深圳市', '4403'), ('江苏省', '32', '南京市', '3201'),
+    ('浙江省', '33', '杭州市', '3301'), ('四川省', '51', '成都市', '5101'), ('辽宁省', '21', '沈阳市', '2101'), ('福建省', '35', '厦门市', '3502')
+]
+
+def localLBS(ip: str) -> dict:
+    """
+    LBS 替身: 按 IP 的哈希值返回固定的地区
+    :param ip: IP 地址
+    :return: IP 信息字典
+    """
+    h = zlib.crc32(ip.encode('utf-8'))
+    if h % 20 == 0:
+        return {'country': '', 'province': '', 'provinceCode': '', 'city': '', 'cityCode': '', 'lbs_service': 'local'}
+    province, provinceCode, city, cityCode = LBS_LOCATIONS[h % len(LBS_LOCATIONS)]
+    return {'country': '中国', 'province': province, 'provinceCode': provinceCode, 'city': city, 'cityCode': cityCode, 'lbs_service': 'local'}
+
+# used when data/divisions.db is missing
+STAND_IN_DIVISIONS = (
+    [('11', '北京市'), ('31', '上海市'), ('44', '广东省'), ('23', '黑龙江省'), ('53', '云南省'), ('32', '江苏省'), ('35', '福建省'),
+     ('21', '辽宁省'), ('33', '浙江省'), ('51', '四川省'), ('22', '吉林省'), ('81', '香港特别行政区')],
+    [('1101', '市辖区'), ('4401', '广州市'), ('4403', '深圳市'), ('2301', '哈尔滨市'), ('5325', '红河哈尼族彝族自治州'), ('3212', '泰州市'),
+     ('3502', '厦门市'), ('2101', '沈阳市'), ('3201', '南京市'), ('3301', '杭州市'), ('5101', '成都市'), ('3205', '苏州市')],
+    [('110105', '朝阳区', '11'), ('220104', '朝阳区', '22'), ('440106', '天河区', '44'), ('330106', '西湖区', '33'), ('320506', '吴中区', '32')]
+)
+
+def installStandIns() -> LocalRedis:
+    """
+    使用本地替身替换 Redis 及 LBS, 行政区划数据缺失时使用内置数据
+    :return: LocalRedis
+    """
+    redis = LocalRedis()
+    utils.rd = redis
+    raw_parser.rd = redis
+    utils.lbs = localLBS
+    utils.LBS_NEGATIVE_CACHE.clear()
+    if utils.DIVISIONS is None and not os.path.exists(f'{ROOT_PATH}/package/data/divisions.db'):
+        utils.DIVISIONS = utils.buildDivisions(*STAND_IN_DIVISIONS)
+    return redis
+
+def clearCaches() -> None:
+    """
+    清空进程内缓存, 使每次运行都与新进程解析一页数据相同
+    :return: None
+    """
+    utils.parseUrl.cache_clear()
+    utils.querySourceCategory.cache_clear()
+    utils.getDayEpoch.cache_clear()
+    return None
+
+
+"""
+benchmark
+"""
+def bestOf(func, repeat: int, setup=None) -> float:
+    """
+    多次运行取最短耗时
+    :param func: 被测函数
+    :param repeat: 运行次数
+    :param setup: 每次运行前调用 (不计时)
+    :return: 最短耗时 (秒)
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def prepareInputs(items: list) -> dict:
+    """
+    按解析器的调用方式, 准备各个函数的输入参数
+    :param items: 原始数据中的 items
+    :return: {函数名: (函数, 参数列表)}
+    """
+    detail = items[0]
+    outline = items[1]
+    session_args = {name: [] for name in ['getTime', 'queryDivision', 'parseTrafficSource', 'getScreenSize', 'saveFistVisitTime']}
+    event_args = {name: [] for name in [
+        'getTime(path)', 'getDuration', 'parseUrl', 'parseSLD', 'parsetUrlPath', 'parsetracking_arams', 'parseOnSiteSearchTerm',
+        'parseEnhancedEvent', 'parseEnhancedTrafficGroup', 'querySearchEngine', 'parseWXShareFrom'
+    ]}
+    for i, o in enumerate(outline):
+        d = detail[i][0]['detail']
+        start_time, area, source, access_page, search_word, ip, visitor_id, duration, visit_pages = o
+        session_args['getTime'].append((start_time,))
+        session_args['queryDivision'].append((area, ip))
+        source = d['fromType']
+        source_url = source.get('url', '') or ''
+        session_args['parseTrafficSource'].append((source.get('fromType', ''), source_url))
+        session_args['getScreenSize'].append((d['resolution'],))
+        session_args['saveFistVisitTime'].append((visitor_id, getTime(start_time)[0], d['lastVisitTime'] == '首次访问'))
+        traffic_source = parseTrafficSource(source.get('fromType', ''), source_url)
+        traffic_source_type = traffic_source['traffic_source_type']
+        referrer_host = traffic_source['referrer_host']
+        paths = sorted(d['paths'], key=lambda x: x[0])
+        for idx, (path_time, path_duration, url) in enumerate(paths):
+            if idx:
+                referrer_host = parseUrl(paths[idx - 1][2]).host
+            parsed = parseUrl(url)
+            tracking_arams = parsetracking_arams(parsed)
+            group = parseEnhancedTrafficGroup(traffic_source_type, referrer_host, tracking_arams['utm_source'], tracking_arams['utm_medium'], tracking_arams['utm_campaign'])
+            event_args['getTime(path)'].append((path_time,))
+            event_args['getDuration'].append((path_duration,))
+            event_args['parseUrl'].append((url,))
+            event_args['parseSLD'].append((parsed.host,))
+            event_args['parsetUrlPath'].append((parsed,))
+            event_args['parsetracking_arams'].append((parsed,))
+            event_args['parseOnSiteSearchTerm'].append((parsed,))
+            event_args['parseEnhancedEvent'].append((parsed, getDuration(path_duration), False, idx == 0))
+            event_args['parseEnhancedTrafficGroup'].append((traffic_source_type, referrer_host, tracking_arams['utm_source'], tracking_arams['utm_medium'], tracking_arams['utm_campaign']))
+            event_args['querySearchEngine'].append((traffic_source, group, referrer_host))
+            event_args['parseWXShareFrom'].append((d['browserType'], referrer_host, access_page))
+    functions = {
+        'getTime': getTime,
+        'getTime(path)': getTime,
+        'queryDivision': queryDivision,
+        'parseTrafficSource': parseTrafficSource,
+        'getScreenSize': getScreenSize,
+        'saveFistVisitTime': saveFistVisitTime,
+        'getDuration': getDuration,
+        'parseUrl': parseUrl,
+        'parseSLD': parseSLD,
+        'parsetUrlPath': parsetUrlPath,
+        'parsetracking_arams': parsetracking_arams,
+        'parseOnSiteSearchTerm': parseOnSiteSearchTerm,
+        'parseEnhancedEvent': parseEnhancedEvent,
+        'parseEnhancedTrafficGroup': parseEnhancedTrafficGroup,
+        'querySearchEngine': querySearchEngine,
+        'parseWXShareFrom': parseWXShareFrom
+    }
+    args = {**session_args, **event_args}
+    return {name: (functions[name], args[name]) for name in args}
+
+def report(name: str, calls: int, elapsed: float, sessions: int, events: int) -> None:
+    """
+    输出一行测试结果
+    :param name: 测试项名称
+    :param calls: 每次运行的调用次数
+    :param elapsed: 最短耗时 (秒)
+    :param sessions: 会话数
+    :param events: 事件数
+    :return: None
+    """
+    elapsed = max(elapsed, 1e-9)
+    print(f'{name:<32}{calls:>10}{elapsed * 1000:>12.2f}{sessions / elapsed:>16,.0f}{events / elapsed:>16,.0f}')
+    return None
+
+def runBenchmark(content, repeat: int=5, workers: int=0, warm: bool=False) -> None:
+    """
+    运行基准测试, 输出整体解析及各个函数的 sessions/s, events/s
+    :param content: 原始数据
+    :param repeat: 每项运行次数, 取最短耗时
+    :param workers: 大于 0 时, 增加并行解析的测试
+    :param warm: 是否保留进程内缓存 (常驻进程的情况), 默认每次运行前清空
+    :return: None
+    """
+    installStandIns()
+    items = loadRawData(content)
+    sessions = len(items[1])
+    events = sum(len(d[0]['detail']['paths']) for d in items[0])
+    print(f'sessions: {sessions}, events: {events}, repeat: {repeat}, caches: {"warm" if warm else "cold"}')
+    print(f'{"":<32}{"calls":>10}{"best (ms)":>12}{"sessions/s":>16}{"events/s":>16}')
+
+    def setup() -> None:
+        """
+        每次运行前重置 Redis 替身, 冷缓存时清空进程内缓存
+        :return: None
+        """
+        installStandIns() # fresh Redis state, as for a new page
+        if not warm:
+            clearCaches()
+
+    content_bytes = content if isinstance(content, bytes) else json.dumps(content)
+    cases = [
+        ('parseRawData', lambda: parseRawData(content_bytes)),
+        ('parseRawData(compact)', lambda: parseRawData(content_bytes, compact=True))
+    ]
+    if workers:
+        parseRawData(content_bytes, workers=workers) # start the worker processes
+        cases.append((f'parseRawData(workers={workers})', lambda: parseRawData(content_bytes, workers=workers)))
+    for name, func in cases:
+        report(name, 1, bestOf(func, repeat, setup), sessions, events)
+
+    print('-' * 86)
+    setup()
+    inputs = prepareInputs(items)
+
+    def prefetch() -> PageCache:
+        """
+        预读整页数据的 Redis 状态, 与 raw_parser.iterItems 相同
+        :return: PageCache
+        """
+        cache = PageCache()
+        cache.prefetch([o[5] for o in items[1]], [o[6] for o in items[1]])
+        cache.prefetchLBS([o[1] for o in items[1]], [o[5] for o in items[1]])
+        return cache
+    report('PageCache.prefetch', 1, bestOf(prefetch, repeat, setup), sessions, events)
+
+    for name, (func, args_list) in inputs.items():
+        if name in ['queryDivision', 'saveFistVisitTime']:
+            # with a prefetched page cache, as in raw_parser.iterItems
+            caches = []
+            def run():
+                cache = caches[-1]
+                for args in args_list:
+                    func(*args, cache)
+            def setupCache():
+                setup()
+                caches.append(prefetch())
+            elapsed = bestOf(run, repeat, setupCache)
+        else:
+            def run():
+                for args in args_list:
+                    func(*args)
+            elapsed = bestOf(run, repeat, setup)
+        report(name, len(args_list), elapsed, sessions, events)
+    return None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the parser on synthetic trend/latest/a payloads.')
+    arg_parser.add_argument('--sessions', type=int, default=1000, help='sessions per payload (page_size, max is 1000 for the API)')
+    arg_parser.add_argument('--path-length', type=int, default=5, help='average pages per session')
+    arg_parser.add_argument('--urls', type=int, default=200, help='distinct on-site urls')
+    arg_parser.add_argument('--referrers', type=int, default=50, help='distinct external referrers')
+    arg_parser.add_argument('--ips', type=int, default=500, help='distinct ip addresses')
+    arg_parser.add_argument('--visitors', type=int, default=0, help='distinct visitors, default is 80%% of the sessions')
+    arg_parser.add_argument('--seed', type=int, default=0, help='random seed')
+    arg_parser.add_argument('--repeat', type=int, default=5, help='runs of each case, the best one is reported')
+    arg_parser.add_argument('--workers', type=int, default=0, help='also benchmark parallel parsing with N processes')
+    arg_parser.add_argument('--warm', action='store_true', help='keep the in-process caches between runs (long-running process)')
+    arg_parser.add_argument('--input', default='', help='benchmark a saved raw data file instead of a synthetic payload')
+    arg_parser.add_argument('--save', default='', help='save the synthetic payload to this file')
+    args = arg_parser.parse_args()
+
+    if args.input:
+        with open(args.input, 'rb') as f:
+            content = f.read()
+    else:
+        content = genPayload(args.sessions, args.path_length, args.urls, args.referrers, args.ips, args.visitors, args.seed)
+        if args.save:
+            with open(args.save, 'wb') as f:
+                f.write(json.dumps(content, option=orjson.OPT_INDENT_2))
+    runBenchmark(content, repeat=args.repeat, workers=args.workers, warm=args.warm)
+
+    print('done.')
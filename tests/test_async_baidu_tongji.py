@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of AsyncBaiduTongji.fetchMany and of the shared parser process pools, without network requests.
+
+Usage:
+    python3 test_async_baidu_tongji.py
+    python3 -m pytest test_async_baidu_tongji.py
+"""
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(dirname(__file__)))
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+import raw_parser
+from async_baidu_tongji import AsyncBaiduTongji
+from benchmark import clearCaches, genPayload, installStandIns
+
+
+class FakeFetch(object):
+    """
+    fetchRealTimeData 的替身, 记录最大并发数, 站点 ID 为 bad 时抛出异常
+    """
+    def __init__(self, delay: float=0.05):
+        self.delay = delay
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, site_id: str, page_size: int=1000, visitor_id: str='') -> list:
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delay)
+            if site_id == 'bad':
+                raise ValueError('request failed')
+            return [{'site_id': site_id}]
+        finally:
+            with self.lock:
+                self.running -= 1
+
+def getClient(concurrency: int) -> tuple:
+    """
+    获取使用 FakeFetch 的客户端
+    :param concurrency: 最大并发数
+    :return: (AsyncBaiduTongji, FakeFetch)
+    """
+    bd = AsyncBaiduTongji(debug=True, concurrency=concurrency)
+    fetch = FakeFetch()
+    bd.fetchRealTimeData = fetch
+    return bd, fetch
+
+def test_fetch_many_concurrency():
+    bd, fetch = getClient(concurrency=3)
+    site_ids = [str(i) for i in range(9)]
+    result = asyncio.run(bd.fetchMany(site_ids))
+    assert result == {site_id: [{'site_id': site_id}] for site_id in site_ids}
+    assert list(result) == site_ids
+    assert fetch.max_running == 3
+
+def test_fetch_many_errors():
+    bd, fetch = getClient(concurrency=4)
+    result = asyncio.run(bd.fetchMany(['1', 'bad', '2']))
+    assert result['1'] == [{'site_id': '1'}]
+    assert result['2'] == [{'site_id': '2'}]
+    assert isinstance(result['bad'], ValueError)
+
+def test_executors_shared_by_threads():
+    installStandIns()
+    clearCaches()
+    content = genPayload(sessions=120, seed=6)
+    expected = raw_parser.parseRawData(content)
+    # different worker counts in concurrent threads, no pool is shut down while another thread uses it
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda workers: raw_parser.parseRawData(content, workers=workers, chunk_size=30), [2, 3, 2, 3]))
+    assert all(len(result) == len(expected) for result in results)
+    assert raw_parser.getExecutor(2) is raw_parser.getExecutor(2)
+    assert raw_parser.getExecutor(2) is not raw_parser.getExecutor(3)
+
+
+if __name__ == '__main__':
+    test_fetch_many_concurrency()
+    test_fetch_many_errors()
+    test_executors_shared_by_threads()
+    print('ok')
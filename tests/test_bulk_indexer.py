@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of the Elasticsearch demo's BulkIndexer, with the Kibana console proxy replaced by a local stand-in.
+
+Usage:
+    python3 test_bulk_indexer.py
+    python3 -m pytest test_bulk_indexer.py
+"""
+import sys
+import threading
+from os.path import abspath, dirname, join
+
+import orjson
+
+sys.path.insert(0, abspath(join(dirname(__file__), '../demo/Elasticsearch')))
+
+import bulk_indexer
+from bulk_indexer import BulkIndexer
+
+
+class FakeResponse(object):
+    def __init__(self, status_code: int, content: dict):
+        self.status_code = status_code
+        self.content = orjson.dumps(content)
+
+    def raise_for_status(self) -> None:
+        return None
+
+
+class FakeBulkAPI(object):
+    """
+    /_bulk 接口替身: 按 statuses 依次决定每个文档的状态, 可截断返回结果
+    """
+    def __init__(self, statuses=None, truncate: list=None):
+        self.statuses = statuses or (lambda doc_id, attempt: 201)
+        self.truncate = list(truncate or []) # number of results returned by the first requests
+        self.requests = []
+        self.attempts = {}
+        self.lock = threading.Lock()
+
+    def post(self, url: str, params: dict=None, data: bytes=b'', headers: dict=None, timeout=None) -> FakeResponse:
+        lines = data.splitlines()
+        doc_ids = [orjson.loads(action)['index']['_id'] for action in lines[0::2]]
+        items = []
+        with self.lock:
+            self.requests.append(doc_ids)
+            limit = self.truncate.pop(0) if self.truncate else len(doc_ids)
+            for doc_id in doc_ids[:limit]:
+                attempt = self.attempts[doc_id] = self.attempts.get(doc_id, 0) + 1
+                items.append({'index': {'_id': doc_id, 'status': self.statuses(doc_id, attempt)}})
+        return FakeResponse(200, {'errors': True, 'items': items})
+
+
+class NoSleep(object):
+    @staticmethod
+    def sleep(seconds: float) -> None:
+        return None
+
+
+def runIndexer(api: FakeBulkAPI, count: int, **kwargs) -> dict:
+    """
+    写入 count 个文档, 不等待重试间隔
+    :param api: /_bulk 接口替身
+    :param count: 文档数
+    :param kwargs: BulkIndexer 的参数
+    :return: 统计信息字典
+    """
+    real_time, bulk_indexer.time = bulk_indexer.time, NoSleep
+    try:
+        indexer = BulkIndexer('http://localhost:5601/api/console/proxy', api, **kwargs)
+        for i in range(count):
+            indexer.add('events', str(i), {'event_id': str(i), 'n': i})
+        return indexer.close()
+    finally:
+        bulk_indexer.time = real_time
+
+def test_truncated_response_is_retried():
+    api = FakeBulkAPI(truncate=[2])
+    stats = runIndexer(api, 5, max_docs=5)
+    assert stats == {'indexed': 5, 'failed': 0, 'requests': 2}
+    assert api.requests == [['0', '1', '2', '3', '4'], ['2', '3', '4']]
+
+def test_truncated_response_fails_after_retries():
+    api = FakeBulkAPI(truncate=[3, 0, 0, 0])
+    stats = runIndexer(api, 4, max_docs=4, max_retries=3)
+    assert stats == {'indexed': 3, 'failed': 1, 'requests': 4}
+
+def test_only_failed_items_are_retried():
+    def statuses(doc_id: str, attempt: int) -> int:
+        if doc_id == '1':
+            return 400 # mapping error, not retried
+        if doc_id == '2' and attempt == 1:
+            return 429
+        return 201
+    api = FakeBulkAPI(statuses)
+    stats = runIndexer(api, 4, max_docs=4)
+    assert stats == {'indexed': 3, 'failed': 1, 'requests': 2}
+    assert api.requests[1] == ['2']
+
+def test_parallel_batches():
+    api = FakeBulkAPI()
+    stats = runIndexer(api, 1000, max_docs=100, workers=4)
+    assert stats == {'indexed': 1000, 'failed': 0, 'requests': 10}
+    assert sorted(int(doc_id) for doc_ids in api.requests for doc_id in doc_ids) == list(range(1000))
+
+
+if __name__ == '__main__':
+    test_truncated_response_is_retried()
+    test_truncated_response_fails_after_retries()
+    test_only_failed_items_are_retried()
+    test_parallel_batches()
+    print('ok')
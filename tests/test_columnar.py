@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of columnar.py (requires the pyarrow package), with the local Redis and LBS stand-ins of benchmark.py.
+
+Usage:
+    python3 test_columnar.py
+    python3 -m pytest test_columnar.py
+"""
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(dirname(__file__)))
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+from benchmark import clearCaches, genPayload, installStandIns
+from columnar import ColumnBuffer, getColumnTypes, pa, toRecordBatches, writeParquet
+from raw_parser import parseRawData
+
+
+def test_column_buffer_padding():
+    buffer = ColumnBuffer()
+    buffer.append({'a': 1, 'b': 2})
+    buffer.append({'a': 3, 'c': 4}) # gains c and lacks b, the key count is the same
+    buffer.append({'b': 5})
+    buffer.append({'c': 6, 'b': 7, 'a': 8})
+    assert buffer.rows == 4
+    assert buffer.columns == {'a': [1, 3, None, 8], 'b': [2, None, 5, 7], 'c': [None, 4, None, 6]}
+
+def test_column_buffer_events():
+    installStandIns()
+    clearCaches()
+    result = parseRawData(genPayload(sessions=50, seed=12), compact=True)
+    event = result[0]['event_list'][0]
+    event['next_event_id'] = 'x'
+    event['session_start_time'] = 'y' # shared field, copied into extra
+    event['custom'] = 'z'
+    events = [event for entity in result for event in entity['event_list']]
+    compact = ColumnBuffer()
+    plain = ColumnBuffer()
+    for event in events:
+        compact.append(event)
+        plain.append(event.to_dict())
+    assert list(compact.columns) == list(plain.columns)
+    assert compact.columns == plain.columns
+    assert compact.columns['custom'][0] == 'z' and compact.columns['custom'][1] is None
+
+def test_record_batches_compact_equals_dict():
+    if pa is None:
+        return None
+    content = genPayload(sessions=100, seed=13)
+    installStandIns()
+    clearCaches()
+    plain = toRecordBatches(parseRawData(content))
+    installStandIns()
+    clearCaches()
+    compact = toRecordBatches(parseRawData(content, compact=True))
+    for table_name in ['visitors', 'sessions', 'events']:
+        assert compact[table_name].equals(plain[table_name])
+    assert plain['sessions'].num_rows == 100
+    assert plain['events'].schema.field('unix_timestamp').type == getColumnTypes()['unix_timestamp']
+
+def test_write_parquet():
+    if pa is None:
+        return None
+    import pyarrow.parquet as pq
+    installStandIns()
+    clearCaches()
+    batches = toRecordBatches(parseRawData(genPayload(sessions=100, seed=14)))
+    file_list = writeParquet(batches, '1', path=tempfile.mkdtemp())
+    assert all('/site_id=1/date=' in path for path in file_list)
+    rows = {'visitors': 0, 'sessions': 0, 'events': 0}
+    for path in file_list:
+        rows[path.split('/')[-4]] += pq.read_table(path).num_rows
+    assert rows == {table_name: batch.num_rows for table_name, batch in batches.items()}
+
+
+if __name__ == '__main__':
+    test_column_buffer_padding()
+    test_column_buffer_events()
+    test_record_batches_compact_equals_dict()
+    test_write_parquet()
+    print('ok')
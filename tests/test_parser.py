@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Parser tests on synthetic trend/latest/a payloads, with the local Redis and LBS stand-ins of benchmark.py.
+
+Usage:
+    python3 test_parser.py
+    python3 -m pytest test_parser.py
+"""
+import sys
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(dirname(__file__)))
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+from benchmark import clearCaches, genPayload, installStandIns
+from entities import toDict
+from raw_parser import Watermark, iterRawData, parseRawData
+
+
+def parseFresh(content: dict, **kwargs) -> list:
+    """
+    使用全新的 Redis 替身解析一页数据
+    :param content: 原始数据
+    :param kwargs: parseRawData 的参数
+    :return: 实时数据列表
+    """
+    installStandIns()
+    clearCaches()
+    return parseRawData(content, **kwargs)
+
+def test_parallel_equals_serial():
+    content = genPayload(sessions=300, seed=1)
+    serial = parseFresh(content)
+    parallel = parseFresh(content, workers=3, chunk_size=50)
+    assert len(serial) == 300
+    assert parallel == serial
+    assert any(x['session']['is_first_day'] for x in serial)
+
+def test_parallel_compact_equals_serial():
+    content = genPayload(sessions=300, seed=2)
+    serial = parseFresh(content)
+    parallel = parseFresh(content, workers=3, chunk_size=50, compact=True)
+    assert [toDict(x) for x in parallel] == serial
+
+def test_watermark_polls_twice():
+    content = genPayload(sessions=300, seed=3)
+    installStandIns()
+    clearCaches()
+    first = parseRawData(content, watermark=Watermark('1', window=600))
+    second = parseRawData(content, watermark=Watermark('1', window=600))
+    assert len(first) == 300
+    assert second == []
+    # a session updated within the window is parsed again
+    content['data']['items'][1][0][8] = '9'
+    third = parseRawData(content, watermark=Watermark('1', window=600))
+    assert len(third) == 1
+
+def test_watermark_abandoned_poll():
+    content = genPayload(sessions=300, seed=4)
+    other = genPayload(sessions=100, seed=5)
+    installStandIns()
+    clearCaches()
+    watermark = Watermark('1', window=86400 * 365)
+    entities = iterRawData(content, watermark)
+    for _ in range(10):
+        next(entities)
+    entities.close() # the consumer stops early, nothing is saved
+    assert len(list(iterRawData(other, watermark))) == 100
+    # the sessions of the abandoned poll are still new
+    assert len(list(iterRawData(content, watermark))) == 300
+    assert list(iterRawData(content, watermark)) == []
+
+
+if __name__ == '__main__':
+    test_parallel_equals_serial()
+    test_parallel_compact_equals_serial()
+    test_watermark_polls_twice()
+    test_watermark_abandoned_poll()
+    print('ok')
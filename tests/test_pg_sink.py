@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of the PostgreSQL demo's PGSink, with the connection replaced by a local stand-in (requires psycopg).
+
+Usage:
+    python3 test_pg_sink.py
+    python3 -m pytest test_pg_sink.py
+"""
+import contextlib
+import io
+import logging
+import re
+import sys
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(join(dirname(__file__), '../demo/PostgreSQL')))
+
+try:
+    import psycopg
+    from pg_sink import PGSink
+except ImportError:
+    psycopg = None
+
+TABLE_COLUMNS = {
+    'visitors': ['visitor_id', 'visitor_type'],
+    'sessions': ['session_id', 'visitor_id', 'visit_pages'],
+    'events': ['event_id', 'session_id', 'url']
+}
+PRIMARY_KEYS = {'visitors': 'visitor_id', 'sessions': 'session_id', 'events': 'event_id'}
+
+
+class FakeCopy(object):
+    def __init__(self, cursor, stage: str, columns: list):
+        self.cursor = cursor
+        self.stage = stage
+        self.columns = columns
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write_row(self, row: list) -> None:
+        record = dict(zip(self.columns, row))
+        if self.cursor.conn.bad_value in record.values():
+            raise ValueError('invalid input syntax')
+        self.cursor.conn.copies.setdefault(self.stage, []).append(record)
+        return None
+
+
+class FakeCursor(object):
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, q: str, params: tuple=None) -> None:
+        q = ' '.join(q.split())
+        if 'information_schema.columns' in q:
+            self.conn.schema_queries += 1
+            self.rows = [(x,) for x in TABLE_COLUMNS[params[0]]]
+        elif q.startswith('CREATE TEMP TABLE'):
+            pass
+        elif 'SELECT' in q: # INSERT INTO {table} (...) SELECT ... FROM {stage}
+            table_name = re.match(r'INSERT INTO (\w+)', q).group(1)
+            for record in self.conn.copies.get(f'_stage_{table_name}', []):
+                self.conn.upsert(table_name, record)
+        else: # INSERT INTO {table} (...) VALUES (...)
+            table_name, columns = re.match(r'INSERT INTO (\w+) \(([^)]*)\)', q).groups()
+            record = dict(zip(columns.split(','), params))
+            if self.conn.bad_value in record.values():
+                raise ValueError('invalid input syntax')
+            self.conn.upsert(table_name, record)
+        return None
+
+    def fetchall(self) -> list:
+        return self.rows
+
+    def copy(self, q: str) -> FakeCopy:
+        stage, columns = re.match(r'COPY (\w+) \(([^)]*)\)', q).groups()
+        return FakeCopy(self, stage, columns.split(','))
+
+
+class FakeConnection(object):
+    """
+    psycopg 连接替身: 提交前的写入保存在 pending 中, 回滚时丢弃
+    """
+    class info(object):
+        transaction_status = None
+
+    def __init__(self, bad_value: str=None):
+        self.bad_value = bad_value # rows with this value are rejected, by COPY and by INSERT
+        self.tables = {table_name: {} for table_name in TABLE_COLUMNS}
+        self.pending = []
+        self.copies = {}
+        self.schema_queries = 0
+        self.info.transaction_status = psycopg.pq.TransactionStatus.IDLE
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def upsert(self, table_name: str, record: dict) -> None:
+        self.pending.append((table_name, dict(record)))
+        return None
+
+    def commit(self) -> None:
+        for table_name, record in self.pending:
+            row = self.tables[table_name].setdefault(record[PRIMARY_KEYS[table_name]], {})
+            row.update(record)
+        self.pending = []
+        self.copies = {}
+        return None
+
+    def rollback(self) -> None:
+        self.pending = []
+        self.copies = {}
+        return None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        try:
+            yield
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+
+def newEntity(visitor_id: str, session_id: str, event_ids: list, visit_pages: int, url: str='/') -> dict:
+    """
+    构造一个会话的实体
+    :param visitor_id: 访客 ID
+    :param session_id: 会话 ID
+    :param event_ids: 事件 ID 列表
+    :param visit_pages: 访问页数
+    :param url: 事件的 url
+    :return: {'visitor': ..., 'session': ..., 'event_list': [...]}
+    """
+    return {
+        'visitor': {'visitor_id': visitor_id, 'visitor_type': 'new', '_ignored': 1},
+        'session': {'session_id': session_id, 'visitor_id': visitor_id, 'visit_pages': visit_pages},
+        'event_list': [{'event_id': event_id, 'session_id': session_id, 'url': url} for event_id in event_ids]
+    }
+
+def test_flush_dedupes_by_primary_key():
+    if psycopg is None:
+        print('skip: psycopg is not installed')
+        return
+    conn = FakeConnection()
+    sink = PGSink(conn, batch_size=10)
+    sink.add(newEntity('v1', 's1', ['e1', 'e2'], 2))
+    sink.add(newEntity('v1', 's1', ['e2', 'e3'], 3, url='/last')) # the same session, read again
+    sink.add(newEntity('v1', 's2', ['e4'], 1))
+    assert sink.flush() is True
+    assert sorted(conn.tables['visitors']) == ['v1']
+    assert conn.tables['sessions']['s1']['visit_pages'] == 3 # the last one wins
+    assert sorted(conn.tables['events']) == ['e1', 'e2', 'e3', 'e4']
+    assert conn.tables['events']['e2']['url'] == '/last'
+    assert '_ignored' not in conn.tables['visitors']['v1']
+    assert not any(sink.buffer.values())
+    # the columns are queried once per table
+    sink.add(newEntity('v2', 's3', ['e5'], 1))
+    assert sink.flush() is True
+    assert conn.schema_queries == 3
+
+def test_flush_falls_back_to_rows():
+    if psycopg is None:
+        print('skip: psycopg is not installed')
+        return
+    conn = FakeConnection(bad_value='/bad')
+    sink = PGSink(conn, batch_size=10)
+    sink.add(newEntity('v1', 's1', ['e1'], 1))
+    sink.add(newEntity('v2', 's2', ['e2'], 1, url='/bad'))
+    logging.disable(logging.CRITICAL)
+    try:
+        with contextlib.redirect_stderr(io.StringIO()):
+            result = sink.flush()
+    finally:
+        logging.disable(logging.NOTSET)
+    # the COPY batch is rolled back, then every row but the bad one is written
+    assert result is False
+    assert sorted(conn.tables['visitors']) == ['v1', 'v2']
+    assert sorted(conn.tables['sessions']) == ['s1', 's2']
+    assert sorted(conn.tables['events']) == ['e1']
+    assert not any(sink.buffer.values())
+
+
+if __name__ == '__main__':
+    test_flush_dedupes_by_primary_key()
+    test_flush_falls_back_to_rows()
+    print('ok')
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of replay.py on synthetic payloads, with the local Redis and LBS stand-ins of benchmark.py.
+
+Usage:
+    python3 test_replay.py
+    python3 -m pytest test_replay.py
+"""
+import copy
+import os
+import sys
+import tempfile
+from os.path import abspath, dirname, join
+
+sys.path.insert(0, abspath(dirname(__file__)))
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+import replay
+from benchmark import clearCaches, genPayload, installStandIns
+from raw_parser import parseRawData
+
+
+def setup():
+    """
+    使用全新的 Redis 替身, replay 模块也使用该替身
+    :return: LocalRedis
+    """
+    redis = installStandIns()
+    replay.rd = redis
+    clearCaches()
+    return redis
+
+def test_replay_serial_equals_parallel():
+    payloads = [genPayload(sessions=100, seed=seed) for seed in (7, 8, 9)]
+    setup()
+    serial = list(replay.replayPayloads(payloads, workers=1))
+    setup()
+    parallel = list(replay.replayPayloads(payloads, workers=3))
+    assert parallel == serial
+    # the first payload is replayed as a first parse on an empty state
+    setup()
+    assert serial[0] == parseRawData(payloads[0])
+
+def test_replay_does_not_modify_redis():
+    payload = genPayload(sessions=100, seed=10)
+    redis = setup()
+    redis.hashes['ip_location'] = {'1.2.3.4': '中国,广东省,广州市'}
+    redis.values['first_day_x'] = '2023-03-30'
+    values = copy.deepcopy(redis.values)
+    hashes = copy.deepcopy(redis.hashes)
+    list(replay.replayPayloads([payload, payload], workers=2))
+    assert redis.values == values
+    assert redis.hashes == hashes
+
+def test_replay_dedupes_overlapping_payloads():
+    payload = genPayload(sessions=100, seed=11)
+    changed = copy.deepcopy(payload)
+    changed['data']['items'][1][0][7] = 9999 # the newest session went on
+    setup()
+    output = join(tempfile.mkdtemp(), 'result.jsonl')
+    stats = replay.replay([payload, payload, changed], sink='jsonl', output=output, workers=1)
+    assert stats['payloads'] == 3
+    assert stats['sessions'] == 101
+    assert stats['duplicates'] == 199
+    with open(output, 'rb') as f:
+        assert len(f.readlines()) == 101
+    os.remove(output)
+
+
+if __name__ == '__main__':
+    test_replay_serial_equals_parallel()
+    test_replay_does_not_modify_redis()
+    test_replay_dedupes_overlapping_payloads()
+    print('ok')
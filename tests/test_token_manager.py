@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of TokenManager: refresh paths and the cross-process file lock.
+The token API is replaced by a local stand-in, and data.db by an in-memory store.
+
+Usage:
+    python3 test_token_manager.py
+    python3 -m pytest test_token_manager.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from os.path import abspath, dirname, join
+
+import arrow
+
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+import token_manager
+from token_manager import TokenManager
+
+MARGIN = 86400
+
+
+class FakeResponse(object):
+    def __init__(self, content: dict):
+        self.content = content
+
+    def json(self) -> dict:
+        return self.content
+
+
+class FakeTokenAPI(object):
+    """
+    token 接口替身, 记录请求次数, 每次返回新的 token
+    """
+    def __init__(self, delay: float=0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get(self, url: str, params: dict=None, timeout=None) -> FakeResponse:
+        with self.lock:
+            self.calls.append(params['grant_type'])
+            n = len(self.calls)
+        if self.delay:
+            time.sleep(self.delay)
+        return FakeResponse({'access_token': f'access_{n}', 'refresh_token': f'refresh_{n}', 'expires_in': 2592000})
+
+
+def installStore(access_token: str, expires_in: float) -> dict:
+    """
+    使用内存中的 token 信息替换 data.db
+    :param access_token: access token, 为空时表示尚未生成
+    :param expires_in: 距离过期的秒数
+    :return: token 信息字典 (与 data.db 相同的结构)
+    """
+    store = {
+        'access_token': {'value': access_token, 'expires': arrow.utcnow().timestamp() + expires_in},
+        'refresh_token': {'value': 'refresh_0' if access_token else '', 'expires': 0}
+    }
+    lock = threading.Lock()
+
+    def queryTokenInfo() -> dict:
+        with lock:
+            return {key: dict(value) for key, value in store.items()}
+
+    def saveTokenInfo(token_info: dict) -> None:
+        with lock:
+            store.update({key: dict(value) for key, value in token_info.items()})
+
+    token_manager.queryTokenInfo = queryTokenInfo
+    token_manager.saveTokenInfo = saveTokenInfo
+    return store
+
+def newManager(api: FakeTokenAPI, lock_path: str='') -> TokenManager:
+    """
+    创建独立的 TokenManager (相当于另一个进程中的实例)
+    :param api: token 接口替身
+    :param lock_path: 锁文件路径
+    :return: TokenManager
+    """
+    manager = TokenManager()
+    manager.refresh_margin = MARGIN
+    manager.sess = api
+    manager.lock_path = lock_path or join(tempfile.mkdtemp(), 'token.lock')
+    return manager
+
+def test_ensure_token_within_margin_does_not_block():
+    installStore('access_0', MARGIN / 2)
+    api = FakeTokenAPI()
+    manager = newManager(api)
+    assert manager.ensureToken() == 'access_0'
+    assert api.calls == [] # left to the background thread
+    assert not manager.isFresh()
+
+def test_ensure_token_refreshes_expired_token():
+    store = installStore('access_0', -10)
+    api = FakeTokenAPI()
+    manager = newManager(api)
+    assert manager.ensureToken() == 'access_1'
+    assert api.calls == ['refresh_token']
+    assert store['access_token']['value'] == 'access_1'
+    assert manager.isFresh()
+
+def test_ensure_token_generates_missing_token():
+    installStore('', 0)
+    api = FakeTokenAPI()
+    manager = newManager(api)
+    assert manager.ensureToken() == 'access_1'
+    assert api.calls == ['authorization_code']
+
+def test_gen_token_force():
+    installStore('access_0', MARGIN * 2)
+    api = FakeTokenAPI()
+    manager = newManager(api)
+    assert manager.genToken() == {}
+    assert api.calls == []
+    manager.genToken(force=True)
+    assert api.calls == ['authorization_code']
+    assert manager.access_token == 'access_1'
+
+def test_run_refreshes_within_margin():
+    installStore('access_0', MARGIN / 2)
+    api = FakeTokenAPI()
+    manager = newManager(api)
+    sleeps = []
+
+    class Stop(Exception):
+        pass
+
+    def sleep(seconds: float) -> None:
+        sleeps.append(seconds)
+        raise Stop()
+
+    # token_manager.time is the time module, restored below
+    token_manager.time.sleep, real_sleep = sleep, token_manager.time.sleep
+    try:
+        manager.run()
+    except Stop:
+        pass
+    finally:
+        token_manager.time.sleep = real_sleep
+    assert api.calls == ['refresh_token']
+    assert manager.access_token == 'access_1'
+    assert sleeps and sleeps[0] > 0 # then waits for the next refresh
+
+def test_file_lock_single_refresh():
+    if token_manager.fcntl is None:
+        return None
+    store = installStore('access_0', -10)
+    api = FakeTokenAPI(delay=0.1)
+    lock_path = join(tempfile.mkdtemp(), 'token.lock')
+    # separate instances do not share the thread lock, only the file lock serializes them
+    managers = [newManager(api, lock_path) for _ in range(4)]
+    threads = [threading.Thread(target=manager.refreshAccessToken) for manager in managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert api.calls == ['refresh_token'] # the others reuse the token saved by the first one
+    assert all(manager.access_token == 'access_1' for manager in managers)
+    assert store['access_token']['value'] == 'access_1'
+    assert os.path.exists(lock_path)
+
+
+if __name__ == '__main__':
+    test_ensure_token_within_margin_does_not_block()
+    test_ensure_token_refreshes_expired_token()
+    test_ensure_token_generates_missing_token()
+    test_gen_token_force()
+    test_run_refreshes_within_margin()
+    test_file_lock_single_refresh()
+    print('ok')
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Tests of the helpers in package/utils.py, without Redis or network requests.
+
+Usage:
+    python3 test_utils.py
+    python3 -m pytest test_utils.py
+"""
+import contextlib
+import glob
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+from os.path import abspath, dirname, join
+
+import arrow
+
+sys.path.insert(0, abspath(dirname(__file__)))
+sys.path.insert(0, abspath(join(dirname(__file__), '../package')))
+
+import utils
+
+
+"""
+time parsing
+"""
+def arrowTime(start_time: str) -> tuple:
+    """
+    使用 arrow 处理时间信息 (原实现), 作为对照
+    :param start_time: 开始时间
+    :return: 时间信息元组
+    """
+    try:
+        start_time = arrow.get(start_time).format('YYYY-MM-DD HH:mm:ss')
+    except:
+        start_time = f'{arrow.now().format("YYYY-MM-DD")} {start_time}'
+    start_time = arrow.get(start_time).format('YYYY-MM-DD HH:mm:ss')
+    return (start_time, start_time, arrow.get(start_time).timestamp())
+
+def test_get_time_matches_arrow():
+    start_times = [
+        '2023/03/30 07:56:57', '2023-03-30 07:56:57', '2024/02/29 23:59:59', '1999-12-31 00:00:00', '2038/01/19 03:14:08',
+        '07:56:57', '00:00:00', '2023-03-30T07:56:57', '2023-03-30 07:56', '2023/03/30 24:00:00'
+    ]
+    for start_time in start_times:
+        assert utils.getTime(start_time) == arrowTime(start_time), start_time
+    assert utils.getTimes(start_times) == [arrowTime(start_time) for start_time in start_times]
+    # invalid dates are rejected as before
+    for start_time in ['2023/02/30 07:56:57', '2023/13/01 07:56:57', '2023/03/30 07:60:00']:
+        try:
+            utils.getTime(start_time)
+        except Exception:
+            pass
+        else:
+            raise AssertionError(start_time)
+
+
+"""
+divisions (gazetteer)
+"""
+PROVINCES = [('11', '北京市'), ('22', '吉林省'), ('42', '湖北省'), ('44', '广东省')]
+CITIES = [('1101', '市辖区'), ('2201', '长春市'), ('4201', '武汉市'), ('4401', '广州市'), ('4403', '深圳市'), ('4404', '珠海市')]
+AREAS = [('110105', '朝阳区', '11'), ('220104', '朝阳区', '22'), ('429004', '仙桃市', '42'), ('440106', '天河区', '44'), ('440402', '香洲区', '44')]
+
+class FakePageCache(object):
+    """
+    PageCache 替身, 记录 IP 定位的调用
+    """
+    def __init__(self, lbs_results: dict=None):
+        self.lbs_results = lbs_results or {}
+        self.locations = {}
+        self.calls = []
+
+    def getLocation(self, ip: str) -> str:
+        self.calls.append(('getLocation', ip))
+        return self.locations.get(ip)
+
+    def getLBS(self, ip: str) -> dict:
+        self.calls.append(('getLBS', ip))
+        return self.lbs_results[ip]
+
+    def setLocation(self, ip: str, location: str) -> None:
+        self.locations[ip] = location
+        return None
+
+@contextlib.contextmanager
+def divisions():
+    """
+    使用测试用的行政区划数据
+    :return: 上下文管理器
+    """
+    real_divisions, utils.DIVISIONS = utils.DIVISIONS, utils.buildDivisions(PROVINCES, CITIES, AREAS)
+    try:
+        yield utils.DIVISIONS
+    finally:
+        utils.DIVISIONS = real_divisions
+
+def test_divisions_match_like_query():
+    # the index must give the same unique matches as the former LIKE '%name%' queries
+    con = sqlite3.connect(':memory:')
+    con.execute('CREATE TABLE city (code TEXT, name TEXT)')
+    con.execute('CREATE TABLE area (code TEXT, name TEXT, provinceCode TEXT)')
+    con.executemany('INSERT INTO city VALUES (?, ?)', CITIES)
+    con.executemany('INSERT INTO area VALUES (?, ?, ?)', AREAS)
+    names = {name[i:j] for _, name, *_ in CITIES + AREAS for i in range(len(name)) for j in range(i + 1, len(name) + 1)}
+    with divisions() as index:
+        for name in sorted(names) + ['西安', '南']:
+            rows = con.execute('SELECT name, code FROM city WHERE name LIKE ?', (f'%{name}%',)).fetchall()
+            if not rows:
+                rows = con.execute('SELECT name, code FROM area WHERE name LIKE ?', (f'%{name}%',)).fetchall()
+            expected = rows[0] if len(rows) == 1 else None
+            assert index['unique'].get(name) == expected, name
+    con.close()
+
+def test_query_division():
+    cache = FakePageCache({
+        '1.2.3.4': {'country': '中国', 'province': '吉林', 'provinceCode': '22', 'city': '朝阳', 'cityCode': '2299'},
+    })
+    with divisions():
+        # a unique name needs no IP lookup
+        assert utils.queryDivision('广州', '5.6.7.8', cache) == ('中国', '广东省', '广州市')
+        assert utils.queryDivision('仙桃', '5.6.7.8', cache) == ('中国', '湖北省', '仙桃市')
+        assert utils.queryDivision('北京', '5.6.7.8', cache) == ('中国', '北京市', '北京市')
+        assert cache.calls == []
+        # an ambiguous name is located by IP, then normalized by the gazetteer
+        assert utils.queryDivision('朝阳', '1.2.3.4', cache) == ('中国', '吉林省', '朝阳区')
+        assert cache.calls == [('getLocation', '1.2.3.4'), ('getLBS', '1.2.3.4')]
+        assert cache.locations['1.2.3.4'] == '中国,吉林省,朝阳区'
+        # the saved location is used next time
+        assert utils.queryDivision('朝阳', '1.2.3.4', cache) == ('中国', '吉林省', '朝阳区')
+        assert cache.calls[-1] == ('getLocation', '1.2.3.4')
+
+
+"""
+ip database (lbs.ip_database)
+"""
+IP_DATABASE_CSV = """start_ip,end_ip,country,province,provinceCode,city,cityCode
+# comment
+1.0.1.0,1.0.3.255,中国,福建省,35,福州市,3501
+16843008,16843263,中国,广东省,44,广州市,4401
+1.0.8.0,1.0.15.255,中国,广东省,44,深圳市,4403
+"""
+
+@contextlib.contextmanager
+def ipDatabase(content: str=None):
+    """
+    使用临时的 IP 地址库
+    :param content: csv 内容, 为 None 时使用不存在的文件
+    :return: 上下文管理器
+    """
+    path = join(tempfile.mkdtemp(), 'ip_database.csv')
+    if content is not None:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    config = dict(utils.CONFIG['lbs'])
+    utils.CONFIG['lbs']['ip_database'] = path
+    utils.IP_DATABASE = None
+    try:
+        yield path
+    finally:
+        utils.CONFIG['lbs'].clear()
+        utils.CONFIG['lbs'].update(config)
+        utils.IP_DATABASE = None
+
+def test_ip_database_range_lookup():
+    with ipDatabase(IP_DATABASE_CSV):
+        assert utils.queryIPDatabase('1.0.1.0')['city'] == '福州市' # first address of a range
+        assert utils.queryIPDatabase('1.0.3.255')['city'] == '福州市' # last address
+        assert utils.queryIPDatabase('1.1.1.1')['city'] == '广州市' # integer range
+        assert utils.queryIPDatabase('1.0.9.9')['cityCode'] == '4403'
+        assert utils.queryIPDatabase('1.0.4.0') is None # between two ranges
+        assert utils.queryIPDatabase('0.255.255.255') is None # before the first range
+        assert utils.queryIPDatabase('9.9.9.9') is None # after the last range
+        assert utils.queryIPDatabase('not an ip') is None
+        assert utils.queryIPDatabase('1.0.1.1')['lbs_service'] == 'local'
+
+def test_ip_database_missing_file_logged_once():
+    with ipDatabase(None) as path:
+        stderr = io.StringIO()
+        stdout = io.StringIO()
+        with contextlib.redirect_stderr(stderr), contextlib.redirect_stdout(stdout):
+            results = [utils.queryIPDatabase('1.0.1.1') for _ in range(5)]
+        assert results == [None] * 5
+        assert stderr.getvalue().count('Traceback') == 1
+        assert stdout.getvalue().count(path) == 1
+
+def test_resolve_locations_local_first():
+    calls = []
+    lock = threading.Lock()
+
+    def remote(ip: str) -> dict:
+        with lock:
+            calls.append(ip)
+        return {'country': '', 'province': '', 'provinceCode': '', 'city': '', 'cityCode': '', 'lbs_service': 'remote'}
+
+    real_lbs, utils.lbs = utils.lbs, remote
+    real_pool = utils.ThreadPoolExecutor
+    try:
+        with ipDatabase(IP_DATABASE_CSV):
+            # every IP is in the local database, no thread pool and no online lookup
+            utils.ThreadPoolExecutor = None
+            result = utils.resolveLocations(['1.0.1.1', '1.1.1.1', '1.0.1.1'], workers=4)
+            assert sorted(result) == ['1.0.1.1', '1.1.1.1']
+            assert result['1.1.1.1']['city'] == '广州市'
+            assert calls == []
+            # only the misses fall back to the online services
+            utils.ThreadPoolExecutor = real_pool
+            result = utils.resolveLocations(['1.0.1.1', '8.8.8.8', '9.9.9.9', '8.8.8.8'], workers=4)
+            assert result['1.0.1.1']['lbs_service'] == 'local'
+            assert result['8.8.8.8']['lbs_service'] == 'remote'
+            assert sorted(calls) == ['8.8.8.8', '9.9.9.9']
+    finally:
+        utils.lbs = real_lbs
+        utils.ThreadPoolExecutor = real_pool
+
+
+"""
+raw data archive
+"""
+@contextlib.contextmanager
+def archive(compression: str):
+    """
+    使用临时目录启用原始数据归档
+    :param compression: gzip 或 zstd
+    :return: 上下文管理器, 返回归档目录
+    """
+    path = tempfile.mkdtemp()
+    config = dict(utils.CONFIG['archive'])
+    utils.CONFIG['archive'].update({'enable': True, 'path': path, 'compression': compression, 'batch_size': 2})
+    utils.ARCHIVE_WRITER = None
+    try:
+        yield path
+    finally:
+        if utils.ARCHIVE_WRITER is not None:
+            utils.ARCHIVE_WRITER.close()
+        utils.ARCHIVE_WRITER = None
+        utils.CONFIG['archive'].clear()
+        utils.CONFIG['archive'].update(config)
+
+def saveAndRead(path: str) -> tuple:
+    """
+    写入 3 份原始数据 (可能分为多个压缩块), 再读回
+    :param path: 归档目录
+    :return: ([(文件名, [content, ...]), ...], 写入的 contents)
+    """
+    contents = [{'data': {'total': i, 'items': [[{'id': str(i)}], ['中文']]}} for i in range(3)]
+    for content in contents:
+        utils.saveRawData('16847648', content)
+    utils.getArchiveWriter().flush()
+    files = sorted(glob.glob(join(path, '16847648', '*')))
+    return [(os.path.basename(file), [record['content'] for record in utils.readArchive(file)]) for file in files], contents
+
+def test_archive_gzip_round_trip():
+    with archive('gzip') as path:
+        files, contents = saveAndRead(path)
+    assert len(files) == 1 # unless the test runs across the hour
+    assert files[0][0].endswith('.jsonl.gz')
+    assert files[0][1] == contents
+
+def test_archive_zstd_round_trip():
+    if utils.zstandard is None:
+        print('skip: zstandard is not installed')
+        return
+    with archive('zstd') as path:
+        files, contents = saveAndRead(path)
+    assert len(files) == 1
+    assert files[0][0].endswith('.jsonl.zst')
+    assert files[0][1] == contents
+
+def test_archive_zstd_fallback():
+    real_zstandard, utils.zstandard = utils.zstandard, None
+    out = io.StringIO()
+    try:
+        with archive('zstd') as path, contextlib.redirect_stdout(out):
+            files, contents = saveAndRead(path)
+    finally:
+        utils.zstandard = real_zstandard
+    assert 'fall back to gzip' in out.getvalue()
+    assert len(files) == 1
+    assert files[0][0].endswith('.jsonl.gz')
+    assert files[0][1] == contents
+
+
+"""
+negative cache (lbs)
+"""
+def test_negative_cache_order_and_purge():
+    real_time = utils.time.time
+    now = [1000.0]
+    utils.time.time = lambda: now[0]
+    utils.LBS_NEGATIVE_CACHE.clear()
+    ttl = utils.CONFIG['lbs']['negative_ttl']
+    try:
+        utils.addNegativeCache('1.1.1.1', limit=3)
+        now[0] += 1
+        utils.addNegativeCache('2.2.2.2', limit=3)
+        now[0] += 1
+        # a re-inserted IP moves to the end with its new expiry
+        utils.addNegativeCache('1.1.1.1', limit=3)
+        assert list(utils.LBS_NEGATIVE_CACHE) == ['2.2.2.2', '1.1.1.1']
+        assert utils.LBS_NEGATIVE_CACHE['1.1.1.1'] == now[0] + ttl
+        now[0] += 1
+        utils.addNegativeCache('3.3.3.3', limit=3)
+        utils.addNegativeCache('4.4.4.4', limit=3)
+        # over the limit, the entry closest to expiry goes first
+        assert list(utils.LBS_NEGATIVE_CACHE) == ['1.1.1.1', '3.3.3.3', '4.4.4.4']
+        # expired entries are purged on insert, even below the limit
+        now[0] += ttl - 0.5
+        utils.addNegativeCache('5.5.5.5', limit=10)
+        assert list(utils.LBS_NEGATIVE_CACHE) == ['3.3.3.3', '4.4.4.4', '5.5.5.5']
+    finally:
+        utils.time.time = real_time
+        utils.LBS_NEGATIVE_CACHE.clear()
+
+
+"""
+source category
+"""
+@contextlib.contextmanager
+def sourceCategory(categories: dict):
+    """
+    使用测试用的流量渠道分类
+    :param categories: {来源域名/品牌: 分类}
+    :return: 上下文管理器, 返回加载次数列表
+    """
+    loads = []
+    def load() -> dict:
+        loads.append(1)
+        return dict(categories)
+
+    real_load, utils.loadSourceCategory = utils.loadSourceCategory, load
+    real_category, utils.SOURCE_CATEGORY = utils.SOURCE_CATEGORY, None
+    utils.querySourceCategory.cache_clear()
+    try:
+        yield loads
+    finally:
+        utils.loadSourceCategory = real_load
+        utils.SOURCE_CATEGORY = real_category
+        utils.querySourceCategory.cache_clear()
+
+def test_query_source_category():
+    categories = {'zhuanlan.zhihu.com': 'SOURCE_CATEGORY_SOCIAL', 'zhihu.com': 'SOURCE_CATEGORY_SEARCH', 'weibo': 'SOURCE_CATEGORY_SOCIAL', 'sina.com.cn': 'SOURCE_CATEGORY_VIDEO'}
+    with sourceCategory(categories) as loads:
+        # full host, then second-level domain, then brand
+        assert utils.querySourceCategory('zhuanlan.zhihu.com') == 'SOURCE_CATEGORY_SOCIAL'
+        assert utils.querySourceCategory('www.zhihu.com') == 'SOURCE_CATEGORY_SEARCH'
+        assert utils.querySourceCategory('link.zhihu.com') == 'SOURCE_CATEGORY_SEARCH' # redirect prefix removed
+        assert utils.querySourceCategory('m.weibo.cn') == 'SOURCE_CATEGORY_SOCIAL'
+        assert utils.querySourceCategory('news.sina.com.cn') == 'SOURCE_CATEGORY_VIDEO'
+        assert utils.querySourceCategory('example.org') == ''
+        assert len(loads) == 1 # loaded once
+        # reloading picks up changes to the table, and clears the cached matches
+        categories['example.org'] = 'SOURCE_CATEGORY_SHOPPING'
+        assert utils.querySourceCategory('example.org') == ''
+        utils.reloadSourceCategory()
+        assert utils.querySourceCategory('example.org') == 'SOURCE_CATEGORY_SHOPPING'
+        assert len(loads) == 2
+
+
+"""
+url parsing (parseUrl cache)
+"""
+def test_parse_url_cache_is_read_only():
+    url = 'https://www.example.com/list?utm_source=news&activity_id=42&q=shoes'
+    utils.parseUrl.cache_clear()
+    parsed = utils.parseUrl(url)
+    for mapping in (parsed.query_params, parsed.tracking_params, parsed.tracking_params['ct_params']):
+        try:
+            mapping['utm_source'] = 'changed'
+        except TypeError:
+            pass
+        else:
+            raise AssertionError('cached parameters must be read-only')
+    # the copies can be changed without touching the cached result
+    tracking_params = utils.parsetracking_arams(url)
+    tracking_params['utm_source'] = 'changed'
+    tracking_params['ct_params']['activity_id'] = 'changed'
+    again = utils.parsetracking_arams(url)
+    assert again['utm_source'] == 'news'
+    assert again['ct_params']['activity_id'] == '42'
+    assert utils.parseUrl(url) is parsed
+
+
+if __name__ == '__main__':
+    test_get_time_matches_arrow()
+    test_divisions_match_like_query()
+    test_query_division()
+    test_ip_database_range_lookup()
+    test_ip_database_missing_file_logged_once()
+    test_resolve_locations_local_first()
+    test_archive_gzip_round_trip()
+    test_archive_zstd_round_trip()
+    test_archive_zstd_fallback()
+    test_negative_cache_order_and_purge()
+    test_query_source_category()
+    test_parse_url_cache_is_read_only()
+    print('ok')